@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class BookmarkCache:
+    """
+    Bounded LRU cache of serialized bookmarks (the dicts the API returns) keyed by id.
+
+    Entries expire ttl seconds after they were stored; when the cache is full the
+    least recently used entry is evicted. The cache is shared between requests,
+    so every operation takes a lock.
+
+    A reader that misses takes version() before reading the database and
+    passes it to put, which drops the entry if an invalidation came in
+    meanwhile: the row read may be from before the write that invalidated it.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped by every invalidate and clear
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, id: int) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, bookmark = entry
+            if expires_at <= self.clock():
+                del self._entries[id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(id)
+            self.hits += 1
+
+        # handing out a copy so callers can't change what is cached
+        return dict(bookmark)
+
+    def version(self) -> int:
+        return self._version
+
+    def put(self, id: int, bookmark: dict, version: Optional[int] = None) -> None:
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            if version is not None and version != self._version:
+                # possibly stale, the next read fills it
+                return
+            self._entries[id] = (self.clock() + self.ttl, dict(bookmark))
+            self._entries.move_to_end(id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *ids: int) -> None:
+        with self._lock:
+            self._version += 1
+            for id in ids:
+                if self._entries.pop(id, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._version += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                size=len(self._entries),
+                max_size=self.max_size,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                expirations=self.expirations,
+                invalidations=self.invalidations,
+            )
@@ -0,0 +1,133 @@
+"""
+Streaming writers for bookmark exports. Each takes the read-model rows from
+the repository (see serializers.COLUMNS) and yields the file as bytes, a few
+thousand rows at a time, so an export of any size is written in constant memory.
+
+- ndjson: one JSON object per line, what the API sends for a bookmark
+- csv: a header line, then one line per bookmark
+- columnar: JSON lines, a header with the column names and then one line per
+  block of rows holding a list of values per column, which is compact and
+  quick to load into dataframes
+"""
+import csv
+import io
+import zlib
+from typing import Iterable, Iterator
+
+from barkylib.adapters import serializers
+
+FORMATS = ('ndjson', 'csv', 'columnar')
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'columnar': 'application/x-ndjson',
+}
+EXTENSIONS = {
+    'ndjson': '.ndjson',
+    'csv': '.csv',
+    'columnar': '.columnar.jsonl',
+}
+# rows that go into one chunk of output, and one block of the columnar format
+ROWS_PER_CHUNK = 1000
+COLUMNAR_VERSION = 1
+
+
+def detect_format(format: str = None, filename: str = None) -> tuple[str, bool]:
+    """
+    The format and whether to gzip it, from the name of the file being written
+    unless the format is given
+    """
+    compress = bool(filename) and filename.lower().endswith('.gz')
+    if format is None and filename:
+        name = filename.lower()[:-3] if compress else filename.lower()
+        format = next((f for f, extension in EXTENSIONS.items() if name.endswith(extension)), None)
+        if format is None and name.endswith('.jsonl'):
+            format = 'ndjson'
+    if format not in FORMATS:
+        raise ValueError(f"Can't tell the export format, pass one of {', '.join(FORMATS)}")
+    return format, compress
+
+
+def write(rows: Iterable, format: str, rows_per_chunk: int = ROWS_PER_CHUNK) -> Iterator[bytes]:
+    return WRITERS[format](rows, rows_per_chunk)
+
+
+def write_ndjson(rows: Iterable, rows_per_chunk: int) -> Iterator[bytes]:
+    chunk = list()
+    for row in rows:
+        chunk.append(serializers.dumps(serializers.row_to_dict(row)))
+        if len(chunk) >= rows_per_chunk:
+            yield b'\n'.join(chunk) + b'\n'
+            chunk = list()
+    if chunk:
+        yield b'\n'.join(chunk) + b'\n'
+
+
+def write_csv(rows: Iterable, rows_per_chunk: int) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(serializers.COLUMNS)
+    count = 0
+    for row in rows:
+        id, title, url, notes, date_added, date_edited = row
+        writer.writerow((
+            id,
+            title,
+            url,
+            notes,
+            serializers.format_datetime(date_added),
+            serializers.format_datetime(date_edited),
+        ))
+        count += 1
+        if count >= rows_per_chunk:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def write_columnar(rows: Iterable, rows_per_chunk: int) -> Iterator[bytes]:
+    yield serializers.dumps({
+        'format': 'barky-columnar',
+        'version': COLUMNAR_VERSION,
+        'columns': serializers.COLUMNS,
+    }) + b'\n'
+
+    block = [list() for _ in serializers.COLUMNS]
+    for row in rows:
+        for values, value in zip(block, row):
+            values.append(value)
+        if len(block[0]) >= rows_per_chunk:
+            yield columnar_block(block)
+            block = [list() for _ in serializers.COLUMNS]
+    if block[0]:
+        yield columnar_block(block)
+
+
+def columnar_block(block: list[list]) -> bytes:
+    columns = dict(zip(serializers.COLUMNS, block))
+    for name in serializers.DATE_COLUMNS:
+        columns[name] = [serializers.format_datetime(value) for value in columns[name]]
+    return serializers.dumps(columns) + b'\n'
+
+
+WRITERS = {
+    'ndjson': write_ndjson,
+    'csv': write_csv,
+    'columnar': write_columnar,
+}
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """
+    Compresses a stream of chunks into one gzip file as it goes
+    """
+    # 16 + MAX_WBITS writes the gzip header and trailer instead of zlib's
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
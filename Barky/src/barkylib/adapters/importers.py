@@ -0,0 +1,178 @@
+"""
+Streaming readers for bookmark files: NDJSON, CSV and the Netscape bookmark
+HTML that browsers export.
+
+read_records takes a binary file object and yields (line, record) pairs one at
+a time, where record is a dict of Bookmark fields or the exception that made
+the line unreadable, so files of any size are read in constant memory.
+to_row validates a record and turns it into the columns of a new bookmark.
+"""
+import csv
+import html
+import io
+import re
+from datetime import datetime
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+from barkylib.adapters import serializers
+from barkylib.domain.models import Bookmark
+
+FORMATS = ('ndjson', 'csv', 'html')
+CONTENT_TYPES = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+    'text/html': 'html',
+}
+EXTENSIONS = {
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+    '.html': 'html',
+    '.htm': 'html',
+}
+# the size of the title and url columns
+MAX_LENGTH = 255
+
+# <DT><A HREF="..." ADD_DATE="..." LAST_MODIFIED="...">title</A>, then maybe <DD>notes
+NETSCAPE_LINK = re.compile(r'<DT><A\s+([^>]*)>(.*?)</A>', re.IGNORECASE)
+NETSCAPE_ATTRIBUTE = re.compile(r'([A-Z_]+)\s*=\s*"([^"]*)"', re.IGNORECASE)
+NETSCAPE_NOTES = re.compile(r'^\s*<DD>(.*)', re.IGNORECASE)
+TAG = re.compile(r'<[^>]+>')
+# a scheme and a host, e.g. http://example.com; cheaper than urlsplit per row
+URL = re.compile(r'^[A-Za-z][A-Za-z0-9+.-]*://[^/?#\s]+')
+
+
+def detect_format(format: str = None, content_type: str = None, filename: str = None) -> str:
+    """
+    An explicit format wins, then the content type, then the file extension
+    """
+    if format is None and content_type:
+        format = CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+    if format is None and filename:
+        format = EXTENSIONS.get(filename[filename.rfind('.'):].lower()) if '.' in filename else None
+    if format not in FORMATS:
+        raise ValueError(f"Can't tell the file format, pass one of {', '.join(FORMATS)}")
+    return format
+
+
+def read_records(stream: BinaryIO, format: str) -> Iterator[tuple[int, object]]:
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    return READERS[format](lines)
+
+
+def read_ndjson(lines: Iterable[str]) -> Iterator[tuple[int, object]]:
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = serializers.loads(line)
+        except ValueError as e:
+            yield number, ValueError(f"invalid JSON: {e}")
+            continue
+        if isinstance(record, dict):
+            yield number, record
+        else:
+            yield number, ValueError("expected a JSON object")
+
+
+def read_csv(lines: Iterable[str]) -> Iterator[tuple[int, object]]:
+    reader = csv.DictReader(lines)
+    try:
+        for row in reader:
+            # columns past the header end up under None
+            row.pop(None, None)
+            yield reader.line_num, row
+    except csv.Error as e:
+        yield reader.line_num, ValueError(f"invalid CSV: {e}")
+
+
+def read_netscape(lines: Iterable[str]) -> Iterator[tuple[int, object]]:
+    pending = None
+    for number, line in enumerate(lines, start=1):
+        link = NETSCAPE_LINK.search(line)
+        if link:
+            if pending is not None:
+                yield pending
+            attributes = {
+                name.lower(): html.unescape(value)
+                for name, value in NETSCAPE_ATTRIBUTE.findall(link.group(1))
+            }
+            pending = number, {
+                'title': html.unescape(TAG.sub('', link.group(2))),
+                'url': attributes.get('href'),
+                'date_added': attributes.get('add_date'),
+                'date_edited': attributes.get('last_modified'),
+            }
+            continue
+
+        notes = NETSCAPE_NOTES.match(line)
+        if notes and pending is not None:
+            pending[1]['notes'] = html.unescape(TAG.sub('', notes.group(1))).strip()
+            yield pending
+            pending = None
+
+    if pending is not None:
+        yield pending
+
+
+READERS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+    'html': read_netscape,
+}
+
+
+def to_bookmark(record: dict, now: datetime) -> Bookmark:
+    return Bookmark(id=None, **to_row(record, now))
+
+
+def to_row(record: dict, now: datetime) -> dict:
+    """
+    Validates a record and returns the columns of a new bookmark. Ids in the
+    file are ignored, imported bookmarks always get new ones.
+    """
+    title = clean(record.get('title'))
+    url = clean(record.get('url'))
+    if not title:
+        raise ValueError("title is required")
+    if len(title) > MAX_LENGTH:
+        raise ValueError(f"title is longer than {MAX_LENGTH} characters")
+    if not url:
+        raise ValueError("url is required")
+    if len(url) > MAX_LENGTH:
+        raise ValueError(f"url is longer than {MAX_LENGTH} characters")
+    if not URL.match(url):
+        raise ValueError(f"invalid url {url}")
+
+    date_added = parse_date(record.get('date_added'), now)
+    return {
+        'title': title,
+        'url': url,
+        'notes': clean(record.get('notes')),
+        'date_added': date_added,
+        'date_edited': parse_date(record.get('date_edited'), date_added),
+    }
+
+
+def clean(value) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def parse_date(value, default: datetime) -> datetime:
+    """
+    ISO 8601 text, or seconds since the epoch like browsers export
+    """
+    if value is None or value == '':
+        return default
+    if isinstance(value, datetime):
+        return value
+    try:
+        if isinstance(value, (int, float)) or value.isdigit():
+            return datetime.fromtimestamp(int(value))
+        return datetime.fromisoformat(value)
+    except (ValueError, OverflowError, OSError, AttributeError):
+        raise ValueError(f"invalid date {value}")
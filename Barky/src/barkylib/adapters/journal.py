@@ -0,0 +1,122 @@
+"""
+Append-only journal of bookmark rows waiting to be written to the database,
+for services/write_behind.py.
+
+The journal is a directory of segment files, journal-<number>.ndjson, one
+row (a dict of add_rows columns) per line. Rows go to the newest segment
+with one os.write each, so a row is in the operating system's hands, and
+survives the process crashing, by the time append returns; with fsync=True
+it is on disk and survives a power loss too, at the cost of an fsync per row.
+
+seal() closes the current segment and starts the next one. Whoever sealed
+it writes its rows to the database and then remove()s the file, so the
+segments left in the directory at startup hold every row that may not have
+reached the database.
+
+Rows the database refused for good are appended to dead-letters.ndjson,
+with the error, for someone to look at.
+
+A directory belongs to one process: another's journal would number its
+segments the same, and replay, or remove, the ones still being written.
+Journal takes an exclusive flock on the directory and raises RuntimeError
+if it is held, so each worker of a multi-process server needs a directory
+of its own. The lock goes with the process, a crashed one doesn't keep it.
+"""
+import fcntl
+import os
+import re
+from datetime import datetime
+from typing import Iterator, Optional
+
+from barkylib.adapters import serializers
+
+SEGMENT = re.compile(r"^journal-(\d+)\.ndjson$")
+DEAD_LETTERS = "dead-letters.ndjson"
+DATE_COLUMNS = ("date_added", "date_edited")
+
+
+class Journal:
+    def __init__(self, directory: str, fsync: bool = False) -> None:
+        self.directory = directory
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self._lock = os.open(directory, os.O_RDONLY)
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self._lock)
+            raise RuntimeError(f"The journal {directory} is in use by another process")
+        existing = self.segments()
+        self.number = existing[-1] + 1 if existing else 1
+        self._fd = None
+
+    def path(self, number: int) -> str:
+        return os.path.join(self.directory, f"journal-{number:012d}.ndjson")
+
+    def segments(self) -> list[int]:
+        """
+        Numbers of the segment files in the directory, oldest first
+        """
+        numbers = [int(match.group(1)) for match in map(SEGMENT.match, os.listdir(self.directory)) if match]
+        return sorted(numbers)
+
+    def append(self, rows: list[dict]) -> None:
+        if self._fd is None:
+            self._fd = os.open(self.path(self.number), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        os.write(self._fd, b"".join(serializers.dumps(row) + b"\n" for row in rows))
+        if self.fsync:
+            os.fsync(self._fd)
+
+    def seal(self) -> Optional[int]:
+        """
+        Closes the current segment and returns its number, None when nothing
+        was appended to it. The next append starts a new segment.
+        """
+        if self._fd is None:
+            return None
+        os.close(self._fd)
+        self._fd = None
+        number = self.number
+        self.number += 1
+        return number
+
+    def remove(self, number: int) -> None:
+        try:
+            os.remove(self.path(number))
+        except FileNotFoundError:
+            pass
+
+    def dead_letter(self, row: dict, error: Exception) -> None:
+        line = serializers.dumps(dict(row=row, error=str(error))) + b"\n"
+        fd = os.open(os.path.join(self.directory, DEAD_LETTERS), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, line)
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def read(self, number: int) -> Iterator[dict]:
+        """
+        The rows of a segment. A process that died mid-write can leave a
+        partial last line, which is skipped.
+        """
+        with open(self.path(number), "rb") as file:
+            for line in file:
+                try:
+                    row = serializers.loads(line)
+                except ValueError:
+                    continue
+                for column in DATE_COLUMNS:
+                    if isinstance(row.get(column), str):
+                        row[column] = datetime.fromisoformat(row[column])
+                yield row
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        if self._lock is not None:
+            # closing the descriptor releases the flock
+            os.close(self._lock)
+            self._lock = None
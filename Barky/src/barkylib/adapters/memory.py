@@ -0,0 +1,719 @@
+"""
+InMemoryRepository: all of AbstractRepository over bookmarks kept in memory,
+as a test double that needs no database and as a read store for deployments
+small enough to hold every bookmark.
+
+The rows live in a BookmarkTable, as tuples in serializers.COLUMNS order, so
+find_rows hands them out as they are. The table keeps
+- hash indexes: id -> row, title -> id (titles are unique, like the column)
+  and url -> ids
+- sorted indexes on id, title, date_added and date_edited: lists of
+  (has a value, value, id) keys kept in order with bisect, NULLs first like
+  sqlite sorts them
+
+Queries are the select(Bookmark) statements SqlAlchemyRepository takes
+(handlers.get_query, page_query, ...). Their WHERE clause becomes a Python
+predicate, and the rows to test come from the cheapest index that applies:
+an equality or IN on a hashed column, then a comparison on a sorted one.
+With neither, rows are read in ORDER BY order off a sorted index and reading
+stops once LIMIT rows have matched. Clauses it doesn't understand raise
+NotImplementedError instead of quietly matching the wrong rows.
+"""
+import operator
+import re
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.instrumentation import opt_manager_of_class
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import (
+    BinaryExpression,
+    BindParameter,
+    BooleanClauseList,
+    False_,
+    Grouping,
+    Null,
+    True_,
+    Tuple,
+    UnaryExpression,
+)
+
+from barkylib.adapters import serializers
+from barkylib.adapters.repository import (
+    DEFAULT_PAGE_SIZE,
+    DEFAULT_UPSERT_COLUMNS,
+    SNIPPET_MARKS,
+    STREAM_BATCH_SIZE,
+    UPDATABLE_COLUMNS,
+    AbstractRepository,
+    bookmark_id,
+    delete_ids,
+    next_page,
+    page_query,
+    upsert_columns,
+    upsert_date_edited,
+    upsert_writes,
+)
+from barkylib.domain.models import Bookmark
+
+POSITIONS = {column: position for position, column in enumerate(serializers.COLUMNS)}
+HASHED_COLUMNS = ('id', 'title', 'url')
+SORTED_COLUMNS = ('id', 'title', 'date_added', 'date_edited')
+# columns a new row has to have, NOT NULL in adapters/orm.py
+REQUIRED_COLUMNS = ('title', 'url')
+COMPARISONS = {
+    operators.eq: operator.eq,
+    operators.ne: operator.ne,
+    operators.lt: operator.lt,
+    operators.le: operator.le,
+    operators.gt: operator.gt,
+    operators.ge: operator.ge,
+}
+# sorts after every id in an index key
+LAST = float('inf')
+# words around the first match in a search snippet, like snippet(..., 12)
+SNIPPET_WORDS = 12
+
+
+class SortedIndex:
+    def __init__(self, column: str) -> None:
+        self.column = column
+        self.position = POSITIONS[column]
+        self.keys = list()
+
+    def key(self, row: tuple) -> tuple:
+        value = row[self.position]
+        return value is not None, value, row[0]
+
+    def add(self, row: tuple) -> None:
+        key = self.key(row)
+        # ids and dates mostly arrive in order
+        if not self.keys or key > self.keys[-1]:
+            self.keys.append(key)
+        else:
+            insort(self.keys, key)
+
+    def add_many(self, rows: list[tuple]) -> None:
+        if len(rows) < 64:
+            for row in rows:
+                self.add(row)
+        else:
+            # one sort of the lot beats an insort per row
+            self.keys.extend(self.key(row) for row in rows)
+            self.keys.sort()
+
+    def remove(self, row: tuple) -> None:
+        key = self.key(row)
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            del self.keys[index]
+
+    def range(self, compare, value) -> tuple[int, int]:
+        """
+        Positions [lo, hi) of the keys whose value compares true against
+        value; a (value, id) tuple compares like a keyset cursor does
+        """
+        keys = self.keys
+        if isinstance(value, tuple):
+            low, high = (True, *value), (True, *value)
+        else:
+            low, high = (True, value), (True, value, LAST)
+        if compare is operator.eq:
+            return bisect_left(keys, low), bisect_right(keys, high)
+        if compare is operator.gt:
+            return bisect_right(keys, high), len(keys)
+        if compare is operator.ge:
+            return bisect_left(keys, low), len(keys)
+        # NULLs never compare true, they are skipped
+        first = bisect_left(keys, (True,))
+        if compare is operator.lt:
+            return first, bisect_left(keys, low)
+        if compare is operator.le:
+            return first, bisect_right(keys, high)
+        return 0, len(keys)
+
+    def ids(self, lo: int, hi: int, descending: bool = False) -> Iterator[int]:
+        keys = self.keys
+        positions = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+        return (keys[position][2] for position in positions)
+
+
+def constraint_error(message: str) -> IntegrityError:
+    """
+    The error SQLAlchemy raises when the database refuses a row, so callers
+    like handlers.import_bookmarks treat both repositories the same
+    """
+    return IntegrityError(None, None, ValueError(message))
+
+
+class BookmarkTable:
+    """
+    The rows and their indexes. One table can back many repositories, one
+    per unit of work, and the lock makes it safe to share between threads.
+    """
+
+    def __init__(self) -> None:
+        self.rows = dict()
+        self.titles = dict()
+        self.urls = dict()
+        self.indexes = {column: SortedIndex(column) for column in SORTED_COLUMNS}
+        # like AUTOINCREMENT, ids of deleted rows aren't handed out again
+        self.last_id = 0
+        self.lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def insert(self, rows: list[tuple]) -> list[int]:
+        """
+        Adds rows whose id may be None, all of them or none if one breaks a
+        constraint, and returns their ids
+        """
+        with self.lock:
+            titles = set()
+            last_id = self.last_id
+            new_rows = list()
+            for row in rows:
+                id = last_id + 1 if row[0] is None else int(row[0])
+                if id in self.rows:
+                    raise constraint_error(f"A bookmark with id {id} already exists")
+                for column in REQUIRED_COLUMNS:
+                    if row[POSITIONS[column]] is None:
+                        raise constraint_error(f"{column} is required")
+                title = row[1]
+                if title in self.titles or title in titles:
+                    raise constraint_error(f"A bookmark titled {title} already exists")
+                titles.add(title)
+                last_id = max(last_id, id)
+                new_rows.append((id, *row[1:]))
+
+            if len({row[0] for row in new_rows}) != len(new_rows):
+                raise constraint_error("The same id is used twice")
+            for row in new_rows:
+                self._add(row, indexes=False)
+            for index in self.indexes.values():
+                index.add_many(new_rows)
+            self.last_id = last_id
+            return [row[0] for row in new_rows]
+
+    def replace(self, rows: list[tuple]) -> None:
+        """
+        Writes new versions of existing rows, checking titles stay unique
+        """
+        with self.lock:
+            titles = {row[0]: row[1] for row in rows}
+            if len(set(titles.values())) != len(titles):
+                raise constraint_error("The same title is used twice")
+            for id, title in titles.items():
+                owner = self.titles.get(title)
+                # taken, unless the owner is being renamed in the same go
+                if owner is not None and owner != id and titles.get(owner, title) == title:
+                    raise constraint_error(f"A bookmark titled {title} already exists")
+            for row in rows:
+                self._remove(self.rows[row[0]])
+                self._add(row)
+
+    def delete(self, ids: list[int]) -> int:
+        with self.lock:
+            deleted = 0
+            for id in ids:
+                row = self.rows.get(id)
+                if row is not None:
+                    self._remove(row)
+                    deleted += 1
+            return deleted
+
+    def _add(self, row: tuple, indexes: bool = True) -> None:
+        id = row[0]
+        self.rows[id] = row
+        self.titles[row[1]] = id
+        self.urls.setdefault(row[2], set()).add(id)
+        if indexes:
+            for index in self.indexes.values():
+                index.add(row)
+
+    def _remove(self, row: tuple) -> None:
+        id = row[0]
+        del self.rows[id]
+        if self.titles.get(row[1]) == id:
+            del self.titles[row[1]]
+        ids = self.urls.get(row[2])
+        if ids is not None:
+            ids.discard(id)
+            if not ids:
+                del self.urls[row[2]]
+        for index in self.indexes.values():
+            index.remove(row)
+
+    def select(self, query) -> list[tuple]:
+        """
+        The rows a select(Bookmark) query returns, in its order
+        """
+        query = select(Bookmark) if query is None else query
+        froms = query.get_final_froms()
+        if len(froms) != 1 or getattr(froms[0], 'name', None) != 'bookmarks':
+            raise NotImplementedError("InMemoryRepository only runs queries on bookmarks")
+        predicate = compile_where(query.whereclause)
+        order = order_columns(query._order_by_clauses)
+        offset = query._offset or 0
+        stop = None if query._limit is None else offset + query._limit
+
+        with self.lock:
+            ids, ordered = self._candidates(conjunction(query.whereclause), order)
+            rows = self.rows
+            if ordered:
+                matched = list()
+                for id in ids:
+                    row = rows[id]
+                    if predicate(row):
+                        matched.append(row)
+                        if stop is not None and len(matched) >= stop:
+                            break
+            else:
+                matched = sort_rows([rows[id] for id in ids if predicate(rows[id])], order)
+        return matched[offset:stop]
+
+    def _candidates(self, terms: list, order: list[tuple[str, bool]]) -> tuple[Iterable[int], bool]:
+        """
+        The ids worth testing against the WHERE clause, and whether they
+        already come in ORDER BY order
+        """
+        ranges = list()
+        for term in terms:
+            if not isinstance(term, BinaryExpression) or not isinstance(term.right, (BindParameter, Tuple)):
+                continue
+            if isinstance(term.left, Tuple):
+                columns = [column_name(column) for column in term.left.clauses]
+                compare = COMPARISONS.get(term.operator)
+                # (column, id) > (value, id) is a keyset cursor on the column's index
+                if len(columns) == 2 and columns[1] == 'id' and columns[0] in self.indexes and compare:
+                    value = tuple(bind_value(element) for element in term.right.clauses)
+                    if value[0] is not None:
+                        ranges.append((columns[0], self.indexes[columns[0]].range(compare, value)))
+                continue
+
+            column = column_name(term.left)
+            if term.operator is operators.eq and column in HASHED_COLUMNS:
+                return sorted(self._lookup(column, [bind_value(term.right)])), False
+            if term.operator is operators.in_op and column in HASHED_COLUMNS:
+                return sorted(self._lookup(column, bind_value(term.right))), False
+            compare = COMPARISONS.get(term.operator)
+            if column in self.indexes and compare is not None and compare is not operator.ne:
+                value = bind_value(term.right)
+                if value is None:
+                    return [], True
+                ranges.append((column, self.indexes[column].range(compare, value)))
+
+        first = order[0] if order else ('id', False)
+        in_order = first[0] in self.indexes and (len(order) < 2 or order[1] == ('id', first[1]))
+        # ranges over the same column narrow each other down
+        narrowed = dict()
+        for column, (lo, hi) in ranges:
+            current = narrowed.get(column, (0, len(self.rows)))
+            narrowed[column] = (max(lo, current[0]), min(hi, current[1]))
+        if narrowed:
+            if in_order and first[0] in narrowed:
+                column = first[0]
+            else:
+                column = min(narrowed, key=lambda name: narrowed[name][1] - narrowed[name][0])
+            lo, hi = narrowed[column]
+            ordered = in_order and column == first[0]
+            return self.indexes[column].ids(lo, max(lo, hi), descending=ordered and first[1]), ordered
+
+        if in_order:
+            index = self.indexes[first[0]]
+            return index.ids(0, len(index.keys), descending=first[1]), True
+        return list(self.rows), False
+
+    def _lookup(self, column: str, values: Iterable) -> set[int]:
+        ids = set()
+        for value in values:
+            if column == 'id':
+                if value is not None and int(value) in self.rows:
+                    ids.add(int(value))
+            elif column == 'title':
+                if value in self.titles:
+                    ids.add(self.titles[value])
+            else:
+                ids.update(self.urls.get(value, ()))
+        return ids
+
+
+class InMemoryRepository(AbstractRepository):
+    """
+    AbstractRepository on a BookmarkTable, a new empty one unless given.
+    Writes apply straight away, like SqlAlchemyRepository's commit on their own.
+    Bookmarks handed out are copies, changing one doesn't change the table.
+    """
+
+    def __init__(self, table: BookmarkTable = None) -> None:
+        super().__init__()
+        self.table = BookmarkTable() if table is None else table
+
+    def add_one(self, bookmark: Bookmark, bulk: bool = False) -> int:
+        if bookmark:
+            return self.add_many([bookmark], bulk=bulk)[0]
+
+    def add_many(self, bookmarks: list[Bookmark], bulk: bool = False, chunk_size: Optional[int] = None) -> list[int]:
+        """
+        Same as SqlAlchemyRepository.add_many: ids come back in order, and
+        the passed bookmarks get theirs unless bulk is set
+        """
+        if not bookmarks:
+            return []
+        ids = self.table.insert([bookmark_row(bookmark) for bookmark in bookmarks])
+        if not bulk:
+            for bookmark, id in zip(bookmarks, ids):
+                bookmark.id = id
+                self.seen.add(bookmark)
+        return ids
+
+    def add_rows(self, rows: list[dict], chunk_size: Optional[int] = None) -> int:
+        return len(self.table.insert([dict_row(row) for row in rows]))
+
+    def add_new_rows(self, rows: list[dict], chunk_size: Optional[int] = None) -> list[bool]:
+        table = self.table
+        with table.lock:
+            titles = set()
+            inserted = list()
+            for row in rows:
+                inserted.append(row['title'] not in table.titles and row['title'] not in titles)
+                titles.add(row['title'])
+            table.insert([dict_row(row) for row, new in zip(rows, inserted) if new])
+        return inserted
+
+    def upsert_many(
+            self,
+            rows: list[dict],
+            update_columns: Optional[Iterable[str]] = DEFAULT_UPSERT_COLUMNS,
+            chunk_size: Optional[int] = None,
+    ) -> dict:
+        """
+        SqlAlchemyRepository.upsert_many's rules: new titles are added, taken
+        ones get update_columns overwritten when they differ, and date_edited
+        set to now unless it is one of them
+        """
+        update_columns = upsert_columns(update_columns)
+        date_edited = datetime.now()
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        table = self.table
+        with table.lock:
+            existing = dict()
+            for row in rows:
+                id = table.titles.get(row['title'])
+                if id is not None:
+                    current = table.rows[id]
+                    existing[row['title']] = {column: current[POSITIONS[column]] for column in update_columns}
+
+            new_rows, changed = list(), dict()
+            for row in upsert_writes(rows, existing, update_columns, counts):
+                id = table.titles.get(row['title'])
+                if id is None:
+                    new_rows.append(dict_row(row))
+                    continue
+                current = list(changed.get(id, table.rows[id]))
+                for column in update_columns:
+                    current[POSITIONS[column]] = row[column]
+                current[POSITIONS['date_edited']] = upsert_date_edited(row, update_columns, date_edited)
+                changed[id] = tuple(current)
+
+            table.insert(new_rows)
+            table.replace(list(changed.values()))
+        return counts
+
+    def delete_one(self, bookmark: Bookmark) -> None:
+        if bookmark:
+            self.delete_many([bookmark])
+
+    def delete_many(self, bookmarks: list[Bookmark]) -> None:
+        if bookmarks:
+            self.delete_by_ids([bookmark_id(bookmark) for bookmark in bookmarks])
+
+    def delete_by_ids(self, ids: Iterable) -> int:
+        return self.table.delete(delete_ids(ids))
+
+    def get(self, id: int) -> Bookmark:
+        row = self.table.rows.get(int(id))
+        if row is None:
+            return None
+        bookmark = to_bookmark(row)
+        self.seen.add(bookmark)
+        return bookmark
+
+    def get_dict(self, id: int) -> Optional[dict]:
+        row = self.table.rows.get(int(id))
+        return None if row is None else serializers.row_to_dict(row)
+
+    def update(self, bookmark) -> int:
+        if bookmark is None:
+            return 'Error', 400
+        else:
+            counts = self.update_many([bookmark])
+            return counts if isinstance(counts, tuple) else counts[0]
+
+    def update_many(self, bookmarks: list[Bookmark]) -> list[int]:
+        """
+        Writes the columns that are set on each bookmark, like
+        SqlAlchemyRepository.update_many, and returns 1 or 0 per bookmark
+        for whether its id was there
+        """
+        if bookmarks is None:
+            return 'Error', 400
+        try:
+            date_edited = datetime.now()
+            table = self.table
+            with table.lock:
+                changed, counts = dict(), list()
+                for bookmark in bookmarks:
+                    id = int(bookmark.id)
+                    current = changed.get(id, table.rows.get(id))
+                    counts.append(0 if current is None else 1)
+                    if current is None:
+                        continue
+                    current = list(current)
+                    for column in UPDATABLE_COLUMNS:
+                        if getattr(bookmark, column) is not None:
+                            current[POSITIONS[column]] = getattr(bookmark, column)
+                    current[POSITIONS['date_edited']] = date_edited
+                    changed[id] = tuple(current)
+                table.replace(list(changed.values()))
+            return counts
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+    def find_first(self, query) -> Bookmark:
+        if query is None:
+            return None
+        rows = self.table.select(query.limit(1))
+        return self._bookmarks(rows)[0] if rows else None
+
+    def find_all(self, query) -> list[Bookmark]:
+        return self._bookmarks(self.table.select(query))
+
+    def find_page(
+        self,
+        query,
+        after: Optional[str] = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        sort: str = 'id',
+    ) -> tuple[list[Bookmark], Optional[str]]:
+        query, limit = page_query(query, after, limit, sort)
+        return next_page(self._bookmarks(self.table.select(query)), limit, sort)
+
+    def stream_all(self, query, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Bookmark]:
+        # the rows are picked up front, later writes don't show up part way through
+        for row in self.table.select(query):
+            yield to_bookmark(row)
+
+    def find_rows(self, query) -> list:
+        return self.table.select(query)
+
+    def stream_rows(self, query, batch_size: int = STREAM_BATCH_SIZE) -> Iterator:
+        yield from self.table.select(query)
+
+    def search(self, text: str, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0) -> list[dict]:
+        """
+        The same matching rules as the FTS5 search (every word, a trailing *
+        makes the last one a prefix) by reading every row, which is fine at
+        the sizes this repository is for. The rank is minus the number of
+        matched words, so lower is better like bm25.
+        """
+        words = [word.lower() for word in re.findall(r'\w+', text or '')]
+        if not words:
+            return []
+        patterns = search_patterns(words, text.rstrip().endswith('*'))
+
+        with self.table.lock:
+            rows = list(self.table.rows.values())
+        results = list()
+        for row in rows:
+            fields = [re.findall(r'\w+', (value or '').lower()) for value in row[1:4]]
+            if all(any(matches(token, [pattern]) for field in fields for token in field) for pattern in patterns):
+                hits = [sum(matches(token, patterns) for token in field) for field in fields]
+                results.append((-sum(hits), row, hits))
+
+        results.sort(key=lambda result: (result[0], result[1][0]))
+        start = max(0, int(offset or 0))
+        page = results[start:start + max(1, int(limit or DEFAULT_PAGE_SIZE))]
+        return [search_result(row, rank, hits, patterns) for rank, row, hits in page]
+
+    def _bookmarks(self, rows: list[tuple]) -> list[Bookmark]:
+        bookmarks = [to_bookmark(row) for row in rows]
+        self.seen.update(bookmarks)
+        return bookmarks
+
+
+def to_bookmark(row: tuple) -> Bookmark:
+    """
+    With the mappers started and configured, the bookmark is made the way the
+    ORM loads one, the values going straight into its __dict__; that skips
+    the attribute events Bookmark.__init__ would fire, a few times faster
+    """
+    manager = opt_manager_of_class(Bookmark)
+    if manager is None or not manager.mapper.configured:
+        return Bookmark(*row)
+    bookmark = manager.new_instance()
+    bookmark.__dict__.update(zip(serializers.COLUMNS, row))
+    return bookmark
+
+
+def bookmark_row(bookmark: Bookmark) -> tuple:
+    return tuple(getattr(bookmark, column) for column in serializers.COLUMNS)
+
+
+def dict_row(row: dict) -> tuple:
+    return (row.get('id'), *(row.get(column) for column in serializers.COLUMNS[1:]))
+
+
+def conjunction(clause) -> list:
+    """
+    The terms ANDed together at the top of a WHERE clause
+    """
+    if clause is None:
+        return []
+    if isinstance(clause, Grouping):
+        return conjunction(clause.element)
+    if isinstance(clause, BooleanClauseList) and clause.operator is operators.and_:
+        return [term for element in clause.clauses for term in conjunction(element)]
+    return [clause]
+
+
+def compile_where(clause) -> Callable[[tuple], bool]:
+    if clause is None or isinstance(clause, True_):
+        return lambda row: True
+    if isinstance(clause, False_):
+        return lambda row: False
+    if isinstance(clause, Grouping):
+        return compile_where(clause.element)
+    if isinstance(clause, BooleanClauseList) and clause.operator in (operators.and_, operators.or_):
+        parts = [compile_where(element) for element in clause.clauses]
+        if clause.operator is operators.and_:
+            return lambda row: all(part(row) for part in parts)
+        return lambda row: any(part(row) for part in parts)
+    if isinstance(clause, BinaryExpression):
+        return compile_comparison(clause)
+    raise NotImplementedError(f"InMemoryRepository can't run {clause}")
+
+
+def compile_comparison(clause: BinaryExpression) -> Callable[[tuple], bool]:
+    op = clause.operator
+    if op in (operators.is_, operators.is_not) and isinstance(clause.right, Null):
+        position = POSITIONS[column_name(clause.left)]
+        if op is operators.is_:
+            return lambda row: row[position] is None
+        return lambda row: row[position] is not None
+
+    if op in (operators.in_op, operators.not_in_op):
+        position = POSITIONS[column_name(clause.left)]
+        values = set(bind_value(clause.right))
+        if op is operators.in_op:
+            return lambda row: row[position] in values
+        return lambda row: row[position] is not None and row[position] not in values
+
+    compare = COMPARISONS.get(op)
+    if compare is None:
+        raise NotImplementedError(f"InMemoryRepository can't run {clause}")
+
+    # NULL compares as neither true nor false, so the row doesn't match
+    if isinstance(clause.left, Tuple):
+        positions = [POSITIONS[column_name(column)] for column in clause.left.clauses]
+        value = tuple(bind_value(element) for element in clause.right.clauses)
+        if None in value:
+            return lambda row: False
+
+        def predicate(row):
+            current = tuple(row[position] for position in positions)
+            return None not in current and compare(current, value)
+
+        return predicate
+
+    position = POSITIONS[column_name(clause.left)]
+    value = bind_value(clause.right)
+    if value is None:
+        return lambda row: False
+    return lambda row: row[position] is not None and compare(row[position], value)
+
+
+def column_name(column) -> str:
+    table = getattr(column, 'table', None)
+    if getattr(table, 'name', None) != 'bookmarks' or column.name not in POSITIONS:
+        raise NotImplementedError(f"InMemoryRepository can't run queries on {column}")
+    return column.name
+
+
+def bind_value(element):
+    if not isinstance(element, BindParameter):
+        raise NotImplementedError(f"InMemoryRepository can only compare columns to values, not {element}")
+    return element.effective_value
+
+
+def order_columns(clauses) -> list[tuple[str, bool]]:
+    """
+    (column, descending) for each ORDER BY term
+    """
+    order = list()
+    for clause in clauses:
+        descending = False
+        if isinstance(clause, UnaryExpression) and clause.modifier in (operators.desc_op, operators.asc_op):
+            descending = clause.modifier is operators.desc_op
+            clause = clause.element
+        order.append((column_name(clause), descending))
+    return order
+
+
+def sort_rows(rows: list[tuple], order: list[tuple[str, bool]]) -> list[tuple]:
+    """
+    Rows in ORDER BY order, NULLs first, id order when nothing else decides
+    """
+    rows.sort(key=lambda row: row[0])
+    # sorts are stable, so sorting by the last key first leaves the first one deciding
+    for column, descending in reversed(order):
+        position = POSITIONS[column]
+        rows.sort(key=lambda row: (row[position] is not None, row[position]), reverse=descending)
+    return rows
+
+
+def search_patterns(words: list[str], prefix: bool) -> list[tuple[str, bool]]:
+    """
+    (word, is a prefix) for each word searched for, only the last can be one
+    """
+    return [(word, prefix and position == len(words) - 1) for position, word in enumerate(words)]
+
+
+def matches(token: str, patterns: list[tuple[str, bool]]) -> bool:
+    return any(token.startswith(word) if prefix else token == word for word, prefix in patterns)
+
+
+def search_result(row: tuple, rank: int, hits: list[int], patterns: list) -> dict:
+    result = serializers.row_to_dict(row)
+    result['rank'] = rank
+    # the snippet comes from the column with the most matches
+    result['snippet'] = snippet(row[1 + hits.index(max(hits))] or '', patterns)
+    return result
+
+
+def snippet(text: str, patterns: list) -> str:
+    """
+    Up to SNIPPET_WORDS words of text around the first match, with the
+    matches marked the way the FTS5 snippets are
+    """
+    tokens = list(re.finditer(r'\w+', text))
+    if not tokens:
+        return text
+    first = next((i for i, token in enumerate(tokens) if matches(token.group().lower(), patterns)), 0)
+    start = max(0, min(first - SNIPPET_WORDS // 4, len(tokens) - SNIPPET_WORDS))
+    stop = min(len(tokens), start + SNIPPET_WORDS)
+    begin = tokens[start].start() if start else 0
+    end = tokens[stop - 1].end() if stop < len(tokens) else len(text)
+
+    def mark(token):
+        word = token.group()
+        return f"{SNIPPET_MARKS[0]}{word}{SNIPPET_MARKS[1]}" if matches(word.lower(), patterns) else word
+
+    marked = re.sub(r'\w+', mark, text[begin:end])
+    return ('…' if begin else '') + marked + ('…' if end < len(text) else '')
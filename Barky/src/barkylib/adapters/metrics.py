@@ -0,0 +1,353 @@
+"""
+In-process metrics, exported in the Prometheus text format (see /api/metrics).
+
+- Counter and Histogram series are keyed by label values and updated under a
+  lock each; render() writes the current values out
+- instrument_engine adds cursor execute listeners to an engine that count
+  queries, time them and count the rows INSERT, UPDATE and DELETE write, per
+  statement shape ("select bookmarks", "insert bookmarks", ...). Returned
+  rows are fetched after the listeners ran, and SQLite reports no rowcount
+  for a SELECT, so the repositories count those where they read them, per
+  method, when their engine is instrumented
+- track_request() collects the queries run inside it, so the API can report
+  the database time of each request next to its total time
+- collectors are called at render time for numbers kept elsewhere, like the
+  bookmark cache and event dispatcher stats
+"""
+import re
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import event
+
+# seconds, from a cached lookup to a full table export
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# the verb and the first table it works on; UPDATE names its table straight away
+SHAPE = re.compile(
+    r'^\s*(\w+)(?:(?:(?:\s+OR\s+\w+)?\s+(?=["`\[]?\w+["`\]]?\s+SET\b)|.*?\b(?:FROM|INTO|TABLE|EXISTS)\s+)["`\[]?(\w+))?',
+    re.IGNORECASE | re.DOTALL,
+)
+# distinct statements whose shape is remembered; SQLAlchemy caches its SQL
+# strings, so there are few of them, but raw SQL could make any number
+MAX_SHAPES = 2000
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterable[tuple]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, dict(zip(self.label_names, labels)), value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (the last one is +Inf), sum]
+        self._series = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def sum(self, *labels) -> float:
+        series = self._series.get(labels)
+        return series[1] if series else 0.0
+
+    def samples(self) -> Iterable[tuple]:
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in series:
+            labels = dict(zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield self.name + "_bucket", dict(labels, le=format_value(bound)), cumulative
+            yield self.name + "_sum", labels, total
+            yield self.name + "_count", labels, cumulative
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics = dict()
+        self.collectors = list()
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[tuple]]) -> None:
+        """
+        collector() returns (name, type, help, [(labels, value), ...]) tuples,
+        for numbers that are kept somewhere else and read when rendering
+        """
+        with self._lock:
+            self.collectors.append(collector)
+
+    def remove_collector(self, collector: Callable) -> None:
+        with self._lock:
+            if collector in self.collectors:
+                self.collectors.remove(collector)
+
+    def clear(self) -> None:
+        """
+        Zeroes every series, the metrics stay registered
+        """
+        for metric in self.metrics.values():
+            metric.clear()
+
+    def render(self) -> str:
+        lines = list()
+        for metric in list(self.metrics.values()):
+            lines += header(metric.name, metric.type, metric.help)
+            lines += [sample(name, labels, value) for name, labels, value in metric.samples()]
+        for collector in list(self.collectors):
+            for name, type, help, values in collector():
+                lines += header(name, type, help)
+                lines += [sample(name, labels, value) for labels, value in values]
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+
+def header(name: str, type: str, help: str) -> list[str]:
+    return [f"# HELP {name} {help}", f"# TYPE {name} {type}"]
+
+
+def sample(name: str, labels: dict, value) -> str:
+    if not labels:
+        return f"{name} {format_value(value)}"
+    text = ",".join(f'{key}="{escape(str(label))}"' for key, label in labels.items())
+    return f"{name}{{{text}}} {format_value(value)}"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# the registry the app and its engines report to
+REGISTRY = Registry()
+
+DB_QUERIES = REGISTRY.counter("barky_db_queries_total", "Statements executed", ("shape",))
+DB_ERRORS = REGISTRY.counter("barky_db_errors_total", "Statements that raised", ("shape",))
+DB_ROWS_WRITTEN = REGISTRY.counter(
+    "barky_db_rows_written_total", "Rows written by statements that return none", ("shape",)
+)
+DB_ROWS_RETURNED = REGISTRY.counter(
+    "barky_db_rows_returned_total", "Rows read by the repository", ("method",)
+)
+DB_DURATION = REGISTRY.histogram("barky_db_query_duration_seconds", "Statement execution time", ("shape",))
+HTTP_REQUESTS = REGISTRY.counter("barky_http_requests_total", "Requests handled", ("endpoint", "method", "status"))
+HTTP_DURATION = REGISTRY.histogram(
+    "barky_http_request_duration_seconds", "Time to build the response", ("endpoint", "method")
+)
+HTTP_DB_DURATION = REGISTRY.histogram(
+    "barky_http_request_db_seconds", "Database time spent building the response", ("endpoint",)
+)
+HTTP_DB_QUERIES = REGISTRY.histogram(
+    "barky_http_request_db_queries",
+    "Statements run to build the response",
+    ("endpoint",),
+    buckets=(1, 2, 3, 5, 10, 25, 50, 100, 1000),
+)
+
+_shapes = dict()
+_instrumented = weakref.WeakSet()
+# [queries, seconds] of the request being handled, see track_request
+_request = ContextVar("barky_request_queries", default=None)
+
+
+def statement_shape(statement: str) -> str:
+    shape = _shapes.get(statement)
+    if shape is None:
+        match = SHAPE.match(statement)
+        shape = " ".join(part.lower() for part in match.groups() if part) if match else "other"
+        if len(_shapes) >= MAX_SHAPES:
+            _shapes.clear()
+        _shapes[statement] = shape
+    return shape
+
+
+def instrumented(engine) -> bool:
+    return engine in _instrumented
+
+
+def instrument_engine(engine, registry: Registry = REGISTRY) -> None:
+    """
+    Times every statement the engine runs. For an AsyncEngine pass
+    engine.sync_engine. Instrumenting the same engine twice does nothing.
+    """
+    if engine in _instrumented:
+        return
+    _instrumented.add(engine)
+
+    queries = registry.counter(DB_QUERIES.name, DB_QUERIES.help, DB_QUERIES.label_names)
+    errors = registry.counter(DB_ERRORS.name, DB_ERRORS.help, DB_ERRORS.label_names)
+    rows = registry.counter(DB_ROWS_WRITTEN.name, DB_ROWS_WRITTEN.help, DB_ROWS_WRITTEN.label_names)
+    duration = registry.histogram(DB_DURATION.name, DB_DURATION.help, DB_DURATION.label_names)
+    perf_counter = time.perf_counter
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        # the execution context lives for one statement, so the start time
+        # can ride on it rather than in the connection's info dict
+        context._barky_start = perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - context._barky_start
+        shape = statement_shape(statement)
+        queries.inc(shape)
+        duration.observe(elapsed, shape)
+        # a statement that returns rows, RETURNING ones too, has no rowcount yet
+        if cursor.description is None and cursor.rowcount > 0:
+            rows.inc(shape, amount=cursor.rowcount)
+        current = _request.get()
+        if current is not None:
+            current[0] += 1
+            current[1] += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def error(context):
+        errors.inc(statement_shape(context.statement or ""))
+
+
+@contextmanager
+def track_request():
+    """
+    Yields [queries, seconds] for the statements run inside the block
+    """
+    current = [0, 0.0]
+    token = _request.set(current)
+    try:
+        yield current
+    finally:
+        _request.reset(token)
+
+
+def start_request() -> tuple:
+    """
+    track_request split in two, for frameworks that time requests with a
+    before and an after hook: pass what this returns to end_request
+    """
+    current = [0, 0.0]
+    return current, _request.set(current), time.perf_counter()
+
+
+def end_request(started: tuple, endpoint: str, method: str, status: int) -> None:
+    current, token, start = started
+    elapsed = time.perf_counter() - start
+    try:
+        _request.reset(token)
+    except ValueError:
+        # ended in another context than it started, nothing to restore
+        pass
+    HTTP_REQUESTS.inc(endpoint, method, str(status))
+    HTTP_DURATION.observe(elapsed, endpoint, method)
+    HTTP_DB_DURATION.observe(current[1], endpoint)
+    HTTP_DB_QUERIES.observe(current[0], endpoint)
+
+
+def stats_collector(prefix: str, stats: Callable[[], Optional[dict]], help: str, counters: tuple = ()) -> Callable:
+    """
+    A collector that renders the numbers in a stats() dict as one metric each,
+    counters for the keys in counters and gauges for the others
+    """
+
+    def collect():
+        values = stats()
+        if not values:
+            return
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                type = "counter" if key in counters else "gauge"
+                name = f"{prefix}_{key}_total" if type == "counter" else f"{prefix}_{key}"
+                yield name, type, f"{help}: {key.replace('_', ' ')}", [({}, value)]
+
+    return collect
+
+
+def dispatcher_collector(stats: Callable[[], dict]) -> Callable:
+    """
+    A collector for services.dispatch.EventDispatcher.stats()
+    """
+
+    def collect():
+        values = stats()
+        yield "barky_events_queue_depth", "gauge", "Events waiting for a worker", [({}, values["queue_depth"])]
+        yield "barky_events_queue_max_depth", "gauge", "Most events that have waited at once", [({}, values["max_depth"])]
+        for key in ("submitted", "rejected", "handled"):
+            yield f"barky_events_{key}_total", "counter", f"Events {key}", [({}, values[key])]
+        handlers = values["handlers"].items()
+        for key, name, type, help in (
+            ("calls", "barky_event_handler_calls_total", "counter", "Event handler calls"),
+            ("errors", "barky_event_handler_errors_total", "counter", "Event handler calls that raised"),
+            ("total_seconds", "barky_event_handler_seconds_total", "counter", "Time spent in event handlers"),
+            ("in_flight", "barky_event_handler_in_flight", "gauge", "Event handler calls running now"),
+        ):
+            yield name, type, help, [({"handler": handler}, stats[key]) for handler, stats in handlers]
+
+    return collect
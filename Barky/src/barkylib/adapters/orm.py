@@ -1,7 +1,9 @@
 import logging
+import threading
+import weakref
 from typing import Text
 
-from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, event
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, Text, event, inspect
 
 # from sqlalchemy.orm import mapper
 from sqlalchemy.orm import registry
@@ -33,10 +35,180 @@ bookmarks = Table(
     Column("notes", Text),
     Column("date_added", DateTime),
     Column("date_edited", DateTime),
+    # handlers.get_query filters and sorts on these; the sort indexes end in id
+    # so keyset pages ordered by (column, id) are read straight off the index.
+    # title already has the index that comes with its unique constraint.
+    Index("ix_bookmarks_url", "url"),
+    Index("ix_bookmarks_date_added_id", "date_added", "id"),
+    Index("ix_bookmarks_date_edited_id", "date_edited", "id"),
 )
 
 
+# domain events waiting to be published, written in the same transaction as
+# the change they describe (adapters/outbox.py) and deleted once published
+outbox = Table(
+    "outbox",
+    mapper_registry.metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("topic", String(64), nullable=False),
+    Column("payload", Text, nullable=False),
+    Column("created", DateTime, nullable=False),
+)
+
+
+def create_indexes(bind):
+    """
+    create_all only creates the indexes of tables it creates, this adds any
+    missing ones to an existing database in place
+    """
+    for index in bookmarks.indexes:
+        index.create(bind, checkfirst=True)
+
+
+# SQLite FTS5 index over title, url and notes. It is an external content table,
+# so it only stores the index and the triggers keep it in step with bookmarks.
+SEARCH_INDEX_DDL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS bookmarks_fts USING fts5(
+        title, url, notes, content='bookmarks', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS bookmarks_fts_insert AFTER INSERT ON bookmarks BEGIN
+        INSERT INTO bookmarks_fts(rowid, title, url, notes)
+        VALUES (new.id, new.title, new.url, new.notes);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS bookmarks_fts_delete AFTER DELETE ON bookmarks BEGIN
+        INSERT INTO bookmarks_fts(bookmarks_fts, rowid, title, url, notes)
+        VALUES ('delete', old.id, old.title, old.url, old.notes);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS bookmarks_fts_update AFTER UPDATE OF title, url, notes ON bookmarks BEGIN
+        INSERT INTO bookmarks_fts(bookmarks_fts, rowid, title, url, notes)
+        VALUES ('delete', old.id, old.title, old.url, old.notes);
+        INSERT INTO bookmarks_fts(rowid, title, url, notes)
+        VALUES (new.id, new.title, new.url, new.notes);
+    END
+    """,
+)
+# BM25 weights for title, url and notes, stored as the default rank of the index
+SEARCH_RANK = "bm25(10.0, 2.0, 1.0)"
+
+
+def create_search_index(connection):
+    """
+    Creates the full-text index and its triggers if they are missing and fills
+    it from the existing bookmarks. Only SQLite has FTS5, other databases are
+    left alone.
+    """
+    if connection.dialect.name != "sqlite":
+        return
+
+    exists = connection.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'bookmarks_fts'"
+    ).first()
+    for statement in SEARCH_INDEX_DDL:
+        connection.exec_driver_sql(statement)
+
+    if not exists:
+        logger.info("building the bookmarks search index")
+        connection.exec_driver_sql("INSERT INTO bookmarks_fts(bookmarks_fts) VALUES ('rebuild')")
+        connection.exec_driver_sql(
+            "INSERT INTO bookmarks_fts(bookmarks_fts, rank) VALUES ('rank', ?)", (SEARCH_RANK,)
+        )
+
+
+@event.listens_for(bookmarks, "after_create")
+def _create_search_index(target, connection, **kw):
+    create_search_index(connection)
+
+
+def create_tables(connection):
+    mapper_registry.metadata.create_all(connection)
+
+
+def create_outbox(connection):
+    outbox.create(connection, checkfirst=True)
+
+
+# Ordered schema upgrades. On SQLite, PRAGMA user_version holds how many of them
+# a database has had, so startup only runs the ones it is missing. Steps must be
+# safe to run on a database that already has their changes (databases created
+# before the versioning start at 0). New steps go at the end.
+MIGRATIONS = (
+    create_tables,
+    create_indexes,
+    create_search_index,
+    create_outbox,
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+_ready_engines = weakref.WeakSet()
+_schema_lock = threading.Lock()
+
+
+def ensure_schema(engine):
+    """
+    Brings the database up to SCHEMA_VERSION the first time an engine is seen,
+    after that it is a set lookup
+    """
+    if engine in _ready_engines:
+        return
+
+    with _schema_lock:
+        if engine not in _ready_engines:
+            with engine.begin() as connection:
+                migrate(connection)
+            _ready_engines.add(engine)
+
+
+_async_schema_lock = None
+
+
+async def ensure_schema_async(engine):
+    """
+    ensure_schema for an AsyncEngine, keyed on the sync engine it wraps
+    """
+    global _async_schema_lock
+    if engine.sync_engine in _ready_engines:
+        return
+
+    # made here so importing this module doesn't pull in asyncio
+    import asyncio
+    if _async_schema_lock is None:
+        _async_schema_lock = asyncio.Lock()
+
+    async with _async_schema_lock:
+        if engine.sync_engine not in _ready_engines:
+            async with engine.begin() as connection:
+                await connection.run_sync(migrate)
+            _ready_engines.add(engine.sync_engine)
+
+
+def migrate(connection) -> int:
+    if connection.dialect.name != "sqlite":
+        # no user_version to go by, every step checks for itself
+        for step in MIGRATIONS:
+            step(connection)
+        return SCHEMA_VERSION
+
+    version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info("upgrading schema to version %s", number)
+        step(connection)
+        connection.exec_driver_sql(f"PRAGMA user_version = {number}")
+
+    return max(version, SCHEMA_VERSION)
+
+
 def start_mappers():
+    # bootstrap and the tests can both get here first, map only once
+    if inspect(Bookmark, raiseerr=False) is not None:
+        return
+
     logger.info("string mappers")
     # SQLAlchemy 2.0
     bookmarks_mapper = mapper_registry.map_imperatively(Bookmark, bookmarks)
@@ -0,0 +1,156 @@
+"""
+Transactional outbox: the domain events of a change are written to the
+outbox table in the same transaction as the change, so they are committed
+or rolled back together and none is lost when the process dies. A relay
+(services/relay.py) publishes them afterwards and deletes them.
+
+The repositories call the record_* functions next to their writes, which
+only queue events on the session. A before_commit hook then inserts the
+queue with one executemany, just before the transaction commits. Nothing is
+queued unless the unit of work turned the outbox on for its session (see
+start), so with the outbox off a write costs a dict lookup more.
+"""
+import functools
+import re
+import threading
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+from barkylib.adapters import orm, serializers
+from barkylib.domain import events
+from barkylib.domain.models import Bookmark
+
+# session.info key of the events waiting for the commit
+PENDING = "barky_outbox"
+
+SQLITE_INSERT = "INSERT INTO outbox (topic, payload, created) VALUES (?, ?, ?)"
+
+# set after a commit that wrote to the outbox, so the relay doesn't have to wait for its next poll
+written = threading.Event()
+
+
+def start(session) -> None:
+    """
+    Turns the outbox on for the session
+    """
+    session.info[PENDING] = list()
+
+
+def recording(session) -> bool:
+    return PENDING in session.info
+
+
+@functools.lru_cache(maxsize=None)
+def topic(event_type: type) -> str:
+    """
+    BookmarkAdded -> bookmark_added
+    """
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", event_type.__name__).lower()
+
+
+def record(session, new_events: Iterable[events.Event]) -> None:
+    pending = session.info.get(PENDING)
+    if pending is not None:
+        pending.extend(new_events)
+
+
+def record_added(session, bookmarks: Iterable, ids: Iterable = None) -> None:
+    """
+    Bookmarks or add_rows column dicts. ids can be left out by the bulk
+    paths that don't read them back, the title is unique too.
+    """
+    if not recording(session):
+        return
+    bookmarks = [bookmark if isinstance(bookmark, dict) else bookmark.__dict__ for bookmark in bookmarks]
+    ids = [bookmark.get("id") for bookmark in bookmarks] if ids is None else ids
+    record(session, (
+        events.BookmarkAdded(
+            id=id,
+            title=bookmark["title"],
+            url=bookmark["url"],
+            date_added=bookmark.get("date_added"),
+            bookmark_notes=bookmark.get("notes"),
+        )
+        for id, bookmark in zip(ids, bookmarks)
+    ))
+
+
+def record_edited(session, bookmarks: Iterable) -> None:
+    """
+    Bookmarks or column dicts, with the columns that were written
+    """
+    if not recording(session):
+        return
+    bookmarks = [bookmark if isinstance(bookmark, dict) else bookmark.__dict__ for bookmark in bookmarks]
+    record(session, (
+        events.BookmarkEdited(
+            id=bookmark.get("id"),
+            title=bookmark.get("title"),
+            url=bookmark.get("url"),
+            date_edited=bookmark.get("date_edited"),
+            bookmark_notes=bookmark.get("notes"),
+        )
+        for bookmark in bookmarks
+    ))
+
+
+def record_deleted(session, ids: Iterable[int]) -> None:
+    if not recording(session):
+        return
+    record(session, (
+        events.BookmarkDeleted(bookmark=Bookmark(id, None, None, None, None, None)) for id in ids
+    ))
+
+
+def payload(domain_event: events.Event) -> dict:
+    if isinstance(domain_event, events.BookmarkDeleted):
+        return dict(id=domain_event.bookmark.id)
+    return dict(domain_event.__dict__)
+
+
+def write(session, pending: list) -> None:
+    """
+    Inserts the events with one executemany. On SQLite the rows go straight
+    to the driver, a bulk import has as many events as bookmarks and
+    SQLAlchemy's per-row parameter handling would double its time.
+    """
+    created = datetime.now()
+    if session.get_bind().dialect.name == "sqlite":
+        # the text SQLAlchemy's sqlite DateTime type stores
+        created = created.isoformat(" ", "microseconds")
+        session.connection().exec_driver_sql(SQLITE_INSERT, [
+            (topic(type(domain_event)), serializers.dumps(payload(domain_event)).decode(), created)
+            for domain_event in pending
+        ])
+    else:
+        session.execute(insert(orm.outbox), [
+            dict(topic=topic(type(domain_event)), payload=serializers.dumps(payload(domain_event)).decode(), created=created)
+            for domain_event in pending
+        ])
+
+
+@event.listens_for(Session, "before_commit")
+def _write_pending(session) -> None:
+    pending = session.info.get(PENDING)
+    if pending:
+        write(session, pending)
+        pending.clear()
+        session.info[PENDING + "_written"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_relay(session) -> None:
+    if session.info.pop(PENDING + "_written", False):
+        written.set()
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session) -> None:
+    # the changes the events were about are gone with the transaction
+    pending = session.info.get(PENDING)
+    if pending:
+        pending.clear()
+    session.info.pop(PENDING + "_written", None)
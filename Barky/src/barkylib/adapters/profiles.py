@@ -0,0 +1,287 @@
+"""
+Profiles of single API requests, taken on demand.
+
+A request is profiled when it carries a signed X-Barky-Profile header, or at
+random for a share of requests. The header is a token that sign_token makes
+from the shared secret (see the profile-token CLI command), so it can't be
+forged or replayed after it expires:
+
+    X-Barky-Profile: <expires>.<mode>.<hmac sha256 of "<expires>.<mode>">
+
+Two profilers:
+- cprofile: deterministic, every call is timed; saved as a pstats file
+- sampling: a thread reads the request thread's stack every millisecond;
+  saved as folded stacks ("module:function;module:function count" lines)
+  that flame graph tools read. Much cheaper on busy code paths.
+
+Profiles are kept in a ProfileStore, the most recent ones in memory and
+optionally written to a directory too.
+"""
+import cProfile
+import hashlib
+import hmac
+import io
+import logging
+import marshal
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+MODES = ("cprofile", "sampling")
+HEADER = "X-Barky-Profile"
+ID_HEADER = "X-Barky-Profile-Id"
+# seconds between samples of the sampling profiler
+SAMPLE_INTERVAL = 0.001
+# deepest stack the sampling profiler records
+MAX_DEPTH = 100
+# what a request id taken from X-Request-Id may look like, it ends up in file names
+REQUEST_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+EXTENSIONS = {"cprofile": ".prof", "sampling": ".folded"}
+
+
+def sign_token(secret: str, mode: str = "cprofile", ttl: int = 300, now: float = None) -> str:
+    if mode not in MODES:
+        raise ValueError(f"Unknown profiler {mode}, pick one of {', '.join(MODES)}")
+    payload = f"{int((now or time.time()) + ttl)}.{mode}"
+    return f"{payload}.{signature(secret, payload)}"
+
+
+def verify_token(secret: str, token: str, now: float = None) -> Optional[str]:
+    """
+    The profiler the token asks for, or None when it's invalid or expired
+    """
+    if not secret or not token:
+        return None
+    payload, _, digest = token.strip().rpartition(".")
+    expires, _, mode = payload.partition(".")
+    if mode not in MODES or not expires.isdigit():
+        return None
+    if not hmac.compare_digest(signature(secret, payload), digest):
+        return None
+    return mode if int(expires) >= (now or time.time()) else None
+
+
+def signature(secret: str, payload: str) -> str:
+    return hmac.new(secret.encode(), payload.encode(), hashlib.sha256).hexdigest()
+
+
+class Profile(NamedTuple):
+    id: str
+    mode: str
+    method: str
+    path: str
+    endpoint: Optional[str]
+    status: Optional[int]
+    seconds: float
+    created: datetime
+    data: bytes
+
+    @property
+    def filename(self) -> str:
+        return self.id + EXTENSIONS[self.mode]
+
+    def summary(self) -> dict:
+        return dict(
+            id=self.id,
+            mode=self.mode,
+            method=self.method,
+            path=self.path,
+            endpoint=self.endpoint,
+            status=self.status,
+            seconds=round(self.seconds, 6),
+            created=self.created.isoformat(),
+            size=len(self.data),
+            filename=self.filename,
+        )
+
+    def text(self, limit: int = 50) -> str:
+        """
+        Readable form: the top functions by cumulative time for cprofile,
+        the folded stacks as they are for sampling
+        """
+        if self.mode == "sampling":
+            return self.data.decode()
+        stream = io.StringIO()
+        stats = load_stats(self.data)
+        stats.stream = stream
+        stats.sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+
+class CProfiler:
+    mode = "cprofile"
+
+    def __init__(self) -> None:
+        self.profiler = cProfile.Profile()
+
+    def start(self) -> None:
+        self.profiler.enable()
+
+    def stop(self) -> bytes:
+        self.profiler.disable()
+        self.profiler.create_stats()
+        # the format pstats.Stats.dump_stats writes
+        return marshal.dumps(self.profiler.stats)
+
+
+class SamplingProfiler:
+    mode = "sampling"
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._sample, name="barky-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> bytes:
+        self._stopped.set()
+        self._thread.join()
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return ("\n".join(lines) + "\n").encode() if lines else b""
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            names = list()
+            while frame is not None and len(names) < MAX_DEPTH:
+                code = frame.f_code
+                names.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+
+PROFILERS = {"cprofile": CProfiler, "sampling": SamplingProfiler}
+
+
+def load_stats(data: bytes) -> pstats.Stats:
+    stats = pstats.Stats()
+    stats.stats = marshal.loads(data)
+    # what Stats.load_stats works out after reading a file
+    stats.get_top_level_stats()
+    return stats
+
+
+class ProfileStore:
+    def __init__(self, keep: int = 50, directory: str = None) -> None:
+        self.keep = keep
+        self.directory = directory
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles[profile.id] = profile
+            self._profiles.move_to_end(profile.id)
+            while len(self._profiles) > self.keep:
+                self._profiles.popitem(last=False)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, profile.filename), "wb") as file:
+                file.write(profile.data)
+
+    def get(self, id: str) -> Optional[Profile]:
+        return self._profiles.get(id)
+
+    def recent(self) -> list[Profile]:
+        """
+        Newest first
+        """
+        with self._lock:
+            return list(reversed(self._profiles.values()))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._profiles.clear()
+
+
+class RequestProfiling:
+    """
+    Decides which requests to profile and keeps their profiles
+    """
+
+    def __init__(
+        self,
+        secret: str = None,
+        sample_rate: float = 0.0,
+        mode: str = "sampling",
+        keep: int = 50,
+        directory: str = None,
+    ) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiler {mode}, pick one of {', '.join(MODES)}")
+        if sample_rate and not secret:
+            # the admin endpoints take a token signed with the secret
+            if not directory:
+                raise ValueError(
+                    "BARKY_PROFILE_SAMPLE_RATE needs BARKY_PROFILE_SECRET or BARKY_PROFILE_DIR, "
+                    "without either the profiles could never be read"
+                )
+            logger.warning("no BARKY_PROFILE_SECRET, sampled profiles are only written to %s", directory)
+        self.secret = secret
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.store = ProfileStore(keep, directory)
+
+    def choose(self, token: str = None) -> Optional[str]:
+        """
+        The profiler to use for a request, None to leave it alone
+        """
+        if token:
+            mode = verify_token(self.secret, token)
+            if mode is not None:
+                return mode
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.mode
+        return None
+
+    def start(self, mode: str, request_id: str = None) -> Optional[tuple]:
+        """
+        Pass what this returns to finish. None when the profiler can't start,
+        cProfile refuses to run while another profiler is on in the thread.
+        """
+        if not request_id or not REQUEST_ID.match(request_id):
+            request_id = os.urandom(8).hex()
+        profiler = PROFILERS[mode]()
+        try:
+            profiler.start()
+        except ValueError:
+            return None
+        return request_id, profiler, time.perf_counter()
+
+    def finish(self, started: tuple, method: str, path: str, endpoint: str = None, status: int = None) -> Profile:
+        request_id, profiler, start = started
+        data = profiler.stop()
+        profile = Profile(
+            id=request_id,
+            mode=profiler.mode,
+            method=method,
+            path=path,
+            endpoint=endpoint,
+            status=status,
+            seconds=time.perf_counter() - start,
+            created=datetime.now(),
+            data=data,
+        )
+        self.store.save(profile)
+        return profile
+
+    def allowed(self, token: str) -> bool:
+        """
+        The admin endpoints take the same signed token as the header
+        """
+        return verify_token(self.secret, token) is not None
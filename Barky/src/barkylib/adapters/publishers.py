@@ -0,0 +1,101 @@
+"""
+Where services/relay.py sends the events it takes from the outbox. A
+publisher gets a whole batch at once, so it can send it in one round trip.
+
+Each message body is {"outbox_id": ..., "event": <payload>}. Delivery is at
+least once: a relay that dies after publishing a batch and before deleting
+it publishes the batch again, consumers can tell by the outbox_id.
+"""
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, NamedTuple
+
+from barkylib import config
+
+CHANNEL_PREFIX = "barky."
+
+
+class Message(NamedTuple):
+    outbox_id: int
+    topic: str
+    # the event as JSON, the outbox payload column
+    payload: str
+
+    @property
+    def channel(self) -> str:
+        return CHANNEL_PREFIX + self.topic
+
+    def body(self) -> str:
+        # the payload is JSON already, it isn't decoded just to be encoded again
+        return f'{{"outbox_id":{self.outbox_id},"event":{self.payload}}}'
+
+
+class AbstractPublisher(ABC):
+    @abstractmethod
+    def publish_many(self, messages: list[Message]) -> None:
+        """
+        Sends the messages in order, raises if any of them may not have gone out
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class RedisPublisher(AbstractPublisher):
+    """
+    PUBLISHes to barky.<topic> channels, a batch at a time through one
+    pipeline: one round trip instead of one per event
+    """
+
+    def __init__(self, client=None) -> None:
+        """
+        client is a redis.Redis, one on get_redis_host_and_port by default
+        """
+        if client is None:
+            # imported here, the API imports this module with the outbox off too
+            import redis
+
+            client = redis.Redis(**config.get_redis_host_and_port())
+        self.client = client
+
+    def publish_many(self, messages: list[Message]) -> None:
+        # no MULTI/EXEC, the batch only needs to go out in order
+        pipe = self.client.pipeline(transaction=False)
+        for message in messages:
+            pipe.publish(message.channel, message.body())
+        pipe.execute()
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class InMemoryPublisher(AbstractPublisher):
+    """
+    Keeps the messages, and passes them to the subscribers of their channel,
+    for tests and a single process that wants its own events
+    """
+
+    def __init__(self) -> None:
+        self.messages = list()
+        self.subscribers = dict()
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel: str, callback: Callable[[Message], None]) -> None:
+        self.subscribers.setdefault(channel, list()).append(callback)
+
+    def publish_many(self, messages: list[Message]) -> None:
+        with self._lock:
+            self.messages += messages
+        for message in messages:
+            for callback in self.subscribers.get(message.channel, ()):
+                callback(message)
+
+
+PUBLISHERS = {"redis": RedisPublisher, "memory": InMemoryPublisher}
+
+
+def create_publisher(name: str) -> AbstractPublisher:
+    if name not in PUBLISHERS:
+        raise ValueError(f"Unknown publisher {name}, pick one of {', '.join(PUBLISHERS)}")
+    return PUBLISHERS[name]()
@@ -0,0 +1,189 @@
+"""
+Records the statements run inside one unit of work, to catch slow queries and
+access patterns that only show up in a profiler otherwise.
+
+- statements slower than a threshold are logged with their parameters and
+  the handler that ran them
+- a statement run many times in one unit of work is reported when the unit of
+  work ends, it's usually a query per row (N+1) or an UPDATE and commit per
+  row in a loop; the same goes for many commits, except those of a batch
+  (a chunked import commits once per chunk)
+- in strict mode those reports raise RepeatedStatementsError instead, so a
+  test suite run with BARKY_QUERY_STRICT=1 fails on them
+
+SqlAlchemyUnitOfWork starts a recorder when config.get_query_log_settings()
+turns it on, and the listeners from instrument_engine add to whichever
+recorder is current in the context they run in.
+"""
+import logging
+import sys
+import time
+import weakref
+from collections import Counter
+from contextvars import ContextVar
+from typing import NamedTuple, Optional
+
+from sqlalchemy import event
+
+from barkylib.adapters import metrics
+
+logger = logging.getLogger(__name__)
+
+# runs of one statement, or commits, in a unit of work before they're reported
+DEFAULT_REPEAT_LIMIT = 10
+# statements binding more parameters than this are batches (multi-row inserts,
+# chunks of an IN list), running them over and over is how bulk writes work
+MAX_ROW_PARAMETERS = 8
+# where the calling handler is looked for, the first frame outside the
+# database code is used when there is none
+HANDLER_MODULES = ("barkylib.services.handlers", "barkylib.services.async_handlers")
+DATABASE_MODULES = ("sqlalchemy.", "barkylib.adapters.", "barkylib.services.unit_of_work", "contextlib")
+
+
+class RepeatedStatementsError(AssertionError):
+    pass
+
+
+class Statement(NamedTuple):
+    statement: str
+    seconds: float
+    # bound parameters, or rows for an executemany
+    size: int
+    executemany: bool
+
+
+class StatementRecorder:
+    def __init__(self, slow_ms: Optional[float] = None, repeat_limit: int = DEFAULT_REPEAT_LIMIT, strict: bool = False):
+        self.slow_seconds = None if slow_ms is None else slow_ms / 1000
+        self.repeat_limit = repeat_limit
+        self.strict = strict
+        # parameters aren't kept, a bulk import would hold on to every row
+        self.statements = list()
+        self.commits = 0
+        # whether a batch ran since the last commit
+        self._batched = False
+
+    def record(self, statement: str, parameters, seconds: float, executemany: bool) -> None:
+        size = len(parameters) if parameters else 0
+        self.statements.append(Statement(statement, seconds, size, executemany))
+        if executemany or size > MAX_ROW_PARAMETERS:
+            self._batched = True
+        if self.slow_seconds is not None and seconds >= self.slow_seconds:
+            logger.warning(
+                "slow statement, %.1f ms in %s: %s %r",
+                seconds * 1000,
+                calling_handler(),
+                statement,
+                parameters if not executemany else f"{size} rows",
+            )
+
+    def commit(self) -> None:
+        """
+        Counts a commit, unless it commits a batch
+        """
+        if self._batched:
+            self._batched = False
+        else:
+            self.commits += 1
+
+    @property
+    def seconds(self) -> float:
+        return sum(statement.seconds for statement in self.statements)
+
+    def repeated(self) -> dict[str, int]:
+        """
+        Statements (and COMMIT) that ran more than repeat_limit times, batches
+        and their commits aside, with how often they ran
+        """
+        counts = Counter(
+            statement.statement
+            for statement in self.statements
+            if not statement.executemany and statement.size <= MAX_ROW_PARAMETERS
+        )
+        repeated = {statement: count for statement, count in counts.items() if count > self.repeat_limit}
+        if self.commits > self.repeat_limit:
+            repeated["COMMIT"] = self.commits
+        return repeated
+
+    def check(self, handler: str = None) -> None:
+        repeated = self.repeated()
+        if not repeated:
+            return
+        handler = handler or calling_handler()
+        lines = [
+            f"{count} x {metrics.statement_shape(statement)}: {' '.join(statement.split())}"
+            for statement, count in sorted(repeated.items(), key=lambda item: -item[1])
+        ]
+        message = f"likely N+1 queries or a commit per row in {handler}:\n  " + "\n  ".join(lines)
+        if self.strict:
+            raise RepeatedStatementsError(message)
+        logger.warning(message)
+
+
+_recorder = ContextVar("barky_statement_recorder", default=None)
+_instrumented = weakref.WeakSet()
+
+
+def start(recorder: StatementRecorder):
+    """
+    Makes recorder the current one, pass what this returns to stop
+    """
+    return _recorder.set(recorder)
+
+
+def stop(token) -> None:
+    try:
+        _recorder.reset(token)
+    except ValueError:
+        # stopped in another context than it started, nothing to restore
+        pass
+
+
+def current() -> Optional[StatementRecorder]:
+    return _recorder.get()
+
+
+def instrument_engine(engine) -> None:
+    """
+    Adds the listeners that feed the current recorder. Nothing is recorded
+    outside a recorder; instrumenting the same engine twice does nothing.
+    """
+    if engine in _instrumented:
+        return
+    _instrumented.add(engine)
+    perf_counter = time.perf_counter
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if _recorder.get() is not None:
+            context._barky_recorded = perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        recorder = _recorder.get()
+        started = getattr(context, "_barky_recorded", None)
+        if recorder is not None and started is not None:
+            recorder.record(statement, parameters, perf_counter() - started, executemany)
+
+    @event.listens_for(engine, "commit")
+    def commit(conn):
+        recorder = _recorder.get()
+        if recorder is not None:
+            recorder.commit()
+
+
+def calling_handler() -> str:
+    """
+    module.function of the handler on the stack, or the first caller outside
+    the database code
+    """
+    frame = sys._getframe(1)
+    fallback = None
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module in HANDLER_MODULES:
+            return f"{module}.{frame.f_code.co_name}"
+        if fallback is None and module != __name__ and not module.startswith(DATABASE_MODULES):
+            fallback = f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return fallback or "unknown"
@@ -1,13 +1,17 @@
+import base64
 import json
+import re
 from abc import ABC, abstractmethod
 from datetime import datetime
 
 # making use of type hints: https://docs.python.org/3/library/typing.html
-from typing import List, Set
+from typing import Iterable, Iterator, List, Optional, Set
 
+from barkylib import config
+from barkylib.adapters import metrics, orm, outbox, serializers
+from barkylib.adapters.cache import BookmarkCache
 from barkylib.adapters.orm import mapper_registry
 from barkylib.domain.models import Bookmark
-from collections import UserDict
 
 
 class AbstractRepository(ABC):
@@ -15,13 +19,28 @@ class AbstractRepository(ABC):
         self.seen = set()
 
     @abstractmethod
-    def add_one(bookmark) -> None:
+    def add_one(bookmark, bulk=False) -> int:
         raise NotImplementedError("Derived classes must implement add_one")
 
     @abstractmethod
-    def add_many(bookmarks) -> None:
+    def add_many(bookmarks, bulk=False) -> list[int]:
         raise NotImplementedError("Derived classes must implement add_many")
 
+    def add_rows(self, rows: list[dict], chunk_size: Optional[int] = None) -> int:
+        """
+        Adds bookmarks given as column dicts (without ids) and returns how many
+        were added. For bulk loads that don't need the new ids back.
+        """
+        return len(self.add_many([Bookmark(id=None, **row) for row in rows], bulk=True))
+
+    @abstractmethod
+    def add_new_rows(rows, chunk_size=None) -> list[bool]:
+        raise NotImplementedError("Derived classes must implement add_new_rows")
+
+    @abstractmethod
+    def upsert_many(rows, update_columns=None, chunk_size=None) -> dict:
+        raise NotImplementedError("Derived classes must implement upsert_many")
+
     @abstractmethod
     def delete_one(bookmark) -> None:
         raise NotImplementedError("Derived classes must implement delete_one")
@@ -30,16 +49,27 @@ class AbstractRepository(ABC):
     def delete_many(bookmarks) -> None:
         raise NotImplementedError("Derived classes must implement delete_many")
 
+    @abstractmethod
+    def delete_by_ids(ids) -> int:
+        raise NotImplementedError("Derived classes must implement delete_by_ids")
+
     @abstractmethod
     def get(self, id: int) -> Bookmark:
         raise NotImplementedError("Derived classes must implement update")
 
+    def get_dict(self, id: int) -> Optional[dict]:
+        """
+        Returns the bookmark serialized the way the API sends it, or None
+        """
+        bookmark = self.get(id)
+        return None if bookmark is None else json.loads(bookmark.to_json())
+
     @abstractmethod
     def update(bookmark) -> int:
         raise NotImplementedError("Derived classes must implement update")
 
     @abstractmethod
-    def update_many(bookmarks) -> int:
+    def update_many(bookmarks) -> list[int]:
         raise NotImplementedError("Derived classes must implement update_many")
 
     @abstractmethod
@@ -50,13 +80,84 @@ class AbstractRepository(ABC):
     def find_all(query) -> list[Bookmark]:
         raise NotImplementedError("Derived classes must implement find_all")
 
+    @abstractmethod
+    def find_page(query, after=None, limit=None, sort='id') -> tuple[list[Bookmark], Optional[str]]:
+        raise NotImplementedError("Derived classes must implement find_page")
+
+    @abstractmethod
+    def stream_all(query, batch_size=None) -> Iterator[Bookmark]:
+        raise NotImplementedError("Derived classes must implement stream_all")
+
+    @abstractmethod
+    def find_rows(query) -> list:
+        raise NotImplementedError("Derived classes must implement find_rows")
+
+    @abstractmethod
+    def stream_rows(query, batch_size=None) -> Iterator:
+        raise NotImplementedError("Derived classes must implement stream_rows")
+
+    @abstractmethod
+    def search(text, limit=None, offset=0) -> list[dict]:
+        raise NotImplementedError("Derived classes must implement search")
+
 
 # sqlalchemy stuff
-from sqlalchemy import create_engine, select, update, delete
+from sqlalchemy import String, and_, bindparam, create_engine, literal, or_, select, insert, text, tuple_, type_coerce, update, delete
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import MetaData
 
 
+# columns update_many writes when they are set on the bookmark
+UPDATABLE_COLUMNS = ('url', 'title', 'notes')
+# the default SQLITE_MAX_VARIABLE_NUMBER of older sqlite builds
+SQLITE_MAX_VARIABLES = 999
+DEFAULT_PAGE_SIZE = 100
+# rows fetched from the server side cursor at a time when streaming
+STREAM_BATCH_SIZE = 1000
+MAX_PAGE_SIZE = 1000
+# what the read-model queries select, in serializers.COLUMNS order; sqlite hands
+# the dates back as the stored text so they don't need parsing and formatting
+READ_COLUMNS = tuple(orm.bookmarks.c[column] for column in serializers.COLUMNS)
+SQLITE_READ_COLUMNS = tuple(
+    type_coerce(column, String).label(column.name) if column.name in serializers.DATE_COLUMNS else column
+    for column in READ_COLUMNS
+)
+SEARCH_SQL = text("""
+    SELECT b.id, b.title, b.url, b.notes, b.date_added, b.date_edited,
+           bookmarks_fts.rank,
+           snippet(bookmarks_fts, -1, :open, :close, '…', 12)
+    FROM bookmarks_fts JOIN bookmarks AS b ON b.id = bookmarks_fts.rowid
+    WHERE bookmarks_fts MATCH :query
+    ORDER BY bookmarks_fts.rank
+    LIMIT :limit OFFSET :offset
+""")
+# wrapped around the matched words in search snippets
+SNIPPET_MARKS = ('<mark>', '</mark>')
+# the columns add_rows takes, and how many rows go in one INSERT on sqlite
+ROW_COLUMNS = ('title', 'url', 'notes', 'date_added', 'date_edited')
+ROW_VALUES = '(' + ', '.join('?' * len(ROW_COLUMNS)) + ')'
+SQLITE_ROWS_PER_INSERT = SQLITE_MAX_VARIABLES // len(ROW_COLUMNS)
+# appended to sqlite_insert_sql by add_new_rows
+SQLITE_SKIP_TAKEN = ' ON CONFLICT (title) DO NOTHING RETURNING title'
+# columns upsert_many can overwrite when the title is already there, and the
+# ones it does by default; a row it changes gets date_edited set to now, like
+# update_many, unless date_edited is one of the columns
+UPSERT_COLUMNS = ('url', 'notes', 'date_added', 'date_edited')
+DEFAULT_UPSERT_COLUMNS = ('url', 'notes')
+# RETURNING rows come back in no set order (SQLAlchemy only sorts them from
+# 2.0.10), so bulk inserts match the ids to their rows by the unique title
+BULK_INSERT = insert(orm.bookmarks).returning(orm.bookmarks.c.id, orm.bookmarks.c.title)
+# the SET clause is filled in from the keys of the executemany rows
+UPDATE_BY_ID = update(orm.bookmarks).where(orm.bookmarks.c.id == bindparam('b_id'))
+# columns find_page can order by, id is always added as the tie breaker
+SORT_COLUMNS = {
+    'id': orm.bookmarks.c.id,
+    'title': orm.bookmarks.c.title,
+    'date_added': orm.bookmarks.c.date_added,
+    'date_edited': orm.bookmarks.c.date_edited,
+}
+
+
 class SqlAlchemyRepository(AbstractRepository):
     """
     Uses guidance from the basic SQLAlchemy 2.0 tutorial:
@@ -90,16 +191,158 @@ class SqlAlchemyRepository(AbstractRepository):
         self.Session.commit()
         self.Session.close()
 
-    def add_one(self, bookmark: Bookmark) -> None:
+    def add_one(self, bookmark: Bookmark, bulk: bool = False) -> int:
         bookmarks = list()
         if bookmark:
             bookmarks.append(bookmark)
-            self.add_many(bookmarks)
+            return self.add_many(bookmarks, bulk=bulk)[0]
 
-    def add_many(self, bookmarks: list[Bookmark]) -> None:
-        if bookmarks:
+    def add_many(
+        self,
+        bookmarks: list[Bookmark],
+        bulk: bool = False,
+        chunk_size: Optional[int] = None,
+    ) -> list[int]:
+        """
+        Adds the bookmarks and returns their ids in the same order.
+
+        The default path goes through the ORM unit of work. With bulk=True the
+        rows are written with Core insert() executemany in chunks of chunk_size
+        (config.get_bulk_chunk_size() by default), all inside one transaction.
+        Bulk mode skips the identity map, so the passed objects are not refreshed.
+        """
+        if not bookmarks:
+            return []
+
+        if bulk:
+            ids = self._bulk_insert(bookmarks, chunk_size or config.get_bulk_chunk_size())
+        else:
             self.Session.add_all(bookmarks)
+            self.Session.flush()
+            # read before the commit expires them, otherwise every id is a SELECT
+            ids = [bookmark.id for bookmark in bookmarks]
+
+        outbox.record_added(self.Session, bookmarks, ids)
+        self.Session.commit()
+        return ids
+
+    def _bulk_insert(self, bookmarks: list[Bookmark], chunk_size: int) -> list[int]:
+        ids = [None] * len(bookmarks)
+        for start in range(0, len(bookmarks), chunk_size):
+            for positions, rows in insert_groups(bookmarks, start, start + chunk_size):
+                place_ids(ids, positions, rows, self.Session.execute(BULK_INSERT, rows))
+        return ids
+
+    def add_rows(self, rows: list[dict], chunk_size: Optional[int] = None) -> int:
+        """
+        Inserts the rows in one transaction without building Bookmark objects
+        or reading ids back. On sqlite they go in as multi-row INSERTs of
+        preformatted values, skipping SQLAlchemy's per-row parameter handling;
+        elsewhere as Core insert() executemany in chunks of chunk_size.
+        """
+        if not rows:
+            return 0
+
+        if self.Session.get_bind().dialect.name == 'sqlite':
+            connection = self.Session.connection()
+            for start in range(0, len(rows), SQLITE_ROWS_PER_INSERT):
+                chunk = rows[start:start + SQLITE_ROWS_PER_INSERT]
+                connection.exec_driver_sql(sqlite_insert_sql(len(chunk)), sqlite_row_params(chunk))
+        else:
+            chunk_size = chunk_size or config.get_bulk_chunk_size()
+            stmt = insert(orm.bookmarks)
+            for start in range(0, len(rows), chunk_size):
+                self.Session.execute(stmt, rows[start:start + chunk_size])
+
+        outbox.record_added(self.Session, rows)
+        self.Session.commit()
+        return len(rows)
+
+    def add_new_rows(self, rows: list[dict], chunk_size: Optional[int] = None) -> list[bool]:
+        """
+        add_rows for rows whose title may be taken: they go in with INSERT ...
+        ON CONFLICT (title) DO NOTHING RETURNING title, so a taken title is
+        skipped instead of failing the transaction, and there is still one
+        commit. Returns whether each row went in; of rows repeating a title
+        the first one does.
+        """
+        if not rows:
+            return []
+
+        added = set()
+        dialect_name = self.Session.get_bind().dialect.name
+        if dialect_name == 'sqlite':
+            connection = self.Session.connection()
+            for start in range(0, len(rows), SQLITE_ROWS_PER_INSERT):
+                chunk = rows[start:start + SQLITE_ROWS_PER_INSERT]
+                result = connection.exec_driver_sql(sqlite_insert_sql(len(chunk)) + SQLITE_SKIP_TAKEN, sqlite_row_params(chunk))
+                added.update(title for title, in result)
+        else:
+            chunk_size = chunk_size or config.get_bulk_chunk_size()
+            stmt = upsert_statement(dialect_name, ()).returning(orm.bookmarks.c.title)
+            for start in range(0, len(rows), chunk_size):
+                added.update(self.Session.execute(stmt, rows[start:start + chunk_size]).scalars())
+
+        inserted = list()
+        for row in rows:
+            inserted.append(row['title'] in added)
+            added.discard(row['title'])
+        outbox.record_added(self.Session, [row for row, new in zip(rows, inserted) if new])
+        self.Session.commit()
+        return inserted
+
+    def upsert_many(
+            self,
+            rows: list[dict],
+            update_columns: Optional[Iterable[str]] = DEFAULT_UPSERT_COLUMNS,
+            chunk_size: Optional[int] = None,
+    ) -> dict:
+        """
+        Adds the rows (column dicts like add_rows takes) whose title is new
+        and overwrites update_columns of the ones whose title is taken, with
+        INSERT ... ON CONFLICT (title) DO UPDATE sent as one executemany per
+        chunk_size rows, all in one transaction.
+
+        Each chunk's titles are looked up first: that gives the counts, and
+        rows that would change nothing aren't sent at all, so re-syncing the
+        same data again is mostly reads. Returns inserted, updated and
+        unchanged counts.
+        """
+        update_columns = upsert_columns(update_columns)
+        chunk_size = chunk_size or config.get_bulk_chunk_size()
+        date_edited = datetime.now()
+        stmt = upsert_statement(self.Session.get_bind().dialect.name, update_columns, date_edited)
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        # (id of the row updated, None for an insert, row) for the outbox
+        changes = list() if outbox.recording(self.Session) else None
+
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            existing = self._existing_rows([row['title'] for row in chunk], update_columns)
+            writes = upsert_writes(chunk, existing, update_columns, counts, changes)
+            if writes:
+                self.Session.execute(stmt, writes)
+
+        if changes:
+            outbox.record_added(self.Session, [row for id, row in changes if id is None])
+            outbox.record_edited(self.Session, [
+                dict(row, id=id, date_edited=upsert_date_edited(row, update_columns, date_edited))
+                for id, row in changes if id is not None
+            ])
+        if rows:
             self.Session.commit()
+        return counts
+
+    def _existing_rows(self, titles: list[str], columns: tuple) -> dict:
+        select_columns = [orm.bookmarks.c.id, orm.bookmarks.c.title, *(orm.bookmarks.c[column] for column in columns)]
+        existing = dict()
+        for start in range(0, len(titles), SQLITE_MAX_VARIABLES):
+            result = self.Session.execute(
+                select(*select_columns).where(orm.bookmarks.c.title.in_(titles[start:start + SQLITE_MAX_VARIABLES]))
+            )
+            for row in result:
+                existing[row.title] = dict(row._mapping)
+        return existing
 
     def delete_one(self, bookmark: Bookmark) -> None:
         bookmarks = list()
@@ -108,18 +351,30 @@ class SqlAlchemyRepository(AbstractRepository):
             self.delete_many(bookmarks)
 
     def delete_many(self, bookmarks: list[Bookmark]) -> None:
-
         if bookmarks:
-            ids = list()
-            for bookmark in bookmarks:
-                try:
-                    ids.append(bookmark['id'])
-                except Exception as e:
-                    ids.append(bookmark.id)
+            self.delete_by_ids([bookmark_id(bookmark) for bookmark in bookmarks])
 
-            stmt = delete(Bookmark).where(Bookmark.id.in_(ids))
-            self.Session.execute(stmt)
+    def delete_by_ids(self, ids: Iterable) -> int:
+        """
+        Deletes the bookmarks with these ids without loading them first and
+        returns how many rows went. The ids go SQLITE_MAX_VARIABLES to a
+        statement, all in one transaction.
+        """
+        ids = delete_ids(ids)
+        deleted = 0
+        recording = outbox.recording(self.Session)
+        for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+            stmt = delete(Bookmark).where(Bookmark.id.in_(ids[start:start + SQLITE_MAX_VARIABLES]))
+            if recording:
+                # only the ids that were there get an event
+                gone = self.Session.scalars(stmt.returning(Bookmark.id)).all()
+                outbox.record_deleted(self.Session, gone)
+                deleted += len(gone)
+            else:
+                deleted += self.Session.execute(stmt).rowcount
+        if ids:
             self.Session.commit()
+        return deleted
 
     def get(self, id: int) -> Bookmark:
         # https://docs.sqlalchemy.org/en/20/orm/session_basics.html#get-by-primary-key
@@ -134,40 +389,57 @@ class SqlAlchemyRepository(AbstractRepository):
 
         return bookmark
 
+    def get_dict(self, id: int) -> Optional[dict]:
+        rows = self.Session.execute(self._read_query(select(Bookmark).where(Bookmark.id == id))).all()
+        rows_returned(self.Session, 'get_dict', len(rows))
+        return serializers.row_to_dict(rows[0]) if rows else None
+
     def update(self, bookmark) -> int:
         if bookmark is None:
             return 'Error', 400
         else:
             bookmarks = list()
             bookmarks.append(bookmark)
-            return self.update_many(bookmarks)
+            counts = self.update_many(bookmarks)
+            return counts if isinstance(counts, tuple) else counts[0]
 
-    def update_many(self,  bookmarks: list[Bookmark]) -> int:
+    def update_many(self, bookmarks: list[Bookmark]) -> list[int]:
+        """
+        Updates the bookmarks in one transaction and returns the number of rows
+        affected for each of them (0 when the id doesn't exist), in input order.
+
+        Only the columns that are set on a bookmark are written, so the rows are
+        grouped by that set of columns and each group runs as one executemany.
+        """
         if bookmarks is None:
             return 'Error', 400
         else:
             try:
-                for bookmark in bookmarks:
-                    id = int(bookmark.id)
-                    bmark = {} # Creating a temp obj so we don't delete any info when editing! I'm sure there's a better way...
-                    if bookmark.id is not None:
-                        bmark['id'] = bookmark.id
-                    if bookmark.url is not None:
-                        bmark['url'] = bookmark.url
-                    if bookmark.title is not None:
-                        bmark['title'] = bookmark.title
-                    if bookmark.notes is not None:
-                        bmark['notes'] = bookmark.notes
-
-                    bmark['date_edited'] = datetime.now()
-
-                    stmt = update(Bookmark).where(Bookmark.id == id).values(UserDict(bmark))
-                    self.Session.execute(stmt)
-                    self.Session.commit()
-
-                return 200
+                affected = 0
+                groups = update_groups(bookmarks)
+                for rows in groups:
+                    affected += self.Session.execute(UPDATE_BY_ID, rows).rowcount
+
+                ids = [int(bookmark.id) for bookmark in bookmarks]
+                if affected == len(ids):
+                    counts = [1] * len(ids)
+                else:
+                    # only look the ids up when some of them didn't match a row
+                    found = set()
+                    for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+                        found.update(self.Session.scalars(
+                            select(orm.bookmarks.c.id).where(
+                                orm.bookmarks.c.id.in_(ids[start:start + SQLITE_MAX_VARIABLES])
+                            )
+                        ))
+                    counts = [1 if id in found else 0 for id in ids]
+
+                record_updates(self.Session, groups, counts, ids)
+                self.Session.commit()
+                return counts
             except Exception as e:
                 print(e)
+                self.Session.rollback()
                 return 'Error', 400
 
     def find_first(self, query) -> Bookmark:
@@ -184,9 +456,675 @@ class SqlAlchemyRepository(AbstractRepository):
     def find_all(self, query) -> list[Bookmark]:
         query = select(Bookmark) if query is None else query
         bookmarks = self.Session.scalars(query).all()
+        rows_returned(self.Session, 'find_all', len(bookmarks))
 
         if bookmarks:
             for bookmark in bookmarks:
                 self.seen.add(bookmark)
 
         return bookmarks
+
+    def find_page(
+        self,
+        query,
+        after: Optional[str] = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        sort: str = 'id',
+    ) -> tuple[list[Bookmark], Optional[str]]:
+        """
+        Keyset pagination: returns up to limit bookmarks ordered by (sort, id)
+        that come after the cursor, and the cursor of the next page (None on the
+        last one). Deep pages cost the same as the first since the cursor becomes
+        a WHERE on an index instead of an OFFSET.
+        """
+        query, limit = page_query(query, after, limit, sort)
+        rows = self.Session.scalars(query).all()
+        rows_returned(self.Session, 'find_page', len(rows))
+        bookmarks, next_cursor = next_page(rows, limit, sort)
+
+        for bookmark in bookmarks:
+            self.seen.add(bookmark)
+
+        return bookmarks, next_cursor
+
+    def stream_all(self, query, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Bookmark]:
+        """
+        Yields the bookmarks as they are read from a server side cursor, batch_size
+        rows at a time. They aren't added to seen, so memory stays flat however
+        many rows the query returns.
+        """
+        query = select(Bookmark) if query is None else query
+        yield from counted(self.Session, 'stream_all', self.Session.scalars(
+            query.execution_options(yield_per=batch_size or STREAM_BATCH_SIZE)
+        ))
+
+    def find_rows(self, query) -> list:
+        """
+        Same as find_all but returns plain result rows (see serializers.COLUMNS)
+        instead of Bookmark objects, for the read side of the API
+        """
+        rows = self.Session.execute(self._read_query(query)).all()
+        rows_returned(self.Session, 'find_rows', len(rows))
+        return rows
+
+    def stream_rows(self, query, batch_size: int = STREAM_BATCH_SIZE) -> Iterator:
+        yield from counted(self.Session, 'stream_rows', self.Session.execute(
+            self._read_query(query).execution_options(yield_per=batch_size or STREAM_BATCH_SIZE)
+        ))
+
+    def search(self, text: str, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0) -> list[dict]:
+        """
+        Full-text search over title, url and notes, best BM25 matches first.
+        Every word has to match; ending the text with * makes the last word
+        a prefix. Each result is the serialized bookmark plus its rank and a
+        snippet.
+        """
+        if self.Session.get_bind().dialect.name != 'sqlite':
+            raise NotImplementedError("Full-text search needs SQLite FTS5")
+
+        params = search_params(text, limit, offset)
+        if params is None:
+            return []
+
+        results = [search_result(row) for row in self.Session.execute(SEARCH_SQL, params)]
+        rows_returned(self.Session, 'search', len(results))
+        return results
+
+    def _read_query(self, query):
+        return read_query(query, self.Session.get_bind().dialect.name)
+
+
+def rows_returned(session, method: str, count: int) -> None:
+    # counted here since the cursor listeners run before the rows are fetched
+    if metrics.instrumented(session.get_bind()):
+        metrics.DB_ROWS_RETURNED.inc(method, amount=count)
+
+
+def counted(session, method: str, rows: Iterable) -> Iterator:
+    """
+    Yields the rows of a stream and counts them once it ends or is closed
+    """
+    count = 0
+    try:
+        for row in rows:
+            count += 1
+            yield row
+    finally:
+        rows_returned(session, method, count)
+
+
+def sqlite_insert_sql(rows: int) -> str:
+    return f"INSERT INTO bookmarks ({', '.join(ROW_COLUMNS)}) VALUES " + ", ".join([ROW_VALUES] * rows)
+
+
+def sqlite_row_params(rows: list[dict]) -> tuple:
+    """
+    The parameters of sqlite_insert_sql(len(rows)), flattened
+    """
+    params = list()
+    for row in rows:
+        params += (
+            row['title'],
+            row['url'],
+            row['notes'],
+            sqlite_datetime(row['date_added']),
+            sqlite_datetime(row['date_edited']),
+        )
+    return tuple(params)
+
+
+def sqlite_datetime(value: Optional[datetime]) -> Optional[str]:
+    """
+    The text SQLAlchemy's sqlite DateTime type stores
+    """
+    if value is None:
+        return None
+    return value.replace(tzinfo=None).isoformat(' ', 'microseconds')
+
+
+def insert_groups(bookmarks: list[Bookmark], start: int, stop: int) -> list[tuple[list[int], list[dict]]]:
+    """
+    Rows for a Core insert of bookmarks[start:stop], with their positions, in
+    runs that keep the list order. executemany needs the same keys on every
+    row, so a run ends where the rows switch between an explicit id and a
+    generated one; the runs go in one after the other, so generated ids still
+    follow the order of the list.
+    """
+    groups = list()
+    for position in range(start, min(stop, len(bookmarks))):
+        bookmark = bookmarks[position]
+        row = {
+            "title": bookmark.title,
+            "url": bookmark.url,
+            "notes": bookmark.notes,
+            "date_added": bookmark.date_added,
+            "date_edited": bookmark.date_edited,
+        }
+        if bookmark.id is not None:
+            row["id"] = bookmark.id
+        if not groups or ("id" in groups[-1][1][0]) != ("id" in row):
+            groups.append(([], []))
+        positions, rows = groups[-1]
+        positions.append(position)
+        rows.append(row)
+
+    return groups
+
+
+def place_ids(ids: list, positions: list[int], rows: list[dict], returned) -> None:
+    """
+    Puts the (id, title) rows BULK_INSERT returned for rows at their positions in ids
+    """
+    by_title = {title: id for id, title in returned}
+    for position, row in zip(positions, rows):
+        ids[position] = by_title[row["title"]]
+
+
+def update_groups(bookmarks: list[Bookmark]) -> list[list[dict]]:
+    """
+    Parameter rows for UPDATE_BY_ID, grouped by the columns they set since the
+    SET clause comes from the keys of the rows
+    """
+    date_edited = datetime.now()
+    groups = dict()
+    for bookmark in bookmarks:
+        # leaving out the None columns so we don't delete any info when editing
+        values = {
+            column: getattr(bookmark, column)
+            for column in UPDATABLE_COLUMNS
+            if getattr(bookmark, column) is not None
+        }
+        values['date_edited'] = date_edited
+        values['b_id'] = int(bookmark.id)
+        groups.setdefault(tuple(values), []).append(values)
+
+    return list(groups.values())
+
+
+def page_query(query, after: Optional[str], limit: int, sort: str) -> tuple:
+    """
+    The keyset query for find_page and the page size it was clamped to
+    """
+    query = select(Bookmark) if query is None else query
+    column = SORT_COLUMNS.get(sort or 'id')
+    if column is None:
+        raise ValueError(f"Can't page by {sort}")
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    id_column = orm.bookmarks.c.id
+
+    if after is not None:
+        value, last_id = decode_cursor(after, sort or 'id')
+        if column is id_column:
+            query = query.where(id_column > last_id)
+        elif value is None:
+            # sqlite sorts NULLs first, so after a NULL come the rest of the
+            # NULLs and then every row that has a value
+            query = query.where(or_(
+                and_(column.is_(None), id_column > last_id),
+                column.is_not(None),
+            ))
+        else:
+            query = query.where(tuple_(column, id_column) > tuple_(value, last_id))
+
+    order = (id_column,) if column is id_column else (column, id_column)
+    # fetching one extra row tells us if there is a next page
+    return query.order_by(None).order_by(*order).limit(limit + 1), limit
+
+
+def next_page(bookmarks: list[Bookmark], limit: int, sort: str) -> tuple[list[Bookmark], Optional[str]]:
+    if len(bookmarks) <= limit:
+        return bookmarks, None
+    bookmarks = bookmarks[:limit]
+    last = bookmarks[-1]
+    return bookmarks, encode_cursor(sort or 'id', getattr(last, SORT_COLUMNS[sort or 'id'].name), last.id)
+
+
+def read_query(query, dialect_name: str):
+    query = select(Bookmark) if query is None else query
+    if dialect_name == 'sqlite':
+        return query.with_only_columns(*SQLITE_READ_COLUMNS)
+    return query.with_only_columns(*READ_COLUMNS)
+
+
+def search_params(text: str, limit: int, offset: int) -> Optional[dict]:
+    query = match_query(text)
+    if query is None:
+        return None
+    return dict(
+        query=query,
+        open=SNIPPET_MARKS[0],
+        close=SNIPPET_MARKS[1],
+        limit=max(1, int(limit or DEFAULT_PAGE_SIZE)),
+        offset=max(0, int(offset or 0)),
+    )
+
+
+def search_result(row) -> dict:
+    result = serializers.row_to_dict(row[:6])
+    result['rank'] = row[6]
+    result['snippet'] = row[7]
+    return result
+
+
+def match_query(text: str) -> Optional[str]:
+    """
+    Turns what a user typed into an FTS5 query. Every word is quoted so
+    characters like - or : can't be read as FTS5 syntax. A trailing * is kept
+    as a prefix match on the last word; it is opt-in because short prefixes
+    can match a large part of the index.
+    """
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        return None
+    query = ' '.join(f'"{word}"' for word in words)
+    return query + '*' if text.rstrip().endswith('*') else query
+
+
+def encode_cursor(sort: str, value, id: int) -> str:
+    """
+    Opaque page cursor, the sort column with the (value, id) of the last row
+    """
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value, id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if value is not None and sort in ('date_added', 'date_edited'):
+            value = datetime.fromisoformat(value)
+        id = int(id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor {cursor}") from e
+
+    if cursor_sort != sort:
+        raise ValueError(f"Cursor was made for sorting by {cursor_sort}, not {sort}")
+
+    return value, id
+
+
+class CachingRepository(AbstractRepository):
+    """
+    Read-through cache in front of another repository.
+
+    get_dict is answered from a BookmarkCache that outlives the repository
+    (and the unit of work it belongs to). Writes go straight to the wrapped
+    repository and drop the ids they touched from the cache.
+    """
+
+    def __init__(self, repository: AbstractRepository, cache: BookmarkCache) -> None:
+        super().__init__()
+        self.repository = repository
+        self.cache = cache
+        self.seen = repository.seen
+
+    def add_one(self, bookmark: Bookmark, bulk: bool = False) -> int:
+        return self.repository.add_one(bookmark, bulk=bulk)
+
+    def add_many(self, bookmarks: list[Bookmark], bulk: bool = False, **kwargs) -> list[int]:
+        return self.repository.add_many(bookmarks, bulk=bulk, **kwargs)
+
+    def add_rows(self, rows: list[dict], chunk_size: Optional[int] = None) -> int:
+        return self.repository.add_rows(rows, chunk_size=chunk_size)
+
+    def add_new_rows(self, rows: list[dict], chunk_size: Optional[int] = None) -> list[bool]:
+        return self.repository.add_new_rows(rows, chunk_size=chunk_size)
+
+    def upsert_many(self, rows: list[dict], update_columns=DEFAULT_UPSERT_COLUMNS, chunk_size=None) -> dict:
+        counts = self.repository.upsert_many(rows, update_columns=update_columns, chunk_size=chunk_size)
+        # the updated ids aren't known here, and an upsert is a bulk job anyway
+        if counts['updated']:
+            self.cache.clear()
+        return counts
+
+    def delete_one(self, bookmark: Bookmark) -> None:
+        if bookmark:
+            self.delete_many([bookmark])
+
+    def delete_many(self, bookmarks: list[Bookmark]) -> None:
+        if bookmarks:
+            self.delete_by_ids([bookmark_id(bookmark) for bookmark in bookmarks])
+
+    def delete_by_ids(self, ids: Iterable) -> int:
+        ids = delete_ids(ids)
+        deleted = self.repository.delete_by_ids(ids)
+        self.cache.invalidate(*ids)
+        return deleted
+
+    def get(self, id: int) -> Bookmark:
+        return self.repository.get(id)
+
+    def get_dict(self, id: int) -> Optional[dict]:
+        key = int(id)
+        bookmark = self.cache.get(key)
+        if bookmark is None:
+            version = self.cache.version()
+            bookmark = self.repository.get_dict(key)
+            if bookmark is not None:
+                self.cache.put(key, bookmark, version)
+
+        return bookmark
+
+    def update(self, bookmark) -> int:
+        if bookmark is None:
+            return 'Error', 400
+        counts = self.update_many([bookmark])
+        return counts if isinstance(counts, tuple) else counts[0]
+
+    def update_many(self, bookmarks: list[Bookmark]) -> list[int]:
+        try:
+            return self.repository.update_many(bookmarks)
+        finally:
+            if bookmarks:
+                self.cache.invalidate(*[bookmark_id(bookmark) for bookmark in bookmarks])
+
+    def find_first(self, query) -> Bookmark:
+        return self.repository.find_first(query)
+
+    def find_all(self, query) -> list[Bookmark]:
+        return self.repository.find_all(query)
+
+    def find_page(self, query, after=None, limit=DEFAULT_PAGE_SIZE, sort='id'):
+        return self.repository.find_page(query, after=after, limit=limit, sort=sort)
+
+    def stream_all(self, query, batch_size=STREAM_BATCH_SIZE) -> Iterator[Bookmark]:
+        return self.repository.stream_all(query, batch_size=batch_size)
+
+    def find_rows(self, query) -> list:
+        return self.repository.find_rows(query)
+
+    def stream_rows(self, query, batch_size=STREAM_BATCH_SIZE) -> Iterator:
+        return self.repository.stream_rows(query, batch_size=batch_size)
+
+    def search(self, text, limit=DEFAULT_PAGE_SIZE, offset=0) -> list[dict]:
+        return self.repository.search(text, limit=limit, offset=offset)
+
+
+def upsert_columns(columns: Optional[Iterable[str]]) -> tuple:
+    columns = tuple(dict.fromkeys(columns or ()))
+    unknown = [column for column in columns if column not in UPSERT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Can't update {', '.join(unknown)} on upsert, pick from {', '.join(UPSERT_COLUMNS)}")
+    return columns
+
+
+def upsert_statement(dialect_name: str, update_columns: tuple, date_edited: Optional[datetime] = None):
+    """
+    The INSERT ... ON CONFLICT (title) upsert_many sends. A row it updates
+    gets date_edited (now by default), unless update_columns has date_edited:
+    the incoming one may just be the record's date_added.
+    """
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        raise NotImplementedError(f"upsert_many needs INSERT ... ON CONFLICT, which {dialect_name} doesn't have")
+
+    stmt = dialect_insert(orm.bookmarks)
+    if not update_columns:
+        return stmt.on_conflict_do_nothing(index_elements=[orm.bookmarks.c.title])
+
+    set_ = {column: stmt.excluded[column] for column in update_columns}
+    set_.setdefault('date_edited', literal(date_edited or datetime.now(), orm.bookmarks.c.date_edited.type))
+    return stmt.on_conflict_do_update(
+        index_elements=[orm.bookmarks.c.title],
+        set_=set_,
+        # a title repeated within a chunk, or a row changed since the lookup,
+        # is still only written when something differs
+        where=or_(*(orm.bookmarks.c[column].is_distinct_from(stmt.excluded[column]) for column in update_columns)),
+    )
+
+
+def upsert_date_edited(row: dict, update_columns: tuple, now: datetime) -> datetime:
+    return row['date_edited'] if 'date_edited' in update_columns else now
+
+
+def upsert_writes(
+        rows: list[dict],
+        existing: dict,
+        update_columns: tuple,
+        counts: dict,
+        changes: Optional[list] = None,
+) -> list[dict]:
+    """
+    The rows that insert or change something, counting each row as inserted,
+    updated or unchanged against existing (title -> current column values),
+    which is kept up to date so a title repeated in rows counts right.
+    changes, when given, gets (id or None for an insert, row) for each of them.
+    """
+    writes = list()
+    for row in rows:
+        current = existing.get(row['title'])
+        if current is None:
+            counts['inserted'] += 1
+            existing[row['title']] = dict(row)
+            if changes is not None:
+                changes.append((None, row))
+        elif any(row[column] != current[column] for column in update_columns):
+            counts['updated'] += 1
+            current.update((column, row[column]) for column in update_columns)
+            if changes is not None:
+                changes.append((current.get('id'), row))
+        else:
+            counts['unchanged'] += 1
+            continue
+        writes.append(row)
+    return writes
+
+
+def record_updates(session, groups: list[list[dict]], counts: list[int], ids: list[int]) -> None:
+    """
+    BookmarkEdited events for the update_groups rows that matched a bookmark
+    """
+    if not outbox.recording(session):
+        return
+    missing = {id for id, count in zip(ids, counts) if not count}
+    outbox.record_edited(session, [
+        dict(row, id=row['b_id']) for rows in groups for row in rows if row['b_id'] not in missing
+    ])
+
+
+def delete_ids(ids: Iterable) -> list[int]:
+    """
+    The ids as ints without repeats, in the order given. Raises ValueError
+    for anything that isn't a whole number, int() would turn 1.9 or True
+    into bookmark 1.
+    """
+    return list(dict.fromkeys(delete_id(id) for id in ids))
+
+
+def delete_id(id) -> int:
+    if isinstance(id, bool) or (isinstance(id, float) and not id.is_integer()):
+        raise ValueError(f"{id!r} is not a bookmark id")
+    return int(id)
+
+
+def bookmark_id(bookmark) -> int:
+    """
+    Bookmarks reach the repository as domain objects, API dicts or plain ids
+    """
+    if isinstance(bookmark, dict):
+        return int(bookmark['id'])
+    if isinstance(bookmark, (int, str)):
+        return int(bookmark)
+    return int(bookmark.id)
+
+
+class AsyncSqlAlchemyRepository:
+    """
+    SqlAlchemyRepository on an AsyncSession (sqlalchemy.ext.asyncio): the same
+    statements and results, but every database call is awaited so one event
+    loop can serve many requests while they wait on the driver.
+
+    Covers what the API needs. There is no stream_all, streaming goes through
+    stream_rows, which is an async generator.
+    """
+
+    def __init__(self, session) -> None:
+        self.Session = session
+        self.seen = set()
+
+    async def add_one(self, bookmark: Bookmark, bulk: bool = False) -> int:
+        if bookmark:
+            return (await self.add_many([bookmark], bulk=bulk))[0]
+
+    async def add_many(
+        self,
+        bookmarks: list[Bookmark],
+        bulk: bool = False,
+        chunk_size: Optional[int] = None,
+    ) -> list[int]:
+        if not bookmarks:
+            return []
+
+        if bulk:
+            chunk_size = chunk_size or config.get_bulk_chunk_size()
+            ids = [None] * len(bookmarks)
+            for start in range(0, len(bookmarks), chunk_size):
+                for positions, rows in insert_groups(bookmarks, start, start + chunk_size):
+                    place_ids(ids, positions, rows, await self.Session.execute(BULK_INSERT, rows))
+        else:
+            self.Session.add_all(bookmarks)
+            await self.Session.flush()
+            ids = [bookmark.id for bookmark in bookmarks]
+
+        outbox.record_added(self.Session, bookmarks, ids)
+        await self.Session.commit()
+        return ids
+
+    async def delete_one(self, bookmark: Bookmark) -> None:
+        if bookmark:
+            await self.delete_many([bookmark])
+
+    async def delete_many(self, bookmarks: list[Bookmark]) -> None:
+        if bookmarks:
+            await self.delete_by_ids([bookmark_id(bookmark) for bookmark in bookmarks])
+
+    async def delete_by_ids(self, ids: Iterable) -> int:
+        ids = delete_ids(ids)
+        deleted = 0
+        recording = outbox.recording(self.Session)
+        for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+            stmt = delete(Bookmark).where(Bookmark.id.in_(ids[start:start + SQLITE_MAX_VARIABLES]))
+            if recording:
+                gone = (await self.Session.scalars(stmt.returning(Bookmark.id))).all()
+                outbox.record_deleted(self.Session, gone)
+                deleted += len(gone)
+            else:
+                deleted += (await self.Session.execute(stmt)).rowcount
+        if ids:
+            await self.Session.commit()
+        return deleted
+
+    async def get(self, id: int) -> Bookmark:
+        bookmark = await self.find_first(select(Bookmark).where(Bookmark.id == id))
+        if bookmark:
+            self.seen.add(bookmark)
+
+        return bookmark
+
+    async def get_dict(self, id: int) -> Optional[dict]:
+        rows = (await self.Session.execute(self._read_query(select(Bookmark).where(Bookmark.id == id)))).all()
+        rows_returned(self.Session, 'get_dict', len(rows))
+        return serializers.row_to_dict(rows[0]) if rows else None
+
+    async def update(self, bookmark) -> int:
+        if bookmark is None:
+            return 'Error', 400
+        counts = await self.update_many([bookmark])
+        return counts if isinstance(counts, tuple) else counts[0]
+
+    async def update_many(self, bookmarks: list[Bookmark]) -> list[int]:
+        if bookmarks is None:
+            return 'Error', 400
+        try:
+            affected = 0
+            groups = update_groups(bookmarks)
+            for rows in groups:
+                affected += (await self.Session.execute(UPDATE_BY_ID, rows)).rowcount
+
+            ids = [int(bookmark.id) for bookmark in bookmarks]
+            if affected == len(ids):
+                counts = [1] * len(ids)
+            else:
+                found = set()
+                for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+                    found.update(await self.Session.scalars(
+                        select(orm.bookmarks.c.id).where(
+                            orm.bookmarks.c.id.in_(ids[start:start + SQLITE_MAX_VARIABLES])
+                        )
+                    ))
+                counts = [1 if id in found else 0 for id in ids]
+
+            record_updates(self.Session, groups, counts, ids)
+            await self.Session.commit()
+            return counts
+        except Exception as e:
+            print(e)
+            await self.Session.rollback()
+            return 'Error', 400
+
+    async def find_first(self, query) -> Bookmark:
+        bookmarks = None if query is None else await self.find_all(query)
+        return bookmarks[0] if bookmarks else None
+
+    async def find_all(self, query) -> list[Bookmark]:
+        query = select(Bookmark) if query is None else query
+        bookmarks = (await self.Session.scalars(query)).all()
+        rows_returned(self.Session, 'find_all', len(bookmarks))
+        for bookmark in bookmarks:
+            self.seen.add(bookmark)
+
+        return bookmarks
+
+    async def find_page(
+        self,
+        query,
+        after: Optional[str] = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        sort: str = 'id',
+    ) -> tuple[list[Bookmark], Optional[str]]:
+        query, limit = page_query(query, after, limit, sort)
+        rows = (await self.Session.scalars(query)).all()
+        rows_returned(self.Session, 'find_page', len(rows))
+        bookmarks, next_cursor = next_page(rows, limit, sort)
+        for bookmark in bookmarks:
+            self.seen.add(bookmark)
+
+        return bookmarks, next_cursor
+
+    async def find_rows(self, query) -> list:
+        rows = (await self.Session.execute(self._read_query(query))).all()
+        rows_returned(self.Session, 'find_rows', len(rows))
+        return rows
+
+    async def stream_rows(self, query, batch_size: int = STREAM_BATCH_SIZE):
+        result = await self.Session.stream(
+            self._read_query(query).execution_options(yield_per=batch_size or STREAM_BATCH_SIZE)
+        )
+        count = 0
+        try:
+            async for row in result:
+                count += 1
+                yield row
+        finally:
+            rows_returned(self.Session, 'stream_rows', count)
+
+    async def search(self, text: str, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0) -> list[dict]:
+        if self.Session.get_bind().dialect.name != 'sqlite':
+            raise NotImplementedError("Full-text search needs SQLite FTS5")
+
+        params = search_params(text, limit, offset)
+        if params is None:
+            return []
+
+        results = [search_result(row) for row in await self.Session.execute(SEARCH_SQL, params)]
+        rows_returned(self.Session, 'search', len(results))
+        return results
+
+    def _read_query(self, query):
+        return read_query(query, self.Session.get_bind().dialect.name)
@@ -0,0 +1,77 @@
+"""
+Read-model serialization: turns result rows straight into the JSON the API sends,
+without building Bookmark objects or going through json.loads(bookmark.to_json()).
+
+orjson is used when it is installed, otherwise the standard library json module.
+"""
+import json
+from datetime import datetime
+from typing import Iterable, Iterator
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+# the order the columns are selected in by the repository's read queries
+COLUMNS = ("id", "title", "url", "notes", "date_added", "date_edited")
+DATE_COLUMNS = ("date_added", "date_edited")
+# what SQLite stores for a datetime without microseconds
+_NO_MICROSECONDS = ".000000"
+
+
+def format_datetime(value):
+    """
+    Same text str(datetime) gives, which is what Bookmark.to_json used to send.
+
+    The repository hands SQLite dates over as the stored text, which only
+    needs the empty microseconds trimmed instead of a parse and a format.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value[:-7] if value.endswith(_NO_MICROSECONDS) else value
+    if isinstance(value, datetime):
+        return value.isoformat(" ")
+    return str(value)
+
+
+def row_to_dict(row) -> dict:
+    id, title, url, notes, date_added, date_edited = row
+    return {
+        "id": id,
+        "title": title,
+        "url": url,
+        "notes": notes,
+        "date_added": format_datetime(date_added),
+        "date_edited": format_datetime(date_edited),
+    }
+
+
+def bookmark_to_dict(bookmark) -> dict:
+    return row_to_dict([getattr(bookmark, column) for column in COLUMNS])
+
+
+if orjson is not None:
+
+    def dumps(obj) -> bytes:
+        return orjson.dumps(obj, default=str)
+
+    # both raise a ValueError subclass on bad input
+    loads = orjson.loads
+
+else:
+
+    def dumps(obj) -> bytes:
+        return json.dumps(obj, default=str, separators=(",", ":")).encode()
+
+    loads = json.loads
+
+
+def rows_to_json(rows: Iterable) -> bytes:
+    return dumps([row_to_dict(row) for row in rows])
+
+
+def rows_to_ndjson(rows: Iterable) -> Iterator[bytes]:
+    for row in rows:
+        yield dumps(row_to_dict(row)) + b"\n"
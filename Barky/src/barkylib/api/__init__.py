@@ -3,13 +3,12 @@ import os
 from flask import Flask
 from .flaskapi import FlaskBookmarkAPI
 
-# init from dotenv file
 from dotenv import load_dotenv
 
-load_dotenv()
-
 
 def create_app(test_config=None):
+    # init from dotenv file, before anything reads its settings
+    load_dotenv()
     app = Flask(__name__)
 
     if test_config is None:
@@ -27,6 +26,7 @@ def create_app(test_config=None):
 
     from . import flaskapi
 
+    flaskapi.fb.init_app(app)
     app.register_blueprint(flaskapi.bp)
 
     return app
@@ -0,0 +1,270 @@
+"""
+The read and write routes of flaskapi.py as a plain ASGI application on the
+asyncio stack (async_handlers + AsyncSqlAlchemyUnitOfWork), so a single process
+can keep thousands of requests in flight while they wait on the database.
+
+Serve it with any ASGI server, e.g. from the Barky folder:
+    PYTHONPATH=src uvicorn barkylib.api.asgiapi:app --port 5005
+"""
+import json
+import re
+from datetime import datetime
+from typing import AsyncIterator, Optional
+from urllib.parse import parse_qsl
+
+from barkylib.adapters import serializers
+from barkylib.adapters.orm import start_mappers
+from barkylib.domain.models import Bookmark
+from barkylib.services import async_handlers, unit_of_work
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+# rows joined into one write when streaming, and the ?stream= values, same as flaskapi
+STREAM_CHUNK_ROWS = 500
+STREAM_FORMATS = ('json', 'ndjson')
+
+
+class Request:
+    def __init__(self, scope: dict, body: bytes) -> None:
+        self.method = scope["method"]
+        self.path = scope["path"]
+        # blank values kept, ?stream means what it does in the Flask app
+        self.args = dict(parse_qsl(scope.get("query_string", b"").decode(), keep_blank_values=True))
+        self.body = body
+
+    def get_int(self, name: str) -> Optional[int]:
+        value = self.args.get(name)
+        return None if value in (None, "") else int(value)
+
+    def get_json(self):
+        return json.loads(self.body or b"{}")
+
+
+class AsgiBookmarkAPI:
+    """
+    Routes /api/... to async handlers. Responses follow the Flask views:
+    a body, or a (body, status) tuple, where dicts, lists and bytes are JSON
+    and an async iterator of bytes is streamed.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker = None, prefix: str = "/api") -> None:
+        self.session_factory = session_factory
+        self.routes = [
+            (method, re.compile(f"^{prefix}{pattern}$"), view)
+            for method, pattern, view in (
+                ("GET", "/", self.index),
+                ("GET", "/one/(?P<id>[^/]+)", self.one),
+                ("GET", "/all", self.all),
+                ("POST", "/add", self.add_bookmark),
+                ("POST", "/edit/(?P<id>[^/]+)", self.update_bookmark),
+                ("GET", "/delete/(?P<id>[^/]+)", self.delete_bookmark),
+                ("POST", "/delete", self.delete_bookmarks),
+                ("GET", "/first/(?P<filter>[^/]+)/(?P<value>[^/]+)/(?P<sort>[^/]+)", self.first),
+                ("GET", "/search", self.search),
+            )
+        ]
+
+    def uow(self) -> unit_of_work.AsyncSqlAlchemyUnitOfWork:
+        return unit_of_work.AsyncSqlAlchemyUnitOfWork(self.session_factory)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        request = Request(scope, body)
+        for method, pattern, view in self.routes:
+            match = pattern.match(request.path)
+            if match:
+                if request.method != method:
+                    result = "Method Not Allowed", 405
+                else:
+                    result = await view(request, **match.groupdict())
+                break
+        else:
+            result = "Not Found", 404
+
+        await respond(send, result)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                start_mappers()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                factory = self.session_factory or unit_of_work._async_session_factory
+                if factory is not None:
+                    await factory.kw["bind"].dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def index(self, request):
+        return "Barky API"
+
+    async def one(self, request, id):
+        try:
+            bookmark = await async_handlers.list_bookmark(id=id, uow=self.uow())
+            if bookmark is None:
+                return 'None found', 204
+            else:
+                return bookmark
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+    async def all(self, request):
+        sort = request.args.get('sort')
+        try:
+            if 'stream' in request.args:
+                format = request.args.get('stream') or 'json'
+                if format not in STREAM_FORMATS:
+                    return f"Unknown stream format {format}, use one of {', '.join(STREAM_FORMATS)}", 400
+                return self.stream(filter=None, value=None, sort=sort, format=format)
+            if 'limit' in request.args or 'after' in request.args:
+                return await async_handlers.list_bookmarks_page(
+                    filter=None,
+                    value=None,
+                    sort=sort,
+                    after=request.args.get('after'),
+                    limit=request.get_int('limit'),
+                    uow=self.uow(),
+                )
+            return await async_handlers.list_all_bookmarks_json(filter=None, value=None, sort=sort, uow=self.uow())
+        except ValueError as e:
+            return str(e), 400
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+    def stream(self, filter, value, sort, format) -> AsyncIterator[bytes]:
+        ndjson = format == 'ndjson'
+        bookmarks = async_handlers.iter_all_bookmarks(filter=filter, value=value, sort=sort, uow=self.uow())
+
+        async def generate():
+            if not ndjson:
+                yield b'['
+            chunk, first = list(), True
+            async for bookmark in bookmarks:
+                row = serializers.dumps(bookmark)
+                if ndjson:
+                    chunk.append(row + b'\n')
+                else:
+                    chunk.append(row if first else b',' + row)
+                first = False
+                if len(chunk) >= STREAM_CHUNK_ROWS:
+                    yield b''.join(chunk)
+                    chunk = list()
+            if not ndjson:
+                chunk.append(b']')
+            yield b''.join(chunk)
+
+        return generate(), 200, 'application/x-ndjson' if ndjson else 'application/json'
+
+    async def search(self, request):
+        try:
+            return await async_handlers.search_bookmarks(
+                text=request.args.get('q', ''),
+                limit=request.get_int('limit'),
+                offset=request.get_int('offset'),
+                uow=self.uow(),
+            )
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+    async def first(self, request, filter, value, sort):
+        try:
+            bookmarks = await async_handlers.list_all_bookmarks(filter=filter, value=value, sort=sort, uow=self.uow())
+            return bookmarks[0] if bookmarks else bookmarks
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+    async def add_bookmark(self, request):
+        try:
+            await async_handlers.add_bookmark(bookmark=get_bookmark_from_json(request.get_json()), uow=self.uow())
+            return 'OK', 201
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+    async def update_bookmark(self, request, id):
+        try:
+            bookmark = get_bookmark_from_json(request.get_json())
+            bookmark.id = id
+            await async_handlers.edit_bookmark(bookmark=bookmark, uow=self.uow())
+            return 'OK', 201
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+    async def delete_bookmark(self, request, id):
+        try:
+            await async_handlers.delete_bookmark(bookmark=id, uow=self.uow())
+            return 'OK', 201
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+    async def delete_bookmarks(self, request):
+        try:
+            body = request.get_json()
+            ids = body.get('ids') if isinstance(body, dict) else body
+            if not isinstance(ids, list):
+                return 'Expected a list of ids', 400
+            return {'deleted': await async_handlers.delete_bookmarks(ids=ids, uow=self.uow())}
+        except ValueError as e:
+            return str(e), 400
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+
+def get_bookmark_from_json(req_json) -> Bookmark:
+    return Bookmark(
+        id=req_json.get('id'),
+        title=req_json.get('title'),
+        url=req_json.get('url'),
+        notes=req_json.get('notes'),
+        date_added=req_json.get('date_added'),
+        date_edited=datetime.now()
+    )
+
+
+async def respond(send, result) -> None:
+    status, content_type = 200, None
+    if isinstance(result, tuple):
+        result, status, *rest = result
+        content_type = rest[0] if rest else None
+
+    if isinstance(result, str):
+        body, content_type = result.encode(), content_type or 'text/html; charset=utf-8'
+    elif isinstance(result, (bytes, dict, list)):
+        body = result if isinstance(result, bytes) else serializers.dumps(result)
+        content_type = content_type or 'application/json'
+    else:
+        body = None
+
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode())],
+    })
+    if body is not None:
+        await send({"type": "http.response.body", "body": body})
+        return
+
+    # anything else is an async iterator of chunks
+    async for chunk in result:
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+app = AsgiBookmarkAPI()
@@ -1,32 +1,39 @@
 import json
 from datetime import datetime
 
-from barkylib import bootstrap
+from barkylib import bootstrap, config
+from barkylib.adapters import exporters, importers, metrics, profiles, publishers, serializers
+from barkylib.adapters.cache import BookmarkCache
 from barkylib.services import unit_of_work, handlers
+from barkylib.services.relay import OutboxRelay
+from barkylib.services.write_behind import WriteBehindWriter
 from barkylib.adapters.repository import *
 from barkylib.domain import commands
 
-# init from dotenv file
-from dotenv import load_dotenv
 from flask import (
     Blueprint,
+    Response,
     flash,
     g,
     redirect,
     render_template,
     request,
     session,
+    stream_with_context,
     url_for,
 )
-from flask_sqlalchemy import SQLAlchemy
 from .baseapi import AbstractBookMarkAPI
 
 
-load_dotenv()
-
 # app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///bookmarks.db'
 # db = SQLAlchemy(app)
-bus = bootstrap.bootstrap()
+
+# rows joined into one write when streaming
+STREAM_CHUNK_ROWS = 500
+# ?stream= values, a bare ?stream is json
+STREAM_FORMATS = ('json', 'ndjson')
+# requests that are never profiled, fetching profiles would only add noise
+PROFILE_ADMIN_ENDPOINTS = ("flask_bookmark_api.profiles", "flask_bookmark_api.profile")
 
 
 class FlaskBookmarkAPI(AbstractBookMarkAPI):
@@ -34,8 +41,156 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
     Flask
     """
 
-    def __init__(self) -> None:
+    def __init__(self, cache: BookmarkCache = None, session_factory=None) -> None:
         super().__init__()
+        self.cache = cache
+        # None is unit_of_work.default_session_factory(), the configured database
+        self.session_factory = session_factory
+        self.bus = None
+        self.collectors = list()
+        self.timing = False
+        # profiles.RequestProfiling when profiling is configured
+        self.profiling = None
+        # WriteBehindWriter when write-behind adds are turned on
+        self.writer = None
+        # OutboxRelay publishing the outbox, when it's turned on
+        self.relay = None
+
+    def init_app(self, app) -> None:
+        """
+        Called by create_app: the settings are read, the mappers started and
+        the message bus built here rather than when the module is imported
+        """
+        if self.cache is None:
+            self.cache = BookmarkCache(**config.get_cache_settings())
+        if self.bus is None:
+            self.bus = bootstrap.bootstrap(uow=self.uow(), cache=self.cache)
+        settings = config.get_write_behind_settings()
+        if settings.pop("enabled") and self.writer is None:
+            self.writer = WriteBehindWriter(self.uow, **settings).start()
+        settings = config.get_outbox_settings()
+        if settings["enabled"] and self.relay is None:
+            self.relay = OutboxRelay(
+                self.session_factory or unit_of_work.default_session_factory(),
+                publishers.create_publisher(settings["publisher"]),
+                batch_size=settings["batch_size"],
+                interval_ms=settings["interval_ms"],
+                # one worker publishes, see services/relay.py
+                lock_path=settings["lock_path"],
+            ).start()
+        self.timing = config.get_metrics_enabled()
+        self.register_collectors()
+        settings = config.get_profiling_settings()
+        enabled = settings["secret"] or settings["sample_rate"]
+        self.profiling = profiles.RequestProfiling(**settings) if enabled else None
+        app.extensions["barky"] = self
+
+    def register_collectors(self) -> None:
+        """
+        Adds the cache, event dispatcher, write-behind and outbox relay stats
+        to /api/metrics, replacing the ones of an earlier init_app
+        """
+        for collector in self.collectors:
+            metrics.REGISTRY.remove_collector(collector)
+        self.collectors = [
+            metrics.stats_collector(
+                "barky_cache",
+                lambda: self.cache.stats() if self.cache is not None else None,
+                "Bookmark cache",
+                counters=("hits", "misses", "evictions", "expirations", "invalidations"),
+            ),
+        ]
+        if self.bus is not None and self.bus.dispatcher is not None:
+            self.collectors.append(metrics.dispatcher_collector(self.bus.dispatcher.stats))
+        if self.writer is not None:
+            self.collectors.append(metrics.stats_collector(
+                "barky_write_behind",
+                self.writer.stats,
+                "Write-behind adds",
+                counters=("added", "replayed", "written", "skipped", "dead_lettered", "flushes", "errors"),
+            ))
+        if self.relay is not None:
+            self.collectors.append(metrics.stats_collector(
+                "barky_outbox",
+                self.relay.stats,
+                "Outbox relay",
+                counters=("published", "batches", "errors"),
+            ))
+        for collector in self.collectors:
+            metrics.REGISTRY.add_collector(collector)
+
+    def start_timing(self) -> None:
+        if self.timing:
+            g.barky_timing = metrics.start_request()
+
+    def end_timing(self, response):
+        started = g.pop('barky_timing', None)
+        if started is not None:
+            metrics.end_request(started, request.endpoint, request.method, response.status_code)
+        return response
+
+    def end_timing_on_error(self, error) -> None:
+        # after_request doesn't run when a view raises
+        started = g.pop('barky_timing', None)
+        if started is not None:
+            metrics.end_request(started, request.endpoint, request.method, 500)
+
+    def prometheus_metrics(self):
+        return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+    def start_profile(self) -> None:
+        # all that runs per request when profiling is off
+        if self.profiling is None or request.endpoint in PROFILE_ADMIN_ENDPOINTS:
+            return
+        mode = self.profiling.choose(request.headers.get(profiles.HEADER))
+        if mode is not None:
+            g.barky_profile = self.profiling.start(mode, request.headers.get('X-Request-Id'))
+
+    def end_profile(self, response):
+        started = g.pop('barky_profile', None)
+        if started is not None:
+            # a streamed body is written after this, only the view is profiled
+            profile = self.profiling.finish(
+                started, request.method, request.path, request.endpoint, response.status_code
+            )
+            response.headers[profiles.ID_HEADER] = profile.id
+        return response
+
+    def end_profile_on_error(self, error) -> None:
+        started = g.pop('barky_profile', None)
+        if started is not None:
+            self.profiling.finish(started, request.method, request.path, request.endpoint, 500)
+
+    def profile_admin_error(self):
+        if self.profiling is None:
+            return 'Profiling is off', 404
+        if not self.profiling.allowed(request.headers.get(profiles.HEADER)):
+            return 'Forbidden', 403
+        return None
+
+    def list_profiles(self):
+        error = self.profile_admin_error()
+        if error is not None:
+            return error
+        return json_response([profile.summary() for profile in self.profiling.store.recent()])
+
+    def get_profile(self, id):
+        error = self.profile_admin_error()
+        if error is not None:
+            return error
+        profile = self.profiling.store.get(id)
+        if profile is None:
+            return 'No results', 404
+        if request.args.get('format') == 'text':
+            return Response(profile.text(), mimetype='text/plain')
+        return Response(
+            profile.data,
+            mimetype='application/octet-stream',
+            headers={'Content-Disposition': f'attachment; filename="{profile.filename}"'},
+        )
+
+    def uow(self) -> unit_of_work.SqlAlchemyUnitOfWork:
+        return unit_of_work.SqlAlchemyUnitOfWork(self.session_factory, cache=self.cache)
 
     # @app.route("/")
     def index(self):
@@ -46,7 +201,7 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
         try:
             bookmark = handlers.list_bookmark(
                 id=id,
-                uow=unit_of_work.SqlAlchemyUnitOfWork(),
+                uow=self.uow(),
             )
 
             if bookmark is None:
@@ -60,7 +215,95 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
 
     # @app.route("/api/all")
     def all(self):
-        return self.many(filter=None, value=None, sort=None)
+        if 'stream' in request.args:
+            format = request.args.get('stream') or 'json'
+            if format not in STREAM_FORMATS:
+                return f"Unknown stream format {format}, use one of {', '.join(STREAM_FORMATS)}", 400
+            return self.stream(filter=None, value=None, sort=request.args.get('sort'), format=format)
+        # asking for a limit or passing a cursor switches to paging
+        if 'limit' in request.args or 'after' in request.args:
+            return self.page(
+                filter=None,
+                value=None,
+                sort=request.args.get('sort'),
+                after=request.args.get('after'),
+                limit=request.args.get('limit', type=int),
+            )
+        try:
+            return json_response(handlers.list_all_bookmarks_json(
+                filter=None,
+                value=None,
+                sort=request.args.get('sort'),
+                uow=self.uow(),
+            ))
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+    def stream(self, filter, value, sort, format):
+        """
+        Writes the bookmarks out as they come off the cursor, either as one JSON
+        array (format json, the default) or one object per line (format ndjson)
+        """
+        ndjson = format == 'ndjson'
+        bookmarks = handlers.iter_all_bookmarks(
+            filter=filter,
+            value=value,
+            sort=sort,
+            uow=self.uow(),
+        )
+
+        def generate():
+            # sending the opening bracket right away keeps the time to first byte low
+            if not ndjson:
+                yield b'['
+            chunk = list()
+            for i, bookmark in enumerate(bookmarks):
+                row = serializers.dumps(bookmark)
+                if ndjson:
+                    chunk.append(row + b'\n')
+                else:
+                    chunk.append(row if i == 0 else b',' + row)
+                if len(chunk) >= STREAM_CHUNK_ROWS:
+                    yield b''.join(chunk)
+                    chunk = list()
+            if not ndjson:
+                chunk.append(b']')
+            yield b''.join(chunk)
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/x-ndjson' if ndjson else 'application/json',
+        )
+
+    def page(self, filter, value, sort, after, limit):
+        try:
+            return json_response(handlers.list_bookmarks_page(
+                filter=filter,
+                value=value,
+                sort=sort,
+                after=after,
+                limit=limit,
+                uow=self.uow(),
+            ))
+        except ValueError as e:
+            return str(e), 400
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+    # @app.route("/api/search")
+    def search(self):
+        try:
+            return json_response(handlers.search_bookmarks(
+                text=request.args.get('q', ''),
+                limit=request.args.get('limit', type=int),
+                offset=request.args.get('offset', type=int),
+                uow=self.uow(),
+            ))
+        except Exception as e:
+            print(e)
+            return 'Error', 400
 
     # @app.route("/api/first/<property>/<value>/<sort>")
     def first(self, filter, value, sort):
@@ -77,7 +320,7 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
                 filter=filter,
                 value=value,
                 sort=sort,
-                uow=unit_of_work.SqlAlchemyUnitOfWork(),
+                uow=self.uow(),
             )
 
             if bookmarks is None:
@@ -91,9 +334,16 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
 
     def add(self, bookmark):
         try:
+            if self.writer is not None:
+                # journaled, in the database within BARKY_WRITE_BEHIND_MS
+                handlers.add_bookmark(
+                    bookmark=bookmark,
+                    uow=unit_of_work.WriteBehindUnitOfWork(self.writer, self.uow()),
+                )
+                return 'OK', 202
             handlers.add_bookmark(
                 bookmark=bookmark,
-                uow=unit_of_work.SqlAlchemyUnitOfWork(),
+                uow=self.uow(),
             )
             return 'OK', 201
         except Exception as e:
@@ -103,11 +353,69 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
     def add_bookmark(self):
         return self.add(bookmark=self.get_bookmark_from_json(request.get_json(force=True)))
 
+    def import_bookmarks(self):
+        """
+        Reads the request body as it arrives, so uploads of any size work.
+        The format comes from ?format=, else the Content-Type.
+        """
+        try:
+            format = importers.detect_format(request.args.get('format'), request.mimetype)
+        except ValueError as e:
+            return str(e), 400
+        try:
+            return json_response(handlers.import_bookmarks(
+                importers.read_records(request.stream, format),
+                uow=self.uow(),
+            ))
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+    def upsert_bookmarks(self):
+        """
+        Same body and ?format= as import, but bookmarks whose title is taken
+        get the columns in ?update= (url,notes by default, empty for none)
+        overwritten instead of failing
+        """
+        try:
+            format = importers.detect_format(request.args.get('format'), request.mimetype)
+            update = request.args.get('update')
+            update_columns = None if update is None else upsert_columns(update.split(',') if update else ())
+        except ValueError as e:
+            return str(e), 400
+        try:
+            return json_response(handlers.upsert_bookmarks(
+                importers.read_records(request.stream, format),
+                uow=self.uow(),
+                update_columns=update_columns,
+            ))
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+    def export_bookmarks(self):
+        """
+        The whole table as a download, written while it is read so the size
+        of the table doesn't matter. ?format= is ndjson (the default), csv or
+        columnar, ?gzip=1 compresses it on the way out.
+        """
+        format = request.args.get('format', 'ndjson')
+        if format not in exporters.FORMATS:
+            return f"Unknown export format {format}, use one of {', '.join(exporters.FORMATS)}", 400
+        compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+        filename = 'bookmarks' + exporters.EXTENSIONS[format] + ('.gz' if compress else '')
+        return Response(
+            stream_with_context(handlers.export_bookmarks(format, uow=self.uow(), compress=compress)),
+            mimetype='application/gzip' if compress else exporters.CONTENT_TYPES[format],
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+        )
+
     def delete(self, bookmark):
         try:
-            handlers.delete_bookmark(
-                bookmark=bookmark,
-                uow=unit_of_work.SqlAlchemyUnitOfWork(),
+            handlers.delete_bookmarks(
+                ids=[bookmark_id(bookmark)],
+                uow=self.uow(),
             )
 
             return 'OK', 201
@@ -117,7 +425,24 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
             return 'Error', 400
 
     def delete_bookmark(self, id):
-        return self.delete(self.one(id=id))
+        return self.delete(id)
+
+    def delete_bookmarks(self):
+        """
+        Deletes the ids in the body, a JSON list or {"ids": [...]}, and
+        reports how many bookmarks there were
+        """
+        body = request.get_json(force=True, silent=True)
+        ids = body.get('ids') if isinstance(body, dict) else body
+        if not isinstance(ids, list):
+            return 'Expected a list of ids', 400
+        try:
+            return json_response({'deleted': handlers.delete_bookmarks(ids=ids, uow=self.uow())})
+        except ValueError as e:
+            return str(e), 400
+        except Exception as e:
+            print(e)
+            return 'Error', 400
 
     def update_bookmark(self, id):
         bookmark = self.get_bookmark_from_json(request.get_json(force=True))
@@ -128,7 +453,7 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
         try:
             result = handlers.edit_bookmark(
                 bookmark=bookmark,
-                uow=unit_of_work.SqlAlchemyUnitOfWork(),
+                uow=self.uow(),
             )
             print(result)
             return 'OK', 201
@@ -136,6 +461,11 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
             print(e)
             return 'Error', 400
 
+    def cache_stats(self):
+        if self.cache is None:
+            return {}
+        return self.cache.stats()
+
     def get_bookmark_from_json(self, req_json) -> Bookmark:
         return Bookmark(
             id=req_json.get('id'),
@@ -147,6 +477,15 @@ class FlaskBookmarkAPI(AbstractBookMarkAPI):
         )
 
 
+def json_response(body) -> Response:
+    """
+    Sends already serialized JSON as is, anything else is serialized once here
+    """
+    if not isinstance(body, bytes):
+        body = serializers.dumps(body)
+    return Response(body, mimetype='application/json')
+
+
 fb = FlaskBookmarkAPI()
 bp = Blueprint("flask_bookmark_api", __name__, url_prefix="/api")
 
@@ -162,11 +501,49 @@ bp.add_url_rule("/all", "all", fb.all, ["GET"])
 # @app.route('/api/add')
 bp.add_url_rule("/add", "add", fb.add_bookmark, methods=["POST"])
 
+# @app.route('/api/import?format=<ndjson|csv|html>')
+bp.add_url_rule("/import", "import", fb.import_bookmarks, methods=["POST"])
+
+# @app.route('/api/upsert?format=<ndjson|csv|html>&update=<url,notes>')
+bp.add_url_rule("/upsert", "upsert", fb.upsert_bookmarks, methods=["POST"])
+
+# @app.route('/api/export?format=<ndjson|csv|columnar>&gzip=<1>')
+bp.add_url_rule("/export", "export", fb.export_bookmarks, methods=["GET"])
+
 # @app.route('/api/edit/<id>')
 bp.add_url_rule("/edit/<id>", "edit", fb.update_bookmark, methods=["POST"])
 
 # @app.route('/api/delete/<id>')
 bp.add_url_rule("/delete/<id>", "delete", fb.delete_bookmark, methods=["GET"])
 
+# @app.route('/api/delete', body [<id>, ...])
+bp.add_url_rule("/delete", "delete_many", fb.delete_bookmarks, methods=["POST"])
+
 # @app.route("/api/first/<filter>/<value>/<sort>")
-bp.add_url_rule('/first/<filter>/<value>/<sort>', "first", fb.first, methods=["GET"])
\ No newline at end of file
+bp.add_url_rule('/first/<filter>/<value>/<sort>', "first", fb.first, methods=["GET"])
+
+# @app.route("/api/search?q=<text>&limit=<limit>&offset=<offset>")
+bp.add_url_rule("/search", "search", fb.search, methods=["GET"])
+
+# @app.route("/api/cache/stats")
+bp.add_url_rule("/cache/stats", "cache_stats", fb.cache_stats, methods=["GET"])
+
+# @app.route("/api/metrics")
+bp.add_url_rule("/metrics", "metrics", fb.prometheus_metrics, methods=["GET"])
+
+# @app.route("/api/admin/profiles"), with a signed X-Barky-Profile header
+bp.add_url_rule("/admin/profiles", "profiles", fb.list_profiles, methods=["GET"])
+
+# @app.route("/api/admin/profiles/<id>?format=<text>")
+bp.add_url_rule("/admin/profiles/<id>", "profile", fb.get_profile, methods=["GET"])
+
+# times every view above when BARKY_METRICS is on, see adapters/metrics.py
+bp.before_request(fb.start_timing)
+bp.after_request(fb.end_timing)
+bp.teardown_request(fb.end_timing_on_error)
+
+# profiles requests on demand, see adapters/profiles.py; registered after the
+# timing so the profile starts last and ends first
+bp.before_request(fb.start_profile)
+bp.after_request(fb.end_profile)
+bp.teardown_request(fb.end_profile_on_error)
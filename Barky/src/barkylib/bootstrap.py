@@ -1,13 +1,19 @@
+import copy
+import functools
 import inspect
 from typing import Callable
 
+from barkylib import config
 from barkylib.adapters import orm
-from barkylib.services import handlers, messagebus, unit_of_work
+from barkylib.adapters.cache import BookmarkCache
+from barkylib.services import dispatch, handlers, messagebus, unit_of_work
 
 
 def bootstrap(
     start_orm: bool = True,
-    uow: unit_of_work.AbstractUnitOfWork = unit_of_work.SqlAlchemyUnitOfWork(),
+    uow: unit_of_work.AbstractUnitOfWork = None,
+    cache: BookmarkCache = None,
+    dispatch_settings: dict = None,
     # notifications: AbstractNotifications = None,
     # publish: Callable = redis_eventpublisher.publish,
 ) -> messagebus.MessageBus:
@@ -17,8 +23,11 @@ def bootstrap(
     if start_orm:
         orm.start_mappers()
 
+    if uow is None:
+        uow = unit_of_work.SqlAlchemyUnitOfWork(cache=cache)
+
     # dependencies = {"uow": uow, "notifications": notifications, "publish": publish}
-    dependencies = {"uow": uow}
+    dependencies = {"uow": uow, "cache": cache}
     injected_event_handlers = {
         event_type: [
             inject_dependencies(handler, dependencies) for handler in event_handlers
@@ -30,16 +39,48 @@ def bootstrap(
         for command_type, handler in handlers.COMMAND_HANDLERS.items()
     }
 
+    # see config.get_event_dispatch_settings, no workers means inline events
+    dispatch_settings = config.get_event_dispatch_settings() if dispatch_settings is None else dispatch_settings
+    dispatcher = None
+    if dispatch_settings.get("workers"):
+        dispatcher = dispatch.EventDispatcher(
+            {
+                event_type: [
+                    inject_dependencies(handler, dependencies, uow_per_call=True) for handler in event_handlers
+                ]
+                for event_type, event_handlers in handlers.EVENT_HANDLERS.items()
+            },
+            **dispatch_settings,
+        )
+
+    injected_batch_command_handlers = {
+        command_type: inject_dependencies(handler, dependencies)
+        for command_type, handler in handlers.BATCH_COMMAND_HANDLERS.items()
+    }
+
     return messagebus.MessageBus(
         uow=uow,
         event_handlers=injected_event_handlers,
         command_handlers=injected_command_handlers,
+        batch_command_handlers=injected_batch_command_handlers,
+        dispatcher=dispatcher,
     )
 
 
-def inject_dependencies(handler, dependencies):
+def inject_dependencies(handler, dependencies, uow_per_call=False):
     params = inspect.signature(handler).parameters
     deps = {
         name: dependency for name, dependency in dependencies.items() if name in params
     }
-    return lambda message: handler(message, **deps)
+    if not deps:
+        # left as it is, a module level function can go to a process pool
+        return handler
+    if uow_per_call and "uow" in deps:
+        # a unit of work holds one session, so handlers running on several
+        # threads at once each get their own copy (same factory and cache)
+        uow = deps.pop("uow")
+        injected = lambda message: handler(message, uow=copy.copy(uow), **deps)
+    else:
+        injected = lambda message: handler(message, **deps)
+    # keeps the handler's name for the dispatcher's limits and stats
+    return functools.wraps(handler)(injected)
@@ -0,0 +1,177 @@
+"""
+Command line tools for bulk work on the bookmarks database.
+
+Run from the Barky folder, e.g.:
+    PYTHONPATH=src python -m barkylib.cli import bookmarks.html
+    PYTHONPATH=src python -m barkylib.cli --db sqlite:///other.db import - --format ndjson < bookmarks.ndjson
+    PYTHONPATH=src python -m barkylib.cli export bookmarks.csv.gz
+    curl -H "X-Barky-Profile: $(PYTHONPATH=src python -m barkylib.cli profile-token)" localhost:5000/api/all
+    BARKY_OUTBOX=1 PYTHONPATH=src python -m barkylib.cli relay
+"""
+import argparse
+import json
+import sys
+from contextlib import contextmanager
+
+from barkylib import config
+from barkylib.adapters import exporters, importers, orm, profiles, publishers
+from barkylib.services import handlers, unit_of_work
+from barkylib.services.relay import OutboxRelay
+from dotenv import load_dotenv
+from sqlalchemy.orm import sessionmaker
+
+
+def make_uow(db: str = None) -> unit_of_work.SqlAlchemyUnitOfWork:
+    if db is None:
+        return unit_of_work.SqlAlchemyUnitOfWork()
+    return unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=unit_of_work.create_profiled_engine(db)))
+
+
+@contextmanager
+def open_input(path: str):
+    if path == '-':
+        yield sys.stdin.buffer
+    else:
+        with open(path, 'rb') as stream:
+            yield stream
+
+
+@contextmanager
+def open_output(path: str):
+    if path == '-':
+        yield sys.stdout.buffer
+        sys.stdout.buffer.flush()
+    else:
+        with open(path, 'wb') as stream:
+            yield stream
+
+
+def import_command(args) -> int:
+    format = importers.detect_format(args.format, filename=args.file)
+    with open_input(args.file) as stream:
+        report = handlers.import_bookmarks(
+            importers.read_records(stream, format),
+            uow=make_uow(args.db),
+            chunk_size=args.chunk_size,
+        )
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 1 if report['failed'] else 0
+
+
+def upsert_command(args) -> int:
+    format = importers.detect_format(args.format, filename=args.file)
+    update_columns = None if args.update is None else [column for column in args.update.split(',') if column]
+    with open_input(args.file) as stream:
+        report = handlers.upsert_bookmarks(
+            importers.read_records(stream, format),
+            uow=make_uow(args.db),
+            update_columns=update_columns,
+            chunk_size=args.chunk_size,
+        )
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    return 1 if report['failed'] else 0
+
+
+def export_command(args) -> int:
+    format, compress = exporters.detect_format(args.format, filename=None if args.file == '-' else args.file)
+    chunks = handlers.export_bookmarks(
+        format,
+        uow=make_uow(args.db),
+        compress=compress or args.gzip,
+        batch_size=args.batch_size,
+    )
+    with open_output(args.file) as stream:
+        for chunk in chunks:
+            stream.write(chunk)
+    return 0
+
+
+def profile_token_command(args) -> int:
+    secret = config.get_profiling_settings()["secret"]
+    if not secret:
+        raise ValueError("BARKY_PROFILE_SECRET isn't set")
+    print(profiles.sign_token(secret, args.mode, args.ttl))
+    return 0
+
+
+def relay_command(args) -> int:
+    """
+    Publishes the outbox from this process, for when the API's own relay is
+    off (the ASGI app has none). It waits for the same lock as the API's
+    relays, so it doesn't publish events twice alongside them.
+    """
+    settings = config.get_outbox_settings()
+    relay = OutboxRelay(
+        make_uow(args.db).session_factory or unit_of_work.default_session_factory(),
+        publishers.create_publisher(args.publisher or settings["publisher"]),
+        batch_size=settings["batch_size"],
+        interval_ms=settings["interval_ms"],
+        lock_path=settings["lock_path"],
+    )
+    if args.once:
+        if not relay.acquire():
+            print(f"Another relay holds {relay.lock_path}", file=sys.stderr)
+            relay.publisher.close()
+            return 1
+        print(json.dumps(dict(published=relay.publish_all())))
+        relay.release()
+        relay.publisher.close()
+        return 0
+    try:
+        relay.run()
+    except KeyboardInterrupt:
+        pass
+    relay.publisher.close()
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="barkylib.cli", description="Bulk tools for the bookmarks database")
+    parser.add_argument("--db", help="database url, the configured sqlite file by default")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="add the bookmarks in an NDJSON, CSV or bookmark HTML file")
+    import_parser.add_argument("file", help="file to read, - for stdin")
+    import_parser.add_argument("--format", choices=importers.FORMATS, help="defaults to the file extension")
+    import_parser.add_argument("--chunk-size", type=int, help="rows per transaction")
+    import_parser.set_defaults(run=import_command)
+
+    upsert_parser = commands.add_parser("upsert", help="import, updating the bookmarks whose title is already there")
+    upsert_parser.add_argument("file", help="file to read, - for stdin")
+    upsert_parser.add_argument("--format", choices=importers.FORMATS, help="defaults to the file extension")
+    upsert_parser.add_argument("--update", help="comma separated columns to overwrite, url,notes by default")
+    upsert_parser.add_argument("--chunk-size", type=int, help="rows per transaction")
+    upsert_parser.set_defaults(run=upsert_command)
+
+    export_parser = commands.add_parser("export", help="write every bookmark, in id order, to an NDJSON, CSV or columnar file")
+    export_parser.add_argument("file", help="file to write, - for stdout; a .gz name is gzipped")
+    export_parser.add_argument("--format", choices=exporters.FORMATS, help="defaults to the file extension")
+    export_parser.add_argument("--gzip", action="store_true", help="compress the output")
+    export_parser.add_argument("--batch-size", type=int, help="rows fetched from the database at a time")
+    export_parser.set_defaults(run=export_command)
+
+    token_parser = commands.add_parser("profile-token", help="print an X-Barky-Profile header value that profiles API requests")
+    token_parser.add_argument("--mode", choices=profiles.MODES, default="cprofile", help="profiler to use")
+    token_parser.add_argument("--ttl", type=int, default=300, help="seconds the token is good for")
+    token_parser.set_defaults(run=profile_token_command)
+
+    relay_parser = commands.add_parser("relay", help="publish the events in the outbox")
+    relay_parser.add_argument("--publisher", choices=publishers.PUBLISHERS, help="defaults to BARKY_OUTBOX_PUBLISHER")
+    relay_parser.add_argument("--once", action="store_true", help="publish what is there and exit")
+    relay_parser.set_defaults(run=relay_command)
+
+    args = parser.parse_args(argv)
+    load_dotenv()
+    orm.start_mappers()
+    try:
+        return args.run(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
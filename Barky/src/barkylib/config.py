@@ -9,6 +9,163 @@ def get_sqlite_file_url():
     return f"sqlite:///../bookmarks.db"
 
 
+def get_sqlite_async_url():
+    # same file through the aiosqlite driver, for the asyncio stack
+    return get_sqlite_file_url().replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+
+# Engine, pool and SQLite pragma settings, picked with BARKY_DB_PROFILE.
+# None leaves SQLite's own default in place; cache_size is in pages, or KiB when
+# negative. "default" is how the engine has always been set up.
+DB_PROFILES = {
+    "default": dict(
+        journal_mode=None,
+        synchronous=None,
+        cache_size=None,
+        mmap_size=None,
+        busy_timeout=None,
+        pool_size=5,
+        max_overflow=10,
+    ),
+    # concurrent readers alongside a writer, waits on locks instead of failing
+    "wal": dict(
+        journal_mode="WAL",
+        synchronous="FULL",
+        cache_size=None,
+        mmap_size=None,
+        busy_timeout=5000,
+        pool_size=10,
+        max_overflow=20,
+    ),
+    # WAL with fewer fsyncs (a power loss can lose the last commits, never
+    # corrupt the file), a 64MB page cache and 256MB of memory mapped I/O
+    "fast": dict(
+        journal_mode="WAL",
+        synchronous="NORMAL",
+        cache_size=-64000,
+        mmap_size=268435456,
+        busy_timeout=5000,
+        pool_size=20,
+        max_overflow=40,
+    ),
+}
+
+
+def get_db_profile(name=None):
+    name = name or os.environ.get("BARKY_DB_PROFILE", "default")
+    if name not in DB_PROFILES:
+        raise ValueError(f"Unknown database profile {name}, pick one of {', '.join(DB_PROFILES)}")
+    return dict(DB_PROFILES[name])
+
+
+def get_metrics_enabled():
+    # query and request metrics, see adapters/metrics.py and /api/metrics.
+    # Off unless BARKY_METRICS is set: they cost about 2% on the median
+    # benchmark, but a primary key lookup of ~120us pays ~8us per statement
+    # (+9-12%), mostly SQLAlchemy dispatching the cursor events
+    return os.environ.get("BARKY_METRICS", "0").lower() not in ("0", "false", "no", "off")
+
+
+def get_query_log_settings():
+    """
+    Statement recording per unit of work, see adapters/query_log.py. Off
+    unless BARKY_QUERY_LOG or BARKY_QUERY_STRICT is set; strict raises on
+    repeated statements instead of logging them.
+    """
+    strict = os.environ.get("BARKY_QUERY_STRICT", "0").lower() not in ("0", "false", "no", "off")
+    enabled = strict or os.environ.get("BARKY_QUERY_LOG", "0").lower() not in ("0", "false", "no", "off")
+    return dict(
+        enabled=enabled,
+        slow_ms=float(os.environ.get("BARKY_SLOW_QUERY_MS", 100)),
+        repeat_limit=int(os.environ.get("BARKY_REPEATED_QUERY_LIMIT", 10)),
+        strict=strict,
+    )
+
+
+def get_profiling_settings():
+    """
+    Per request profiling, see adapters/profiles.py. A BARKY_PROFILE_SECRET
+    lets signed X-Barky-Profile headers turn it on for a request (and opens
+    /api/admin/profiles to the same tokens), BARKY_PROFILE_SAMPLE_RATE
+    profiles that share of all requests. Neither set means off.
+    """
+    return dict(
+        secret=os.environ.get("BARKY_PROFILE_SECRET") or None,
+        sample_rate=float(os.environ.get("BARKY_PROFILE_SAMPLE_RATE", 0)),
+        mode=os.environ.get("BARKY_PROFILE_MODE", "sampling"),
+        keep=int(os.environ.get("BARKY_PROFILE_KEEP", 50)),
+        directory=os.environ.get("BARKY_PROFILE_DIR") or None,
+    )
+
+
+def get_write_behind_settings():
+    """
+    Write-behind adds, see services/write_behind.py. Off unless
+    BARKY_WRITE_BEHIND is set; BARKY_WRITE_BEHIND_DIR is the journal, one
+    directory per process; batches are written every BARKY_WRITE_BEHIND_ROWS
+    rows or BARKY_WRITE_BEHIND_MS milliseconds, whichever comes first.
+    BARKY_WRITE_BEHIND_FSYNC makes adds survive a power loss, not just a crash.
+    An update or delete waits up to BARKY_WRITE_BEHIND_FLUSH_MS for the rows
+    added before it to be written.
+    """
+    return dict(
+        enabled=os.environ.get("BARKY_WRITE_BEHIND", "0").lower() not in ("0", "false", "no", "off"),
+        directory=os.environ.get("BARKY_WRITE_BEHIND_DIR", "../bookmarks.journal"),
+        max_rows=int(os.environ.get("BARKY_WRITE_BEHIND_ROWS", 1000)),
+        max_delay_ms=float(os.environ.get("BARKY_WRITE_BEHIND_MS", 50)),
+        max_buffer=int(os.environ.get("BARKY_WRITE_BEHIND_BUFFER", 100000)),
+        fsync=os.environ.get("BARKY_WRITE_BEHIND_FSYNC", "0").lower() not in ("0", "false", "no", "off"),
+        flush_timeout_ms=float(os.environ.get("BARKY_WRITE_BEHIND_FLUSH_MS", 10000)),
+    )
+
+
+def get_outbox_settings():
+    """
+    Transactional outbox, see adapters/outbox.py and services/relay.py. Off
+    unless BARKY_OUTBOX is set. BARKY_OUTBOX_PUBLISHER is "redis" (the host
+    from get_redis_host_and_port) or "memory". Only the relay holding the
+    BARKY_OUTBOX_LOCK file publishes, the processes of one deployment on a
+    host must share it.
+    """
+    return dict(
+        enabled=os.environ.get("BARKY_OUTBOX", "0").lower() not in ("0", "false", "no", "off"),
+        publisher=os.environ.get("BARKY_OUTBOX_PUBLISHER", "redis"),
+        batch_size=int(os.environ.get("BARKY_OUTBOX_BATCH_SIZE", 500)),
+        interval_ms=float(os.environ.get("BARKY_OUTBOX_INTERVAL_MS", 1000)),
+        lock_path=os.environ.get("BARKY_OUTBOX_LOCK", "../bookmarks.outbox.lock"),
+    )
+
+
+def get_bulk_chunk_size():
+    return int(os.environ.get("BULK_CHUNK_SIZE", 5000))
+
+
+def get_cache_settings():
+    # a max_size of 0 turns the bookmark cache off
+    max_size = int(os.environ.get("BOOKMARK_CACHE_SIZE", 10000))
+    ttl = float(os.environ.get("BOOKMARK_CACHE_TTL", 300))
+    return dict(max_size=max_size, ttl=ttl)
+
+
+def get_event_dispatch_settings():
+    """
+    Settings for services.dispatch.EventDispatcher. With no BARKY_EVENT_WORKERS
+    (or 0) events are handled inline, on the thread that raised them.
+    BARKY_EVENT_HANDLER_LIMITS caps handlers by name, e.g. "check_link=2,notify=1".
+    """
+    limits = dict()
+    for item in os.environ.get("BARKY_EVENT_HANDLER_LIMITS", "").split(","):
+        if item.strip():
+            name, limit = item.split("=")
+            limits[name.strip()] = int(limit)
+    return dict(
+        workers=int(os.environ.get("BARKY_EVENT_WORKERS", 0)),
+        max_queue=int(os.environ.get("BARKY_EVENT_QUEUE_SIZE", 1000)),
+        executor=os.environ.get("BARKY_EVENT_EXECUTOR", "thread"),
+        handler_limits=limits,
+    )
+
+
 def get_postgres_uri():
     host = os.environ.get("DB_HOST", "localhost")
     port = 54321 if host == "localhost" else 5432
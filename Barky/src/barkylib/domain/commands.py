@@ -8,8 +8,6 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
-import requests
-
 # from database import DatabaseManager
 
 # module scope
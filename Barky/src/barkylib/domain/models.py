@@ -3,6 +3,9 @@ import json
 from json import JSONEncoder
 
 
+FIELDS = ("id", "title", "url", "notes", "date_added", "date_edited")
+
+
 class Bookmark:
     """
     Pure domain bookmark:
@@ -37,4 +40,4 @@ class Bookmark:
         return json.dumps(self.as_dict(), default=str)
 
     def as_dict(self):
-       return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+       return {name: getattr(self, name) for name in FIELDS}
@@ -0,0 +1,158 @@
+"""
+Async versions of the handlers in handlers.py, for AsyncSqlAlchemyUnitOfWork.
+Queries are built by handlers.get_query so both stacks return the same results.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from typing import TYPE_CHECKING, Iterable
+
+from barkylib.adapters import serializers
+from barkylib.domain import models
+from barkylib.services.handlers import get_query, search_page
+
+if TYPE_CHECKING:
+    from . import unit_of_work
+
+
+async def add_bookmark(
+        uow: unit_of_work.AsyncSqlAlchemyUnitOfWork,
+        id: int = None,
+        title: str = None,
+        url: str = None,
+        notes: str = None,
+        date_added: datetime = None,
+        bookmark: models.Bookmark = None,
+        bookmarks: list[models.Bookmark] = None,
+        bulk: bool = False,
+):
+    date_added = datetime.now()
+    if (bookmark is not None and bookmark.date_added is None):
+        bookmark.date_added = date_added
+    async with uow:
+        if bookmarks is not None:
+            for b in bookmarks:
+                if b.date_added is None:
+                    b.date_added = date_added
+            return await uow.bookmarks.add_many(bookmarks, bulk=bulk)
+
+        bookmark = models.Bookmark(id=id, title=title, url=url, notes=notes, date_added=date_added, date_edited=datetime.now()) if bookmark is None else bookmark
+        return await uow.bookmarks.add_one(bookmark, bulk=bulk)
+
+
+async def list_bookmark(
+        id: int,
+        uow: unit_of_work.AsyncSqlAlchemyUnitOfWork
+):
+    async with uow:
+        bookmark = await uow.bookmarks.get_dict(id)
+        if bookmark is None:
+            return 'No results'
+        else:
+            return bookmark
+
+
+async def list_all_bookmarks(
+        filter: str,
+        value: object,
+        sort: str,
+        uow: unit_of_work.AsyncSqlAlchemyUnitOfWork
+):
+    async with uow:
+        rows = await uow.bookmarks.find_rows(get_query(filter, value, sort))
+        return [serializers.row_to_dict(row) for row in rows]
+
+
+async def list_all_bookmarks_json(
+        filter: str,
+        value: object,
+        sort: str,
+        uow: unit_of_work.AsyncSqlAlchemyUnitOfWork
+) -> bytes:
+    async with uow:
+        return serializers.rows_to_json(await uow.bookmarks.find_rows(get_query(filter, value, sort)))
+
+
+async def list_bookmarks_page(
+        filter: str,
+        value: object,
+        sort: str,
+        after: str,
+        limit: int,
+        uow: unit_of_work.AsyncSqlAlchemyUnitOfWork
+):
+    async with uow:
+        bookmarks, next_cursor = await uow.bookmarks.find_page(
+            get_query(filter, value, None), after=after, limit=limit, sort=sort
+        )
+
+        return {
+            'bookmarks': [serializers.bookmark_to_dict(bookmark) for bookmark in bookmarks],
+            'next': next_cursor,
+        }
+
+
+async def iter_all_bookmarks(
+        filter: str,
+        value: object,
+        sort: str,
+        uow: unit_of_work.AsyncSqlAlchemyUnitOfWork,
+        batch_size: int = None,
+):
+    async with uow:
+        async for row in uow.bookmarks.stream_rows(get_query(filter, value, sort), batch_size=batch_size):
+            yield serializers.row_to_dict(row)
+
+
+async def search_bookmarks(
+        text: str,
+        limit: int,
+        offset: int,
+        uow: unit_of_work.AsyncSqlAlchemyUnitOfWork
+):
+    limit, offset = search_page(limit, offset)
+    async with uow:
+        results = await uow.bookmarks.search(text, limit=limit + 1, offset=offset)
+
+        return {
+            'results': results[:limit],
+            'next': offset + limit if len(results) > limit else None,
+        }
+
+
+async def edit_bookmark(
+        uow: unit_of_work.AsyncSqlAlchemyUnitOfWork,
+        id: int = None,
+        title: str = None,
+        url: str = None,
+        notes: str = None,
+        bookmark: models.Bookmark = None,
+):
+    async with uow:
+        try:
+            bookmark = models.Bookmark(id=id, title=title, url=url, notes=notes, date_edited=datetime.now()) if bookmark is None else bookmark
+            return await uow.bookmarks.update(bookmark=bookmark)
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+
+async def delete_bookmark(
+        bookmark: models.Bookmark,
+        uow: unit_of_work.AsyncSqlAlchemyUnitOfWork
+):
+    async with uow:
+        try:
+            await uow.bookmarks.delete_one(bookmark=bookmark)
+            return 200
+        except Exception as e:
+            print(e)
+            return 'Error', 400
+
+
+async def delete_bookmarks(
+        ids: Iterable,
+        uow: unit_of_work.AsyncSqlAlchemyUnitOfWork
+) -> int:
+    async with uow:
+        return await uow.bookmarks.delete_by_ids(ids)
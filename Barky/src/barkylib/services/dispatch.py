@@ -0,0 +1,220 @@
+"""
+Background event dispatch for the message bus.
+
+Events are put on a bounded queue and handled by worker threads, so slow
+handlers (notifications, indexing, link checks) don't add to the latency of
+the request that raised the event. With executor="process" the workers hand
+the calls of handlers that can be pickled, module level functions that take
+just the event, to a process pool. The others stay on the worker threads:
+the handlers bootstrap binds to a unit of work or the cache can't be sent to
+a child process, and a cache invalidated there wouldn't be this process's.
+"""
+import atexit
+import logging
+import pickle
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Type
+
+from barkylib.domain import events
+
+logger = logging.getLogger(__name__)
+
+# tells a worker to exit, queued behind everything it has to drain
+_STOP = object()
+
+
+def handler_name(handler: Callable) -> str:
+    return getattr(handler, "__name__", repr(handler))
+
+
+def picklable(handler: Callable) -> bool:
+    try:
+        pickle.dumps(handler)
+    except Exception:
+        return False
+    return True
+
+
+class HandlerStats:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        return dict(
+            calls=self.calls,
+            errors=self.errors,
+            in_flight=self.in_flight,
+            total_seconds=self.total_seconds,
+            max_seconds=self.max_seconds,
+            avg_seconds=self.total_seconds / self.calls if self.calls else 0.0,
+        )
+
+
+class EventDispatcher:
+    """
+    Runs the handlers of submitted events on a pool of workers.
+
+    - backpressure: the queue holds at most max_queue events, submit blocks
+      while it is full and raises queue.Full after submit_timeout seconds
+    - handler_limits: the most calls of a handler (by name) that run at once
+    - shutdown: stops taking events, then by default drains the queue
+    - stats(): queue depth and per-handler latency
+    """
+
+    def __init__(
+        self,
+        event_handlers: Dict[Type[events.Event], List[Callable]],
+        workers: int = 4,
+        max_queue: int = 1000,
+        executor: str = "thread",
+        handler_limits: Dict[str, int] = None,
+        submit_timeout: Optional[float] = None,
+    ) -> None:
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor {executor}, use thread or process")
+        self.event_handlers = event_handlers
+        self.executor = executor
+        self.submit_timeout = submit_timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.limits = {
+            name: threading.BoundedSemaphore(limit) for name, limit in (handler_limits or {}).items()
+        }
+        self.process_pool = ProcessPoolExecutor(max_workers=workers) if executor == "process" else None
+        # the handlers that run in the process pool
+        self.pooled = set()
+        if self.process_pool is not None:
+            self.pooled = {
+                handler for handlers in event_handlers.values() for handler in handlers if picklable(handler)
+            }
+
+        self._lock = threading.Lock()
+        self._handler_stats = dict()
+        self.submitted = 0
+        self.rejected = 0
+        self.handled = 0
+        self.max_depth = 0
+        self.closed = False
+
+        self.workers = [
+            threading.Thread(target=self._work, name=f"event-dispatch-{number}", daemon=True)
+            for number in range(max(1, workers))
+        ]
+        for worker in self.workers:
+            worker.start()
+        # whatever is still queued when the interpreter exits gets handled
+        atexit.register(self.shutdown)
+
+    def submit(self, event: events.Event) -> None:
+        if self.closed:
+            raise RuntimeError("The event dispatcher has been shut down")
+        try:
+            self.queue.put(event, timeout=self.submit_timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise
+
+        with self._lock:
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def join(self) -> None:
+        """
+        Waits until every submitted event has been handled
+        """
+        self.queue.join()
+
+    def shutdown(self, drain: bool = True, timeout: Optional[float] = None) -> bool:
+        """
+        Stops the workers, after they have handled what is queued unless drain
+        is False. Returns False if they didn't all stop within timeout seconds.
+        """
+        with self._lock:
+            if self.closed:
+                return True
+            self.closed = True
+        atexit.unregister(self.shutdown)
+
+        if not drain:
+            while True:
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                except queue.Empty:
+                    break
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for _ in self.workers:
+            self.queue.put(_STOP)
+        for worker in self.workers:
+            worker.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+        stopped = not any(worker.is_alive() for worker in self.workers)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=stopped)
+        return stopped
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(
+                executor=self.executor,
+                workers=len(self.workers),
+                queue_depth=self.queue.qsize(),
+                max_queue=self.queue.maxsize,
+                max_depth=self.max_depth,
+                submitted=self.submitted,
+                rejected=self.rejected,
+                handled=self.handled,
+                handlers={name: stats.as_dict() for name, stats in self._handler_stats.items()},
+            )
+
+    def _work(self) -> None:
+        while True:
+            event = self.queue.get()
+            try:
+                if event is _STOP:
+                    return
+                for handler in self.event_handlers.get(type(event), ()):
+                    self._run(handler, event)
+                with self._lock:
+                    self.handled += 1
+            finally:
+                self.queue.task_done()
+
+    def _run(self, handler: Callable, event: events.Event) -> None:
+        name = handler_name(handler)
+        limit = self.limits.get(name)
+        if limit is not None:
+            limit.acquire()
+        with self._lock:
+            stats = self._handler_stats.setdefault(name, HandlerStats())
+            stats.in_flight += 1
+
+        failed = False
+        start = time.perf_counter()
+        try:
+            logger.debug("handling event %s with handler %s", event, name)
+            if handler in self.pooled:
+                self.process_pool.submit(handler, event).result()
+            else:
+                handler(event)
+        except Exception:
+            failed = True
+            logger.exception("Exception handling event %s", event)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stats.in_flight -= 1
+                stats.calls += 1
+                stats.errors += failed
+                stats.total_seconds += elapsed
+                stats.max_seconds = max(stats.max_seconds, elapsed)
+            if limit is not None:
+                limit.release()
@@ -2,8 +2,12 @@ from __future__ import annotations
 
 import json
 from dataclasses import asdict
-from typing import TYPE_CHECKING, Callable, Dict, List, Type
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Type
 
+from barkylib import config
+from barkylib.adapters import exporters, importers, repository, serializers
+from barkylib.adapters.cache import BookmarkCache
+from barkylib.adapters.repository import MAX_PAGE_SIZE, bookmark_id
 from barkylib.domain import commands, events, models
 from barkylib.domain.commands import EditBookmarkCommand
 from barkylib.domain.events import BookmarkEdited
@@ -23,13 +27,22 @@ def add_bookmark(
         notes: str = None,
         date_added: datetime = None,
         bookmark: models.Bookmark = None,
+        bookmarks: list[models.Bookmark] = None,
+        bulk: bool = False,
 ):
     date_added = datetime.now()
     if (bookmark is not None and bookmark.date_added is None):
         bookmark.date_added = date_added
     with uow:
+        if bookmarks is not None:
+            # many at once, bulk=True skips the ORM and uses chunked executemany
+            for b in bookmarks:
+                if b.date_added is None:
+                    b.date_added = date_added
+            return uow.bookmarks.add_many(bookmarks, bulk=bulk)
+
         bookmark = models.Bookmark(id=id, title=title, url=url, notes=notes, date_added=date_added, date_edited=datetime.now()) if bookmark is None else bookmark
-        uow.bookmarks.add_one(bookmark)
+        return uow.bookmarks.add_one(bookmark, bulk=bulk)
 
 
 def list_bookmark(
@@ -37,11 +50,11 @@ def list_bookmark(
         uow: unit_of_work.AbstractUnitOfWork
 ):
     with uow:
-        bookmark = uow.bookmarks.get(id)
+        bookmark = uow.bookmarks.get_dict(id)
         if bookmark is None:
             return 'No results'
         else:
-            return json.loads(bookmark.to_json())
+            return bookmark
 
 
 def list_all_bookmarks(
@@ -52,14 +65,199 @@ def list_all_bookmarks(
 ):
 
     with uow:
-        bookmarks = uow.bookmarks.find_all(get_query(filter, value, sort))
-        json_bookmarks = list()
+        rows = uow.bookmarks.find_rows(get_query(filter, value, sort))
+        return [serializers.row_to_dict(row) for row in rows]
+
+
+def list_all_bookmarks_json(
+        filter: str,
+        value: object,
+        sort: str,
+        uow: unit_of_work.AbstractUnitOfWork
+) -> bytes:
+    """
+    list_all_bookmarks already encoded, rows go to response bytes in one pass
+    """
+    with uow:
+        return serializers.rows_to_json(uow.bookmarks.find_rows(get_query(filter, value, sort)))
+
+
+def list_bookmarks_page(
+        filter: str,
+        value: object,
+        sort: str,
+        after: str,
+        limit: int,
+        uow: unit_of_work.AbstractUnitOfWork
+):
+    with uow:
+        bookmarks, next_cursor = uow.bookmarks.find_page(
+            get_query(filter, value, None), after=after, limit=limit, sort=sort
+        )
+
+        return {
+            'bookmarks': [serializers.bookmark_to_dict(bookmark) for bookmark in bookmarks],
+            'next': next_cursor,
+        }
+
+
+def iter_all_bookmarks(
+        filter: str,
+        value: object,
+        sort: str,
+        uow: unit_of_work.AbstractUnitOfWork,
+        batch_size: int = None,
+):
+    """
+    Generator version of list_all_bookmarks, the unit of work stays open until
+    the last bookmark has been yielded (or the generator is closed)
+    """
+    with uow:
+        for row in uow.bookmarks.stream_rows(get_query(filter, value, sort), batch_size=batch_size):
+            yield serializers.row_to_dict(row)
 
-        if bookmarks:
-            for bookmark in bookmarks:
-                json_bookmarks.append(json.loads(bookmark.to_json()))
 
-        return json_bookmarks
+def export_bookmarks(
+        format: str,
+        uow: unit_of_work.AbstractUnitOfWork,
+        compress: bool = False,
+        batch_size: int = None,
+):
+    """
+    Generator of the whole table as an exporters format, in id order and
+    gzipped if asked. The rows come from one SELECT read off a server side
+    cursor, which the database answers from a single snapshot, so the export
+    never mixes rows from before and after a concurrent write. With SQLite's
+    WAL profiles the writes go ahead and don't show up in the export; with
+    the default rollback journal they wait for it to finish.
+    """
+    if format not in exporters.FORMATS:
+        raise ValueError(f"Unknown export format {format}, use one of {', '.join(exporters.FORMATS)}")
+    with uow:
+        rows = uow.bookmarks.stream_rows(
+            select(models.Bookmark).order_by(models.Bookmark.id),
+            batch_size=batch_size,
+        )
+        chunks = exporters.write(rows, format)
+        if compress:
+            chunks = exporters.gzip_chunks(chunks)
+        yield from chunks
+
+
+def search_page(limit, offset) -> tuple[int, int]:
+    """
+    limit clamped to 1..MAX_PAGE_SIZE (20 when not given) and offset to 0 or
+    more; SQLite reads LIMIT -1 as no limit at all
+    """
+    return max(1, min(limit or 20, MAX_PAGE_SIZE)), max(0, offset or 0)
+
+
+def search_bookmarks(
+        text: str,
+        limit: int,
+        offset: int,
+        uow: unit_of_work.AbstractUnitOfWork
+):
+    limit, offset = search_page(limit, offset)
+    with uow:
+        # one extra result tells us if there is a next page
+        results = uow.bookmarks.search(text, limit=limit + 1, offset=offset)
+
+        return {
+            'results': results[:limit],
+            'next': offset + limit if len(results) > limit else None,
+        }
+
+
+# the import report lists at most this many failed rows, it still counts all of them
+MAX_REPORTED_ERRORS = 1000
+
+
+def import_bookmarks(
+        records: Iterable[tuple[int, object]],
+        uow: unit_of_work.AbstractUnitOfWork,
+        chunk_size: int = None,
+):
+    """
+    Adds the (line, record) pairs from importers.read_records. Valid records
+    are inserted chunk_size at a time, each chunk in its own transaction; a
+    record whose title is already taken fails on its own, the rest of its
+    chunk still goes in. Returns the counts and the line and reason of each
+    failed row.
+    """
+    report = {'imported': 0, 'failed': 0, 'errors': []}
+
+    with uow:
+        for lines, rows in import_chunks(records, report, chunk_size or config.get_bulk_chunk_size()):
+            inserted = uow.bookmarks.add_new_rows(rows, chunk_size=len(rows))
+            for line, row, new in zip(lines, rows, inserted):
+                if new:
+                    report['imported'] += 1
+                else:
+                    report_error(report, line, f"A bookmark titled {row['title']} already exists")
+
+    report['errors_truncated'] = report['failed'] > len(report['errors'])
+    return report
+
+
+def upsert_bookmarks(
+        records: Iterable[tuple[int, object]],
+        uow: unit_of_work.AbstractUnitOfWork,
+        update_columns: Iterable[str] = None,
+        chunk_size: int = None,
+):
+    """
+    import_bookmarks for data that may already be there: a record whose
+    title is taken overwrites update_columns (url and notes by default) of
+    that bookmark instead of failing. Running it again with the same file
+    changes nothing. Returns inserted, updated, unchanged and failed counts.
+    """
+    update_columns = repository.upsert_columns(
+        repository.DEFAULT_UPSERT_COLUMNS if update_columns is None else update_columns
+    )
+    chunk_size = chunk_size or config.get_bulk_chunk_size()
+    report = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'failed': 0, 'errors': []}
+
+    with uow:
+        for lines, rows in import_chunks(records, report, chunk_size):
+            counts = uow.bookmarks.upsert_many(rows, update_columns=update_columns, chunk_size=chunk_size)
+            for name, count in counts.items():
+                report[name] += count
+
+    report['errors_truncated'] = report['failed'] > len(report['errors'])
+    return report
+
+
+def import_chunks(records: Iterable[tuple[int, object]], report: dict, chunk_size: int):
+    """
+    The valid records as (lines, rows) lists of up to chunk_size, the others
+    go into the report's errors
+    """
+    now = datetime.now()
+    lines, rows = list(), list()
+    for line, record in records:
+        if isinstance(record, Exception):
+            report_error(report, line, record)
+            continue
+        try:
+            rows.append(importers.to_row(record, now))
+            lines.append(line)
+        except ValueError as e:
+            report_error(report, line, e)
+            continue
+
+        if len(rows) >= chunk_size:
+            yield lines, rows
+            lines, rows = list(), list()
+
+    if rows:
+        yield lines, rows
+
+
+def report_error(report: dict, line: int, error) -> None:
+    report['failed'] += 1
+    if len(report['errors']) < MAX_REPORTED_ERRORS:
+        report['errors'].append({'line': line, 'error': str(error)})
 
 
 def edit_bookmark(
@@ -91,6 +289,18 @@ def delete_bookmark(
             print(e)
             return 'Error', 400
 
+
+def delete_bookmarks(
+        ids: Iterable,
+        uow: unit_of_work.AbstractUnitOfWork
+) -> int:
+    """
+    Deletes by id without reading the bookmarks first, returns how many
+    there were
+    """
+    with uow:
+        return uow.bookmarks.delete_by_ids(ids)
+
 # def add_bookmark(
 #     cmd: commands.AddBookmarkCommand,
 #     uow: unit_of_work.AbstractUnitOfWork,
@@ -106,6 +316,18 @@ def delete_bookmark(
 #         uow.commit()
 
 
+def invalidate_cached_bookmark(
+        event: events.Event,
+        cache: BookmarkCache = None,
+):
+    if cache is None:
+        return
+    if isinstance(event, events.BookmarkDeleted):
+        cache.invalidate(bookmark_id(event.bookmark))
+    else:
+        cache.invalidate(int(event.id))
+
+
 # ListBookmarksCommand: order_by: str order: str
 def list_bookmarks(
     cmd: commands.ListBookmarksCommand,
@@ -113,43 +335,110 @@ def list_bookmarks(
 ):
     bookmarks = None
     with uow:
-        bookmarks = uow.bookmarks.all()
+        bookmarks = uow.bookmarks.find_all(get_query(None, None, cmd.order_by))
+
+    return bookmarks[::-1] if cmd.order == 'desc' else bookmarks
+
 
-    return bookmarks
+# Command handlers take the command first, the message bus injects the rest.
+# The *_batch variants get a run of consecutive commands of one type and
+# handle all of them in one unit of work with one commit.
+
+def add_bookmark_command(
+    cmd: commands.AddBookmarkCommand,
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    return add_bookmarks_batch([cmd], uow)[0]
+
+
+def add_bookmarks_batch(
+    cmds: list[commands.AddBookmarkCommand],
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    now = datetime.now()
+    bookmarks = [
+        models.Bookmark(
+            id=cmd.id,
+            title=cmd.title,
+            url=cmd.url,
+            notes=cmd.notes,
+            date_added=parse_datetime(cmd.date_added, now),
+            date_edited=parse_datetime(cmd.date_edited, now),
+        )
+        for cmd in cmds
+    ]
+    with uow:
+        return uow.bookmarks.add_many(bookmarks, bulk=True)
 
 
 # DeleteBookmarkCommand: id: int
-# def delete_bookmark(
-#     cmd: commands.DeleteBookmarkCommand,
-#     uow: unit_of_work.AbstractUnitOfWork,
-# ):
-#     with uow:
-#         pass
+def delete_bookmark_command(
+    cmd: commands.DeleteBookmarkCommand,
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    delete_bookmarks_batch([cmd], uow)
+
+
+def delete_bookmarks_batch(
+    cmds: list[commands.DeleteBookmarkCommand],
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    with uow:
+        uow.bookmarks.delete_by_ids(cmd.id for cmd in cmds)
 
 
 # EditBookmarkCommand(Command):
-# def edit_bookmark(
-#     cmd: commands.EditBookmarkCommand,
-#     uow: unit_of_work.AbstractUnitOfWork,
-# ):
-#     with uow:
-#         pass
+def edit_bookmark_command(
+    cmd: commands.EditBookmarkCommand,
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    counts = edit_bookmarks_batch([cmd], uow)
+    return counts if isinstance(counts, tuple) else counts[0]
+
+
+def edit_bookmarks_batch(
+    cmds: list[commands.EditBookmarkCommand],
+    uow: unit_of_work.AbstractUnitOfWork,
+):
+    bookmarks = [
+        models.Bookmark(id=cmd.id, title=cmd.title, url=cmd.url, notes=cmd.notes, date_added=None, date_edited=None)
+        for cmd in cmds
+    ]
+    with uow:
+        return uow.bookmarks.update_many(bookmarks)
+
+
+def parse_datetime(value, default: datetime = None):
+    if value is None:
+        return default
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
 
 
 EVENT_HANDLERS = {
     events.BookmarkAdded: [add_bookmark],
     events.BookmarksListed: [list_bookmarks],
-    events.BookmarkDeleted: [delete_bookmark],
-    events.BookmarkEdited: [edit_bookmark],
+    events.BookmarkDeleted: [delete_bookmark, invalidate_cached_bookmark],
+    events.BookmarkEdited: [edit_bookmark, invalidate_cached_bookmark],
 }  # type: Dict[Type[events.Event], List[Callable]]
 
 COMMAND_HANDLERS = {
-    commands.AddBookmarkCommand: add_bookmark,
+    commands.AddBookmarkCommand: add_bookmark_command,
     commands.ListBookmarksCommand: list_bookmarks,
-    commands.DeleteBookmarkCommand: delete_bookmark,
-    commands.EditBookmarkCommand: edit_bookmark,
+    commands.DeleteBookmarkCommand: delete_bookmark_command,
+    commands.EditBookmarkCommand: edit_bookmark_command,
 }  # type: Dict[Type[commands.Command], Callable]
 
+BATCH_COMMAND_HANDLERS = {
+    commands.AddBookmarkCommand: add_bookmarks_batch,
+    commands.DeleteBookmarkCommand: delete_bookmarks_batch,
+    commands.EditBookmarkCommand: edit_bookmarks_batch,
+}  # type: Dict[Type[commands.Command], Callable]
+
+
+# what get_query understands, the indexes in adapters/orm.py cover all of them
+FILTERS = ('id', 'title', 'url', 'date_added', 'date_edited')
+SORTS = ('id', 'title', 'date_added', 'date_edited')
+
 
 def get_query(
         filter: str,
@@ -159,14 +448,19 @@ def get_query(
     query = select(models.Bookmark)
 
     if filter is not None:
+        if filter in ('date_added', 'date_edited') and isinstance(value, str):
+            value = datetime.fromisoformat(value)
+
         if filter == 'id':
             query = query.where(models.Bookmark.id == int(value))
         elif filter == 'title' and isinstance(value, str):
             query = query.where(models.Bookmark.title == str(value))
+        elif filter == 'url' and isinstance(value, str):
+            query = query.where(models.Bookmark.url == str(value))
         elif filter == 'date_added' and isinstance(value, datetime):
-            query = query.where(models.Bookmark.date_added == datetime(value))
+            query = query.where(models.Bookmark.date_added == value)
         elif filter == 'date_edited' and isinstance(value, datetime):
-            query = query.where(models.Bookmark.date_edited == datetime(value))
+            query = query.where(models.Bookmark.date_edited == value)
 
     if sort is not None:
         if sort == 'id':
@@ -179,4 +473,3 @@ def get_query(
             query = query.order_by(models.Bookmark.date_edited)
 
     return query
-
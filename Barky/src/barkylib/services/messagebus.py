@@ -1,12 +1,13 @@
 from __future__ import annotations
 
 import logging
-from typing import TYPE_CHECKING, Callable, Dict, List, Type, Union
+from collections import deque
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Type, Union
 
 from barkylib.domain import commands, events
 
 if TYPE_CHECKING:
-    from . import unit_of_work
+    from . import dispatch, unit_of_work
 
 logger = logging.getLogger(__name__)
 
@@ -19,23 +20,49 @@ class MessageBus:
         uow: unit_of_work.AbstractUnitOfWork,
         event_handlers: Dict[Type[events.Event], List[Callable]],
         command_handlers: Dict[Type[commands.Command], Callable],
+        batch_command_handlers: Dict[Type[commands.Command], Callable] = None,
+        dispatcher: dispatch.EventDispatcher = None,
     ):
         self.uow = uow
         self.event_handlers = event_handlers
         self.command_handlers = command_handlers
+        # take a list of commands of one type and handle them in one unit of work
+        self.batch_command_handlers = batch_command_handlers or dict()
+        # when set, events are handled in the background by its workers
+        self.dispatcher = dispatcher
 
     def handle(self, message: Message):
-        self.queue = [message]
+        self.handle_many([message])
+
+    def handle_many(self, messages: Iterable[Message]):
+        """
+        Handles the messages in order. A run of consecutive commands of the
+        same type that has a batch handler goes to it as one list, so e.g.
+        10k AddBookmarkCommands are one transaction and one commit. Events
+        raised while handling are queued after the messages already waiting.
+        """
+        self.queue = deque(messages)
         while self.queue:
-            message = self.queue.pop(0)
+            message = self.queue.popleft()
             if isinstance(message, events.Event):
                 self.handle_event(message)
             elif isinstance(message, commands.Command):
-                self.handle_command(message)
+                if type(message) in self.batch_command_handlers:
+                    batch = [message]
+                    while self.queue and type(self.queue[0]) is type(message):
+                        batch.append(self.queue.popleft())
+                    self.handle_command_batch(batch)
+                else:
+                    self.handle_command(message)
             else:
                 raise Exception(f"{message} was not an Event or Command")
 
     def handle_event(self, event: events.Event):
+        if self.dispatcher is not None:
+            # blocks while the dispatcher's queue is full
+            self.dispatcher.submit(event)
+            return
+
         for handler in self.event_handlers[type(event)]:
             try:
                 logger.debug("handling event %s with handler %s", event, handler)
@@ -54,3 +81,13 @@ class MessageBus:
         except Exception:
             logger.exception("Exception handling command %s", command)
             raise
+
+    def handle_command_batch(self, batch: List[commands.Command]):
+        logger.debug("handling %s %s commands", len(batch), type(batch[0]).__name__)
+        try:
+            handler = self.batch_command_handlers[type(batch[0])]
+            handler(batch)
+            self.queue.extend(self.uow.collect_new_events())
+        except Exception:
+            logger.exception("Exception handling %s batch of %s", type(batch[0]).__name__, len(batch))
+            raise
@@ -0,0 +1,164 @@
+"""
+Publishes the events in the outbox table (adapters/outbox.py) on a thread of
+its own, so a write request never waits on the publisher.
+
+Each round reads the oldest batch_size events, publishes them with one
+publish_many call and deletes them in a transaction of their own. A commit
+that writes to the outbox wakes the relay right away; interval_ms is how
+often it looks anyway, for events committed by other processes. When the
+publisher fails the events stay in the outbox and the round is tried again
+after interval_ms, so an outage delays events but doesn't lose them.
+
+Rows aren't claimed before they are published, so two relays on one outbox
+would both publish them. With lock_path, run() only publishes while it holds
+an exclusive flock on that file: every API worker can start a relay, one of
+them owns the outbox and the others try for the lock every interval_ms, so
+one takes over when the owner's process exits. The lock is per host; with
+workers on several hosts, run the CLI relay on one of them instead.
+"""
+import fcntl
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import delete, func, select
+
+from barkylib.adapters import orm, outbox
+from barkylib.adapters.publishers import AbstractPublisher, Message
+from barkylib.adapters.repository import SQLITE_MAX_VARIABLES
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxRelay:
+    def __init__(
+        self,
+        session_factory,
+        publisher: AbstractPublisher,
+        batch_size: int = 500,
+        interval_ms: float = 1000,
+        lock_path: Optional[str] = None,
+    ) -> None:
+        self.session_factory = session_factory
+        self.publisher = publisher
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self.lock_path = lock_path
+        self._lock = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.published = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_batch_seconds = 0.0
+
+    def start(self) -> "OutboxRelay":
+        self._thread = threading.Thread(target=self.run, name="outbox-relay", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = 10) -> None:
+        self._stopped.set()
+        outbox.written.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.release()
+        self.publisher.close()
+
+    def acquire(self) -> bool:
+        """
+        Takes the lock_path lock that makes this the relay of the outbox,
+        returns whether it has it. Always True without a lock_path.
+        """
+        if self.lock_path is None or self._lock is not None:
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock = fd
+        logger.info("this process publishes the outbox now")
+        return True
+
+    def release(self) -> None:
+        if self._lock is not None:
+            # closing the descriptor releases the flock
+            os.close(self._lock)
+            self._lock = None
+
+    def publish_batch(self) -> int:
+        """
+        Publishes and deletes the oldest batch, returns how many events it had
+        """
+        with self.session_factory() as session:
+            orm.ensure_schema(session.get_bind())
+            rows = session.execute(
+                select(orm.outbox.c.id, orm.outbox.c.topic, orm.outbox.c.payload)
+                .order_by(orm.outbox.c.id)
+                .limit(self.batch_size)
+            ).all()
+            if not rows:
+                return 0
+
+            started = time.perf_counter()
+            self.publisher.publish_many([Message(*row) for row in rows])
+            ids = [row.id for row in rows]
+            for start in range(0, len(ids), SQLITE_MAX_VARIABLES):
+                session.execute(delete(orm.outbox).where(orm.outbox.c.id.in_(ids[start:start + SQLITE_MAX_VARIABLES])))
+            session.commit()
+
+        self.published += len(rows)
+        self.batches += 1
+        self.last_batch_seconds = time.perf_counter() - started
+        return len(rows)
+
+    def publish_all(self) -> int:
+        """
+        Publishes until the outbox is empty, returns how many events went out
+        """
+        published = 0
+        while True:
+            count = self.publish_batch()
+            published += count
+            if count < self.batch_size:
+                return published
+
+    def backlog(self) -> int:
+        with self.session_factory() as session:
+            orm.ensure_schema(session.get_bind())
+            return session.scalar(select(func.count()).select_from(orm.outbox))
+
+    def stats(self) -> dict:
+        return dict(
+            published=self.published,
+            batches=self.batches,
+            errors=self.errors,
+            owner=int(self._lock is not None or self.lock_path is None),
+            last_batch_seconds=self.last_batch_seconds,
+        )
+
+    def run(self) -> None:
+        """
+        Publishes until stop() is called, on the thread start() starts or the
+        caller's, while it has the lock
+        """
+        while not self._stopped.is_set():
+            if not self.acquire():
+                self._stopped.wait(self.interval)
+                continue
+            # cleared first, a commit from now on wakes the next wait
+            outbox.written.clear()
+            try:
+                if self.publish_batch() == self.batch_size:
+                    continue
+            except Exception:
+                logger.exception("Couldn't publish the outbox, will retry")
+                self.errors += 1
+                self._stopped.wait(self.interval)
+                continue
+            outbox.written.wait(self.interval)
@@ -2,14 +2,23 @@ from __future__ import annotations
 
 import abc
 from abc import ABC
+from typing import TYPE_CHECKING
 
 from barkylib import config
 from barkylib.adapters import repository
-from barkylib.adapters.orm import mapper_registry
-from sqlalchemy import create_engine
+from barkylib.adapters.cache import BookmarkCache
+from barkylib.adapters.memory import BookmarkTable, InMemoryRepository
+from barkylib.adapters import metrics, orm, outbox, query_log
+from barkylib.services.write_behind import WriteBehindRepository, WriteBehindWriter
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
 
+if TYPE_CHECKING:
+    # the asyncio stack is imported where it's used, see create_profiled_async_engine
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
 
 class AbstractUnitOfWork(ABC):
     bookmarks: repository.AbstractRepository
@@ -23,11 +32,15 @@ class AbstractUnitOfWork(ABC):
     def commit(self):
         self._commit()
 
-    # def collect_new_events(self):
-    #     for bookmark in self.bookmarks.seen:
-    #         while bookmark.events:
-    #             yield bookmark.events.pop(0)
-    #
+    def collect_new_events(self):
+        # there is no repository until the unit of work has been entered
+        bookmarks = getattr(self, "bookmarks", None)
+        for bookmark in bookmarks.seen if bookmarks is not None else ():
+            # bookmarks loaded by the ORM skip __init__, so most have no events
+            bookmark_events = getattr(bookmark, "events", None)
+            while bookmark_events:
+                yield bookmark_events.pop(0)
+
     @abc.abstractmethod
     def _commit(self):
         raise NotImplementedError
@@ -37,31 +50,251 @@ class AbstractUnitOfWork(ABC):
         raise NotImplementedError
 
 
-DEFAULT_SESSION_FACTORY = sessionmaker(
-    bind=create_engine(
-        config.get_sqlite_file_url(),
-        isolation_level="SERIALIZABLE",
-    )
-)
+# pragmas set on every new SQLite connection, in this order
+SQLITE_PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size", "busy_timeout")
+
+
+def create_profiled_engine(url: str = None, profile: dict = None):
+    """
+    Builds an engine with the pool sizes and SQLite pragmas of a profile from
+    config.DB_PROFILES (the one BARKY_DB_PROFILE names by default)
+    """
+    url = url or config.get_sqlite_file_url()
+    profile = config.get_db_profile() if profile is None else profile
+    kwargs = dict(isolation_level="SERIALIZABLE")
+    # in-memory sqlite uses a single connection pool that has no overflow
+    if make_url(url).database not in (None, "", ":memory:"):
+        kwargs.update(pool_size=profile["pool_size"], max_overflow=profile["max_overflow"])
+    engine = create_engine(url, **kwargs)
+    set_sqlite_pragmas(engine, profile)
+    if config.get_metrics_enabled():
+        metrics.instrument_engine(engine)
+    return engine
+
+
+def create_profiled_async_engine(url: str = None, profile: dict = None):
+    """
+    create_profiled_engine for the asyncio stack, on aiosqlite by default
+    """
+    # imported here so the sync API doesn't load asyncio
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+    url = url or config.get_sqlite_async_url()
+    profile = config.get_db_profile() if profile is None else profile
+    kwargs = dict()
+    # aiosqlite would open (and start a thread for) a new connection every
+    # session on a file database, so file databases get a real pool
+    if make_url(url).database not in (None, "", ":memory:"):
+        kwargs.update(
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=profile["pool_size"],
+            max_overflow=profile["max_overflow"],
+        )
+    engine = create_async_engine(url, **kwargs)
+    set_sqlite_pragmas(engine.sync_engine, profile)
+    if config.get_metrics_enabled():
+        metrics.instrument_engine(engine.sync_engine)
+    return engine
+
+
+def set_sqlite_pragmas(engine, profile: dict) -> None:
+    pragmas = [
+        f"PRAGMA {name} = {profile[name]}"
+        for name in SQLITE_PRAGMAS
+        if profile.get(name) is not None
+    ]
+    if pragmas and engine.dialect.name == "sqlite":
+
+        @event.listens_for(engine, "connect")
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+
+_session_factory = None
+
+
+def default_session_factory() -> sessionmaker:
+    """
+    Built on first use, importing this module doesn't create an engine
+    """
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = sessionmaker(bind=create_profiled_engine())
+    return _session_factory
 
 
 class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
-    def __init__(self, session_factory=DEFAULT_SESSION_FACTORY):
+    def __init__(
+        self,
+        session_factory=None,
+        cache: BookmarkCache = None,
+        query_log: dict = None,
+        outbox: bool = None,
+    ):
+        # None means default_session_factory(), looked up when the unit of work is entered
         self.session_factory = session_factory
-        mapper_registry.metadata.create_all(self.session_factory().get_bind())
+        # the cache is shared between units of work, so reads can skip the database
+        self.cache = cache
+        # StatementRecorder settings, config.get_query_log_settings() when None
+        self.query_log = query_log
+        self.recorder = None
+        # whether writes put their events in the outbox, config.get_outbox_settings() when None
+        self.outbox = outbox
 
     def __enter__(self):
+        if self.session_factory is None:
+            self.session_factory = default_session_factory()
         self.session = self.session_factory()  # type: Session
+        # only does any work the first time an engine is used
+        orm.ensure_schema(self.session.get_bind())
+        if self.outbox if self.outbox is not None else config.get_outbox_settings()["enabled"]:
+            outbox.start(self.session)
         self.bookmarks = repository.SqlAlchemyRepository(self.session)
+        if self.cache is not None:
+            self.bookmarks = repository.CachingRepository(self.bookmarks, self.cache)
+        self.start_recording()
 
         return super().__enter__()
 
     def __exit__(self, *args):
         super().__exit__(*args)
         self.session.close()
+        if self.recorder is not None:
+            query_log.stop(self._recording)
+            # an error on the way out is the one to report
+            if args[0] is None:
+                self.recorder.check()
+
+    def start_recording(self):
+        settings = self.query_log if self.query_log is not None else config.get_query_log_settings()
+        if not settings.get("enabled", True):
+            self.recorder = None
+            return
+        query_log.instrument_engine(self.session.get_bind())
+        self.recorder = query_log.StatementRecorder(
+            slow_ms=settings.get("slow_ms"),
+            repeat_limit=settings.get("repeat_limit", query_log.DEFAULT_REPEAT_LIMIT),
+            strict=settings.get("strict", False),
+        )
+        self._recording = query_log.start(self.recorder)
 
     def _commit(self):
         self.session.commit()
 
     def rollback(self):
         self.session.rollback()
+
+
+class InMemoryUnitOfWork(AbstractUnitOfWork):
+    """
+    Unit of work over bookmarks kept in memory (adapters/memory.py), for
+    tests and small deployments. The table outlives the unit of work, each
+    one gets its own repository on it. Repository writes apply straight
+    away, so there is nothing to commit or roll back.
+    """
+
+    def __init__(self, table: BookmarkTable = None, cache: BookmarkCache = None):
+        self.table = BookmarkTable() if table is None else table
+        self.cache = cache
+        self.committed = False
+
+    def __enter__(self):
+        self.bookmarks = InMemoryRepository(self.table)
+        if self.cache is not None:
+            self.bookmarks = repository.CachingRepository(self.bookmarks, self.cache)
+        return super().__enter__()
+
+    def _commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+
+class WriteBehindUnitOfWork(AbstractUnitOfWork):
+    """
+    Unit of work whose adds go to a WriteBehindWriter (services/write_behind.py)
+    and are acknowledged once they're journaled. Everything else goes to uow,
+    a SqlAlchemyUnitOfWork by default, which is only entered when something
+    needs it.
+    """
+
+    def __init__(self, writer: WriteBehindWriter, uow: AbstractUnitOfWork = None):
+        self.writer = writer
+        self.uow = SqlAlchemyUnitOfWork() if uow is None else uow
+        self._entered = False
+
+    def __enter__(self):
+        self.bookmarks = WriteBehindRepository(self.writer, self._repository)
+        return super().__enter__()
+
+    def __exit__(self, *args):
+        super().__exit__(*args)
+        if self._entered:
+            self._entered = False
+            self.uow.__exit__(*args)
+
+    def _repository(self) -> repository.AbstractRepository:
+        if not self._entered:
+            self.uow.__enter__()
+            self._entered = True
+        return self.uow.bookmarks
+
+    def _commit(self):
+        # adds were committed to the journal as they came in
+        if self._entered:
+            self.uow.commit()
+
+    def rollback(self):
+        if self._entered:
+            self.uow.rollback()
+
+
+_async_session_factory = None
+
+
+def default_async_session_factory() -> async_sessionmaker:
+    """
+    Built on first use so the async driver is only needed by the asyncio stack
+    """
+    global _async_session_factory
+    if _async_session_factory is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        # attributes stay loaded after commit, lazy loads can't happen outside an await
+        _async_session_factory = async_sessionmaker(create_profiled_async_engine(), expire_on_commit=False)
+    return _async_session_factory
+
+
+class AsyncSqlAlchemyUnitOfWork:
+    """
+    SqlAlchemyUnitOfWork for the asyncio stack, used with async with
+    """
+
+    def __init__(self, session_factory: async_sessionmaker = None, outbox: bool = None):
+        self.session_factory = session_factory
+        self.outbox = outbox
+
+    async def __aenter__(self) -> AsyncSqlAlchemyUnitOfWork:
+        if self.session_factory is None:
+            self.session_factory = default_async_session_factory()
+        self.session = self.session_factory()
+        await orm.ensure_schema_async(self.session.bind)
+        if self.outbox if self.outbox is not None else config.get_outbox_settings()["enabled"]:
+            outbox.start(self.session.sync_session)
+        self.bookmarks = repository.AsyncSqlAlchemyRepository(self.session)
+        return self
+
+    async def __aexit__(self, *args):
+        await self.rollback()
+        await self.session.close()
+
+    async def commit(self):
+        await self.session.commit()
+
+    async def rollback(self):
+        await self.session.rollback()
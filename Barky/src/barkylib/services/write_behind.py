@@ -0,0 +1,385 @@
+"""
+Write-behind ingestion: adds are acknowledged once they are in a journal
+(adapters/journal.py) and written to the bookmarks table in batches.
+
+A single add through SqlAlchemyUnitOfWork is a transaction, and SQLite can
+only commit so many of those a second. WriteBehindWriter takes rows into a
+buffer backed by the journal, and a flusher thread writes the buffer out
+as one transaction whenever it reaches max_rows or its oldest row has
+waited max_delay_ms, whichever comes first.
+
+- the rows go in with upsert_many and ON CONFLICT DO NOTHING on the title:
+  writing a batch twice (after a crash between the commit and removing its
+  journal segment) changes nothing, and a title that is already taken is
+  skipped and counted instead of failing the whole batch
+- add() checks and normalises rows like importers.to_row, so a row the
+  table would refuse (no url, a date as text) is refused there and then
+- start() replays the segments a previous process left behind before
+  taking new rows
+- a batch that fails because of the database (it can't be opened, or
+  raises OperationalError) is kept, with its segment, and retried on the
+  next flush. One that fails for any other reason has a bad row in it: it
+  is split in halves that are written on their own, down to single rows,
+  and the rows that still fail go to the journal's dead letter file
+- adds block while max_buffer rows are waiting, so a database that is down
+  doesn't turn into unbounded memory
+- stats() has the buffer depth and flush latency, which /api/metrics shows
+
+Rows added here show up in reads once their batch is written, and get
+their ids then; callers don't get an id back.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from barkylib.adapters import importers, metrics
+from barkylib.adapters.journal import Journal
+from barkylib.adapters.repository import ROW_COLUMNS, AbstractRepository
+from barkylib.domain.models import Bookmark
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = metrics.REGISTRY.histogram(
+    "barky_write_behind_flush_seconds", "Time to write one write-behind batch to the database"
+)
+FLUSH_ROWS = metrics.REGISTRY.histogram(
+    "barky_write_behind_flush_rows",
+    "Rows in one write-behind batch",
+    buckets=(1, 10, 100, 500, 1000, 5000, 10000, 50000),
+)
+# errors that are the database's, not the rows', a batch that raises them is retried as it is
+RETRIED = (OperationalError, InterfaceError)
+
+
+class WriteBehindWriter:
+    def __init__(
+        self,
+        uow_factory,
+        directory: str,
+        max_rows: int = 1000,
+        max_delay_ms: float = 50,
+        max_buffer: int = 100_000,
+        fsync: bool = False,
+        flush_timeout_ms: float = 10_000,
+    ) -> None:
+        """
+        uow_factory() returns a new unit of work for each batch, e.g. a
+        SqlAlchemyUnitOfWork on the database the rows go to.
+        flush_timeout_ms is how long WriteBehindRepository waits for the
+        buffer before an update or delete.
+        """
+        self.uow_factory = uow_factory
+        self.journal = Journal(directory, fsync=fsync)
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self.max_buffer = max_buffer
+        self.flush_timeout = flush_timeout_ms / 1000
+
+        self._condition = threading.Condition()
+        self._buffer = list()
+        # when the oldest buffered row came in
+        self._oldest = None
+        # (segment, rows) sealed but not written yet, oldest first
+        self._sealed = list()
+        self._thread = None
+        self.closed = False
+
+        self.added = 0
+        self.replayed = 0
+        self.written = 0
+        self.skipped = 0
+        self.dead_lettered = 0
+        self.flushes = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.last_flush_seconds = 0.0
+
+    def start(self) -> "WriteBehindWriter":
+        """
+        Writes out what a previous process left in the journal, then starts
+        the flusher thread
+        """
+        for segment in self.journal.segments():
+            if segment < self.journal.number:
+                rows = list(self.journal.read(segment))
+                logger.info("replaying %s rows from journal segment %s", len(rows), segment)
+                self._sealed.append((segment, rows))
+                self.replayed += len(rows)
+        if self._sealed:
+            self._write_sealed()
+            if self._sealed:
+                raise RuntimeError("Couldn't replay the write-behind journal, see the log")
+
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        # rows still buffered at exit are written, or replayed on the next start
+        atexit.register(self.close)
+        return self
+
+    @property
+    def depth(self) -> int:
+        """
+        Rows acknowledged but not in the database yet
+        """
+        return len(self._buffer) + sum(len(rows) for _, rows in self._sealed)
+
+    def add(self, rows: list[dict]) -> None:
+        """
+        Journals the rows (dicts of add_rows columns) and buffers them for
+        the next batch. Raises ValueError for a row the table would refuse.
+        """
+        now = datetime.now()
+        rows = [importers.to_row(row, now) for row in rows]
+        with self._condition:
+            if self.closed:
+                raise RuntimeError("The write-behind writer has been closed")
+            while self.depth >= self.max_buffer and not self.closed:
+                self._condition.wait()
+            self.journal.append(rows)
+            first = not self._buffer
+            if first:
+                self._oldest = time.monotonic()
+            self._buffer += rows
+            self.added += len(rows)
+            self.max_depth = max(self.max_depth, self.depth)
+            # the flusher sleeps until the first row comes in, then until it's due
+            if first or len(self._buffer) >= self.max_rows:
+                self._condition.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every row added so far is in the database. Returns False
+        if that didn't happen within timeout seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            target = self.replayed + self.added
+            if self._buffer:
+                # due now
+                self._oldest = float("-inf")
+                self._condition.notify_all()
+            while self.written + self.skipped + self.dead_lettered < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout: Optional[float] = 10) -> None:
+        """
+        Stops taking rows and writes out the buffer
+        """
+        with self._condition:
+            if self.closed:
+                return
+            self.closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.journal.close()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return dict(
+                depth=self.depth,
+                max_depth=self.max_depth,
+                added=self.added,
+                replayed=self.replayed,
+                written=self.written,
+                skipped=self.skipped,
+                dead_lettered=self.dead_lettered,
+                flushes=self.flushes,
+                errors=self.errors,
+                last_flush_seconds=self.last_flush_seconds,
+            )
+
+    def _due(self) -> Optional[float]:
+        """
+        Seconds until the buffer should be flushed, 0 for now, None when it's empty
+        """
+        if self._sealed:
+            return 0
+        if not self._buffer:
+            return None
+        if len(self._buffer) >= self.max_rows or self.closed:
+            return 0
+        return max(0.0, self._oldest + self.max_delay - time.monotonic())
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                due = self._due()
+                while due != 0 and not (self.closed and due is None):
+                    self._condition.wait(due)
+                    due = self._due()
+                if due is None:
+                    # closed, and nothing is left
+                    return
+                segment = self.journal.seal()
+                if segment is not None:
+                    self._sealed.append((segment, self._buffer))
+                self._buffer = list()
+                self._oldest = None
+            if not self._write_sealed() and self.closed:
+                # the journal has the rows for the next start
+                return
+
+    def _write_sealed(self) -> bool:
+        """
+        Writes the sealed batches in order, stopping at the first failure.
+        Returns whether they were all written.
+        """
+        while self._sealed:
+            with self._condition:
+                segment, rows = self._sealed[0]
+            started = time.perf_counter()
+            try:
+                counts = self._write(rows)
+            except Exception:
+                logger.exception("Couldn't write %s buffered bookmarks, will retry", len(rows))
+                with self._condition:
+                    self.errors += 1
+                if not self.closed:
+                    # back off for a bit instead of spinning on a broken database
+                    time.sleep(self.max_delay)
+                return False
+
+            elapsed = time.perf_counter() - started
+            self.journal.remove(segment)
+            FLUSH_SECONDS.observe(elapsed)
+            FLUSH_ROWS.observe(len(rows))
+            with self._condition:
+                self._sealed.pop(0)
+                self.written += counts['inserted']
+                self.skipped += counts['unchanged'] + counts['updated']
+                self.dead_lettered += counts['dead_lettered']
+                self.flushes += 1
+                self.last_flush_seconds = elapsed
+                self._condition.notify_all()
+            if counts['unchanged']:
+                logger.warning("%s buffered bookmarks had a title that was taken", counts['unchanged'])
+        return True
+
+    def _write(self, rows: list[dict]) -> dict:
+        """
+        Writes the rows in one transaction, or in halves when a row is bad,
+        and returns upsert_many's counts and how many rows were dead lettered.
+        Raises when the database is the problem.
+        """
+        # a unit of work that can't be made is the database's problem too
+        uow = self.uow_factory()
+        try:
+            with uow:
+                return dict(uow.bookmarks.upsert_many(rows, update_columns=()), dead_lettered=0)
+        except RETRIED:
+            raise
+        except Exception as error:
+            if len(rows) == 1:
+                logger.error("Couldn't write buffered bookmark %s, dead lettered: %s", rows[0].get('title'), error)
+                self.journal.dead_letter(rows[0], error)
+                return dict(inserted=0, updated=0, unchanged=0, dead_lettered=1)
+            logger.warning("Couldn't write %s buffered bookmarks, splitting them: %s", len(rows), error)
+
+        half = len(rows) // 2
+        first, second = self._write(rows[:half]), self._write(rows[half:])
+        return {key: first[key] + second[key] for key in first}
+
+
+class WriteBehindRepository(AbstractRepository):
+    """
+    Sends adds to a WriteBehindWriter and everything else to the repository
+    of a regular unit of work, opened the first time it's needed. Writes
+    other than adds flush the buffer first, so they see the rows added
+    before them.
+    """
+
+    def __init__(self, writer: WriteBehindWriter, open_repository) -> None:
+        super().__init__()
+        self.writer = writer
+        self.open_repository = open_repository
+
+    @property
+    def repository(self) -> AbstractRepository:
+        return self.open_repository()
+
+    def flush(self) -> None:
+        if not self.writer.flush(self.writer.flush_timeout):
+            raise TimeoutError(f"{self.writer.depth} buffered bookmarks weren't written in time")
+
+    def add_one(self, bookmark: Bookmark, bulk: bool = False) -> None:
+        if bookmark:
+            self.add_many([bookmark])
+
+    def add_many(self, bookmarks: list[Bookmark], bulk: bool = False, **kwargs) -> list:
+        """
+        The ids aren't known until the rows are written, so they come back as None
+        """
+        self.writer.add([{column: getattr(bookmark, column) for column in ROW_COLUMNS} for bookmark in bookmarks])
+        return [None] * len(bookmarks)
+
+    def add_rows(self, rows: list[dict], chunk_size: Optional[int] = None) -> int:
+        self.writer.add([{column: row.get(column) for column in ROW_COLUMNS} for row in rows])
+        return len(rows)
+
+    def add_new_rows(self, rows: list[dict], chunk_size: Optional[int] = None) -> list[bool]:
+        """
+        Written straight away, which rows are new is only known then
+        """
+        self.flush()
+        return self.repository.add_new_rows(rows, chunk_size=chunk_size)
+
+    def upsert_many(self, rows: list[dict], update_columns=None, chunk_size=None) -> dict:
+        self.flush()
+        return self.repository.upsert_many(rows, update_columns=update_columns, chunk_size=chunk_size)
+
+    def delete_one(self, bookmark: Bookmark) -> None:
+        self.flush()
+        self.repository.delete_one(bookmark)
+
+    def delete_many(self, bookmarks: list[Bookmark]) -> None:
+        self.flush()
+        self.repository.delete_many(bookmarks)
+
+    def delete_by_ids(self, ids: Iterable) -> int:
+        self.flush()
+        return self.repository.delete_by_ids(ids)
+
+    def get(self, id: int) -> Bookmark:
+        return self.repository.get(id)
+
+    def get_dict(self, id: int) -> Optional[dict]:
+        return self.repository.get_dict(id)
+
+    def update(self, bookmark) -> int:
+        self.flush()
+        return self.repository.update(bookmark)
+
+    def update_many(self, bookmarks: list[Bookmark]) -> list[int]:
+        self.flush()
+        return self.repository.update_many(bookmarks)
+
+    def find_first(self, query) -> Bookmark:
+        return self.repository.find_first(query)
+
+    def find_all(self, query) -> list[Bookmark]:
+        return self.repository.find_all(query)
+
+    def find_page(self, query, after=None, limit=None, sort='id'):
+        return self.repository.find_page(query, after=after, limit=limit, sort=sort)
+
+    def stream_all(self, query, batch_size=None) -> Iterator[Bookmark]:
+        return self.repository.stream_all(query, batch_size=batch_size)
+
+    def find_rows(self, query) -> list:
+        return self.repository.find_rows(query)
+
+    def stream_rows(self, query, batch_size=None) -> Iterator:
+        return self.repository.stream_rows(query, batch_size=batch_size)
+
+    def search(self, text: str, limit=None, offset: int = 0) -> list[dict]:
+        return self.repository.search(text, limit=limit, offset=offset)
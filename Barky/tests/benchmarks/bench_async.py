@@ -0,0 +1,98 @@
+"""
+Throughput of concurrent reads by id on the two stacks:
+- sync: handlers.list_bookmark on SqlAlchemyUnitOfWork, one thread per
+  in-flight request (capped at --threads), like a threaded WSGI server
+- async: async_handlers.list_bookmark on AsyncSqlAlchemyUnitOfWork, every
+  request a task on one event loop
+
+Run from the Barky folder:
+    PYTHONPATH=src python tests/benchmarks/bench_async.py --requests 5000 --concurrency 1000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from barkylib import config
+from barkylib.adapters.orm import start_mappers
+from barkylib.services import async_handlers, handlers, unit_of_work
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from bench_repository import make_bookmarks
+
+
+def bench_sync(session_factory, ids, threads):
+    def read(id):
+        return handlers.list_bookmark(id=id, uow=unit_of_work.SqlAlchemyUnitOfWork(session_factory))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(read, ids))
+    elapsed = time.perf_counter() - start
+    assert all(isinstance(result, dict) for result in results)
+    return elapsed
+
+
+async def bench_async(session_factory, ids, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def read(id):
+        async with semaphore:
+            return await async_handlers.list_bookmark(
+                id=id, uow=unit_of_work.AsyncSqlAlchemyUnitOfWork(session_factory)
+            )
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(read(id) for id in ids))
+    elapsed = time.perf_counter() - start
+    assert all(isinstance(result, dict) for result in results)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--profile", default="wal", choices=list(config.DB_PROFILES))
+    args = parser.parse_args()
+
+    start_mappers()
+    profile = config.get_db_profile(args.profile)
+    rng = random.Random(42)
+    ids = [rng.randint(1, args.rows) for _ in range(args.requests)]
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "bench.db")
+        engine = unit_of_work.create_profiled_engine(f"sqlite:///{path}", profile)
+        session_factory = sessionmaker(bind=engine)
+        handlers.add_bookmark(
+            uow=unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+            bookmarks=make_bookmarks(args.rows),
+            bulk=True,
+        )
+
+        async_engine = unit_of_work.create_profiled_async_engine(f"sqlite+aiosqlite:///{path}", profile)
+        async_session_factory = async_sessionmaker(async_engine, expire_on_commit=False)
+
+        async def run_async():
+            try:
+                return await bench_async(async_session_factory, ids, args.concurrency)
+            finally:
+                await async_engine.dispose()
+
+        print(f"{'stack':>6} {'in flight':>10} {'requests/s':>11}")
+        elapsed = bench_sync(session_factory, ids, min(args.threads, args.concurrency))
+        print(f"{'sync':>6} {min(args.threads, args.concurrency):>10} {args.requests / elapsed:>11.0f}")
+        elapsed = asyncio.run(run_async())
+        print(f"{'async':>6} {args.concurrency:>10} {args.requests / elapsed:>11.0f}")
+
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
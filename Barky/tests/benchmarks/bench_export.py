@@ -0,0 +1,69 @@
+"""
+Throughput and peak Python memory of handlers.export_bookmarks writing every
+format, plain and gzipped, from a SQLite database of --rows bookmarks to disk.
+Peak memory (tracemalloc) should stay flat as --rows grows.
+
+Run from the Barky folder:
+    PYTHONPATH=src python tests/benchmarks/bench_export.py --rows 1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from barkylib import config
+from barkylib.adapters import exporters
+from barkylib.adapters.orm import start_mappers
+from barkylib.services import handlers, unit_of_work
+from sqlalchemy.orm import sessionmaker
+
+
+def load(uow, rows):
+    now = datetime.now()
+    with uow:
+        for start in range(0, rows, 100_000):
+            uow.bookmarks.add_rows([
+                {"title": f"bookmark {i}", "url": f"http://test{i}.com", "notes": f"test {i}",
+                 "date_added": now, "date_edited": now}
+                for i in range(start, min(rows, start + 100_000))
+            ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--formats", nargs="+", default=list(exporters.FORMATS))
+    parser.add_argument("--profile", default="fast", choices=list(config.DB_PROFILES))
+    args = parser.parse_args()
+
+    start_mappers()
+    with tempfile.TemporaryDirectory() as folder:
+        engine = unit_of_work.create_profiled_engine(
+            f"sqlite:///{os.path.join(folder, 'bench.db')}", config.get_db_profile(args.profile)
+        )
+        uow = unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine))
+        load(uow, args.rows)
+
+        print(f"{'format':>9} {'gzip':>5} {'size (MB)':>10} {'total (s)':>10} {'rows/s':>9} {'peak (MB)':>10}")
+        for format in args.formats:
+            for compress in (False, True):
+                path = os.path.join(folder, "export")
+                tracemalloc.start()
+                start = time.perf_counter()
+                with open(path, "wb") as out:
+                    for chunk in handlers.export_bookmarks(format, uow=uow, compress=compress):
+                        out.write(chunk)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1] / 1e6
+                tracemalloc.stop()
+
+                size = os.path.getsize(path) / 1e6
+                print(f"{format:>9} {str(compress):>5} {size:>10.1f} {elapsed:>10.2f} "
+                      f"{args.rows / elapsed:>9.0f} {peak:>10.1f}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
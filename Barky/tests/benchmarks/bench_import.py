@@ -0,0 +1,81 @@
+"""
+Throughput of handlers.import_bookmarks reading NDJSON, CSV and bookmark HTML
+files from disk into a fresh SQLite database (with the search index triggers).
+With --upsert the same file then goes through handlers.upsert_bookmarks,
+which finds every title already there and nothing to change (a re-sync).
+
+Run from the Barky folder:
+    PYTHONPATH=src python tests/benchmarks/bench_import.py --rows 500000
+"""
+import argparse
+import csv
+import json
+import os
+import tempfile
+import time
+
+from barkylib import config
+from barkylib.adapters import importers
+from barkylib.adapters.orm import start_mappers
+from barkylib.services import handlers, unit_of_work
+from sqlalchemy.orm import sessionmaker
+
+
+def write_file(path, format, rows):
+    with open(path, "w", newline="") as out:
+        if format == "ndjson":
+            for i in range(rows):
+                out.write(json.dumps({"title": f"bookmark {i}", "url": f"http://test{i}.com", "notes": f"test {i}"}))
+                out.write("\n")
+        elif format == "csv":
+            writer = csv.writer(out)
+            writer.writerow(["title", "url", "notes"])
+            for i in range(rows):
+                writer.writerow([f"bookmark {i}", f"http://test{i}.com", f"test {i}"])
+        else:
+            out.write("<!DOCTYPE NETSCAPE-Bookmark-file-1>\n<DL><p>\n")
+            for i in range(rows):
+                out.write(f'<DT><A HREF="http://test{i}.com" ADD_DATE="1691800000">bookmark {i}</A>\n<DD>test {i}\n')
+            out.write("</DL><p>\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--formats", nargs="+", default=list(importers.FORMATS))
+    parser.add_argument("--profile", default="fast", choices=list(config.DB_PROFILES))
+    parser.add_argument("--upsert", action="store_true", help="time a re-sync of the file after importing it")
+    args = parser.parse_args()
+
+    start_mappers()
+    print(f"{'format':>7} {'size (MB)':>10} {'total (s)':>10} {'rows/s':>9}")
+    for format in args.formats:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, f"bookmarks.{format}")
+            write_file(path, format, args.rows)
+            engine = unit_of_work.create_profiled_engine(
+                f"sqlite:///{os.path.join(folder, 'bench.db')}", config.get_db_profile(args.profile)
+            )
+            uow = unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine))
+
+            start = time.perf_counter()
+            with open(path, "rb") as stream:
+                report = handlers.import_bookmarks(importers.read_records(stream, format), uow=uow)
+            elapsed = time.perf_counter() - start
+            assert report["imported"] == args.rows, report
+
+            size = os.path.getsize(path) / 1e6
+            print(f"{format:>7} {size:>10.1f} {elapsed:>10.2f} {args.rows / elapsed:>9.0f}")
+
+            if args.upsert:
+                start = time.perf_counter()
+                with open(path, "rb") as stream:
+                    report = handlers.upsert_bookmarks(importers.read_records(stream, format), uow=uow)
+                elapsed = time.perf_counter() - start
+                assert report["unchanged"] == args.rows, report
+                print(f"{'upsert':>7} {size:>10.1f} {elapsed:>10.2f} {args.rows / elapsed:>9.0f}")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
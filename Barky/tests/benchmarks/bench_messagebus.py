@@ -0,0 +1,62 @@
+"""
+Ingesting AddBookmarkCommands through the message bus:
+- handle: one call per command, every command is its own unit of work and commit
+- handle_many: the whole run goes to the batch handler, one unit of work and commit
+
+Run from the Barky folder:
+    PYTHONPATH=src python tests/benchmarks/bench_messagebus.py --commands 10000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from barkylib import bootstrap
+from barkylib.domain import commands
+from barkylib.services import unit_of_work
+from sqlalchemy.orm import sessionmaker
+
+
+def make_commands(count):
+    return [
+        commands.AddBookmarkCommand(
+            id=None,
+            title=f"bookmark {i}",
+            url=f"http://test{i}.com",
+            date_added="2023-08-12T00:00:00",
+            date_edited="2023-08-12T00:00:00",
+        )
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--commands", type=int, default=10_000)
+    args = parser.parse_args()
+
+    start_orm = True
+    print(f"{'dispatch':>12} {'total (s)':>10} {'commands/s':>11}")
+    for name in ("handle", "handle_many"):
+        with tempfile.TemporaryDirectory() as folder:
+            engine = unit_of_work.create_profiled_engine(f"sqlite:///{os.path.join(folder, 'bench.db')}")
+            bus = bootstrap.bootstrap(
+                start_orm=start_orm, uow=unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=engine))
+            )
+            start_orm = False
+            messages = make_commands(args.commands)
+
+            start = time.perf_counter()
+            if name == "handle":
+                for message in messages:
+                    bus.handle(message)
+            else:
+                bus.handle_many(messages)
+            elapsed = time.perf_counter() - start
+
+            print(f"{name:>12} {elapsed:>10.3f} {args.commands / elapsed:>11.0f}")
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
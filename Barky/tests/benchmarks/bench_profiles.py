@@ -0,0 +1,120 @@
+"""
+Load test of the database profiles in config.DB_PROFILES: writer threads add one
+bookmark per transaction while reader threads fetch bookmarks by id.
+
+Run from the Barky folder:
+    PYTHONPATH=src python tests/benchmarks/bench_profiles.py --writers 4 --readers 8 --seconds 10
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from barkylib import config
+from barkylib.adapters import orm
+from barkylib.adapters.orm import start_mappers
+from barkylib.adapters.repository import SqlAlchemyRepository
+from barkylib.domain.models import Bookmark
+from barkylib.services import unit_of_work
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+
+class Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.reads = 0
+        self.locked = 0
+
+    def add(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+def writer(session_factory, counters, deadline, number):
+    count = 0
+    while time.perf_counter() < deadline:
+        session = session_factory()
+        now = datetime.now()
+        try:
+            SqlAlchemyRepository(session).add_one(
+                Bookmark(None, f"writer {number} {count}", "http://load.com", None, now, now)
+            )
+            counters.add("writes")
+        except OperationalError:
+            session.rollback()
+            counters.add("locked")
+        finally:
+            session.close()
+        count += 1
+
+
+def reader(session_factory, counters, deadline, max_id):
+    rng = random.Random()
+    while time.perf_counter() < deadline:
+        session = session_factory()
+        try:
+            SqlAlchemyRepository(session).get_dict(rng.randint(1, max_id))
+            counters.add("reads")
+        except OperationalError:
+            session.rollback()
+            counters.add("locked")
+        finally:
+            session.close()
+
+
+def run_profile(name, args):
+    with tempfile.TemporaryDirectory() as folder:
+        engine = unit_of_work.create_profiled_engine(
+            f"sqlite:///{os.path.join(folder, 'load.db')}", config.get_db_profile(name)
+        )
+        orm.ensure_schema(engine)
+        session_factory = sessionmaker(bind=engine)
+        now = datetime.now()
+        SqlAlchemyRepository(session_factory()).add_many(
+            [Bookmark(None, f"seed {i}", "http://seed.com", None, now, now) for i in range(1000)],
+            bulk=True,
+        )
+
+        counters = Counters()
+        deadline = time.perf_counter() + args.seconds
+        threads = [
+            threading.Thread(target=writer, args=(session_factory, counters, deadline, i))
+            for i in range(args.writers)
+        ] + [
+            threading.Thread(target=reader, args=(session_factory, counters, deadline, 1000))
+            for _ in range(args.readers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        engine.dispose()
+        return counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--profiles", nargs="+", default=list(config.DB_PROFILES))
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    start_mappers()
+    print(f"{'profile':>8} {'writes/s':>9} {'reads/s':>9} {'locked':>7}")
+    for name in args.profiles:
+        counters = run_profile(name, args)
+        print(
+            f"{name:>8} {counters.writes / args.seconds:>9.0f} "
+            f"{counters.reads / args.seconds:>9.0f} {counters.locked:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmarks for the write paths of SqlAlchemyRepository:
+- add: the ORM path against the bulk (Core executemany) path of add_many
+- update: one UPDATE and commit per row against the batched update_many
+
+Run from the Barky folder:
+    PYTHONPATH=src python tests/benchmarks/bench_repository.py add --sizes 10000 100000 1000000
+    PYTHONPATH=src python tests/benchmarks/bench_repository.py update --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from barkylib.adapters.orm import mapper_registry, start_mappers
+from barkylib.adapters.repository import SqlAlchemyRepository
+from barkylib.domain.models import Bookmark
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+
+
+def make_bookmarks(count):
+    now = datetime(2023, 8, 12)
+    return [
+        Bookmark(
+            id=None,
+            title=f"bookmark {i}",
+            url=f"http://test{i}.com",
+            notes=f"test {i}",
+            date_added=now,
+            date_edited=now,
+        )
+        for i in range(count)
+    ]
+
+
+def bench_add_many(count, bulk):
+    with tempfile.TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'bench.db')}")
+        mapper_registry.metadata.create_all(engine)
+        repo = SqlAlchemyRepository(sessionmaker(bind=engine)())
+        bookmarks = make_bookmarks(count)
+
+        start = time.perf_counter()
+        ids = repo.add_many(bookmarks, bulk=bulk)
+        elapsed = time.perf_counter() - start
+
+        assert len(ids) == count
+        del repo
+        engine.dispose()
+        return elapsed
+
+
+def bench_update_many(count, batched):
+    with tempfile.TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'bench.db')}")
+        mapper_registry.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        repo = SqlAlchemyRepository(session)
+        ids = repo.add_many(make_bookmarks(count), bulk=True)
+        changes = [
+            Bookmark(id, None, f"http://rewritten{id}.com", "re-tagged", None, None)
+            for id in ids
+        ]
+
+        start = time.perf_counter()
+        if batched:
+            assert sum(repo.update_many(changes)) == count
+        else:
+            # what update_many used to do: one statement and one commit per row
+            for bookmark in changes:
+                values = dict(url=bookmark.url, notes=bookmark.notes, date_edited=datetime.now())
+                session.execute(update(Bookmark).where(Bookmark.id == bookmark.id).values(values))
+                session.commit()
+        elapsed = time.perf_counter() - start
+
+        del repo
+        session.close()
+        engine.dispose()
+        return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("operation", choices=["add", "update"])
+    parser.add_argument("--sizes", type=int, nargs="+")
+    args = parser.parse_args()
+
+    start_mappers()
+    if args.operation == "add":
+        sizes = args.sizes or [10_000, 100_000, 1_000_000]
+        labels, bench = ("orm", "bulk"), bench_add_many
+    else:
+        sizes = args.sizes or [1_000, 10_000, 100_000]
+        labels, bench = ("per row", "batched"), bench_update_many
+
+    print(f"{'rows':>10} {labels[0] + ' (s)':>12} {labels[1] + ' (s)':>12} {'speedup':>8}")
+    for count in sizes:
+        old_time = bench(count, False)
+        new_time = bench(count, True)
+        print(f"{count:>10} {old_time:>12.3f} {new_time:>12.3f} {old_time / new_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
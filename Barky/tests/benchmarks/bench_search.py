@@ -0,0 +1,72 @@
+"""
+Latency of SqlAlchemyRepository.search (SQLite FTS5, BM25 ranking) for top-k queries.
+
+Run from the Barky folder:
+    PYTHONPATH=src python tests/benchmarks/bench_search.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from barkylib.adapters.orm import mapper_registry, start_mappers
+from barkylib.adapters.repository import SqlAlchemyRepository
+from barkylib.domain.models import Bookmark
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+WORDS = [f"word{i}" for i in range(5000)]
+QUERIES = ["word1", "word42 word7", "word49", "word123 word4", "word4999", "word49*"]
+
+
+def make_bookmarks(count, rng):
+    now = datetime(2023, 8, 12)
+    for i in range(count):
+        yield Bookmark(
+            id=None,
+            title=f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i}",
+            url=f"http://{rng.choice(WORDS)}.com/{i}",
+            notes=" ".join(rng.choices(WORDS, k=8)),
+            date_added=now,
+            date_edited=now,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    start_mappers()
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'bench.db')}")
+        mapper_registry.metadata.create_all(engine)
+        repo = SqlAlchemyRepository(sessionmaker(bind=engine)())
+
+        start = time.perf_counter()
+        bookmarks = list(make_bookmarks(args.rows, rng))
+        repo.add_many(bookmarks, bulk=True)
+        del bookmarks
+        print(f"loaded and indexed {args.rows} rows in {time.perf_counter() - start:.1f}s")
+
+        print(f"{'query':>16} {'hits':>5} {'median (ms)':>12} {'max (ms)':>9}")
+        for query in QUERIES:
+            timings = list()
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                results = repo.search(query, limit=args.limit)
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f"{query:>16} {len(results):>5} {statistics.median(timings):>12.2f} {max(timings):>9.2f}")
+
+        del repo
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
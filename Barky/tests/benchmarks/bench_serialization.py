@@ -0,0 +1,67 @@
+"""
+Per-row cost of listing bookmarks as JSON:
+- orm: find_all, then json.loads(bookmark.to_json()) per row and json.dumps of the list
+  (what handlers.list_all_bookmarks and Flask used to do)
+- rows: find_rows straight into serializers.rows_to_json
+
+Run from the Barky folder:
+    PYTHONPATH=src python tests/benchmarks/bench_serialization.py --rows 100000
+"""
+import argparse
+import json
+import time
+
+from barkylib.adapters import serializers
+from barkylib.adapters.orm import mapper_registry, start_mappers
+from barkylib.adapters.repository import SqlAlchemyRepository
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from bench_repository import make_bookmarks
+
+
+def orm_listing(session):
+    repo = SqlAlchemyRepository(session)
+    bookmarks = [json.loads(bookmark.to_json()) for bookmark in repo.find_all(None)]
+    return json.dumps(bookmarks).encode()
+
+
+def rows_listing(session):
+    repo = SqlAlchemyRepository(session)
+    return serializers.rows_to_json(repo.find_rows(None))
+
+
+def bench(listing, session_factory, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        session = session_factory()
+        start = time.perf_counter()
+        body = listing(session)
+        elapsed = time.perf_counter() - start
+        session.close()
+        best = elapsed if best is None else min(best, elapsed)
+    assert len(json.loads(body)) == rows
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    start_mappers()
+    engine = create_engine("sqlite://")
+    mapper_registry.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+    SqlAlchemyRepository(session_factory()).add_many(make_bookmarks(args.rows), bulk=True)
+
+    print(f"json backend: {'orjson' if serializers.orjson else 'json'}")
+    print(f"{'path':>6} {'total (s)':>10} {'per row (us)':>13}")
+    for name, listing in (("orm", orm_listing), ("rows", rows_listing)):
+        elapsed = bench(listing, session_factory, args.rows, args.repeat)
+        print(f"{name:>6} {elapsed:>10.3f} {elapsed / args.rows * 1e6:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Per-request cost of a SqlAlchemyUnitOfWork around handlers.list_bookmark:
+- per request: the schema is created/checked every time a unit of work is built
+  (what SqlAlchemyUnitOfWork.__init__ used to do)
+- once: orm.ensure_schema, which only migrates the first time it sees an engine
+
+Run from the Barky folder:
+    PYTHONPATH=src python tests/benchmarks/bench_unit_of_work.py --requests 2000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from barkylib.adapters import orm
+from barkylib.adapters.orm import start_mappers
+from barkylib.domain.models import Bookmark
+from barkylib.services import handlers, unit_of_work
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+class SchemaPerRequestUnitOfWork(unit_of_work.SqlAlchemyUnitOfWork):
+    def __init__(self, session_factory):
+        super().__init__(session_factory)
+        bind = self.session_factory().get_bind()
+        orm.mapper_registry.metadata.create_all(bind)
+        orm.create_indexes(bind)
+        with bind.begin() as connection:
+            orm.create_search_index(connection)
+
+
+def bench(uow_class, session_factory, id, requests):
+    timings = list()
+    for _ in range(requests):
+        start = time.perf_counter()
+        handlers.list_bookmark(id=id, uow=uow_class(session_factory))
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    start_mappers()
+    with tempfile.TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'bench.db')}")
+        session_factory = sessionmaker(bind=engine)
+        now = datetime(2023, 8, 12)
+        id = handlers.add_bookmark(
+            uow=unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+            bookmark=Bookmark(None, "bench", "http://bench.com", None, now, now),
+        )
+
+        print(f"{'schema':>12} {'median (us)':>12} {'p99 (us)':>10}")
+        for name, uow_class in (
+            ("per request", SchemaPerRequestUnitOfWork),
+            ("once", unit_of_work.SqlAlchemyUnitOfWork),
+        ):
+            timings = sorted(bench(uow_class, session_factory, id, args.requests))
+            p99 = timings[int(len(timings) * 0.99) - 1]
+            print(f"{name:>12} {statistics.median(timings) * 1e6:>12.0f} {p99 * 1e6:>10.0f}")
+
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
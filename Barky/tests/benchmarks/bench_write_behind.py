@@ -0,0 +1,84 @@
+"""
+Adds per second through handlers.add_bookmark, one bookmark per call like
+POST /api/add:
+- sync: a SqlAlchemyUnitOfWork, a transaction per add
+- write-behind: a WriteBehindUnitOfWork, journaled and written in batches;
+  the time includes flushing the last batch
+
+Run from the Barky folder:
+    PYTHONPATH=src python tests/benchmarks/bench_write_behind.py --adds 20000
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+
+from barkylib.adapters import orm
+from barkylib.adapters.orm import start_mappers
+from barkylib.domain.models import Bookmark
+from barkylib.services import handlers, unit_of_work
+from barkylib.services.write_behind import WriteBehindWriter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+def bench(make_uow, prefix, adds):
+    now = datetime(2023, 8, 12)
+    start = time.perf_counter()
+    for i in range(adds):
+        handlers.add_bookmark(
+            uow=make_uow(),
+            bookmark=Bookmark(None, f"{prefix} {i}", f"http://{i}.com", None, now, now),
+        )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--adds", type=int, default=20000)
+    parser.add_argument("--sync-adds", type=int, default=2000)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--ms", type=float, default=50)
+    parser.add_argument("--fsync", action="store_true")
+    args = parser.parse_args()
+
+    start_mappers()
+    with tempfile.TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'bench.db')}")
+        orm.mapper_registry.metadata.create_all(engine)
+        session_factory = sessionmaker(bind=engine)
+
+        print(f"{'unit of work':>14} {'adds':>7} {'adds/s':>9}")
+        seconds = bench(lambda: unit_of_work.SqlAlchemyUnitOfWork(session_factory), "sync", args.sync_adds)
+        print(f"{'sync':>14} {args.sync_adds:>7} {args.sync_adds / seconds:>9.0f}")
+
+        writer = WriteBehindWriter(
+            lambda: unit_of_work.SqlAlchemyUnitOfWork(session_factory),
+            os.path.join(folder, "journal"),
+            max_rows=args.rows,
+            max_delay_ms=args.ms,
+            fsync=args.fsync,
+        ).start()
+        start = time.perf_counter()
+        bench(
+            lambda: unit_of_work.WriteBehindUnitOfWork(writer, unit_of_work.SqlAlchemyUnitOfWork(session_factory)),
+            "write-behind",
+            args.adds,
+        )
+        acknowledged = time.perf_counter() - start
+        writer.flush()
+        seconds = time.perf_counter() - start
+        writer.close()
+        print(f"{'write-behind':>14} {args.adds:>7} {args.adds / seconds:>9.0f}")
+        stats = writer.stats()
+        print(
+            f"acknowledged in {acknowledged:.2f}s, {stats['flushes']} flushes, "
+            f"max depth {stats['max_depth']}, last flush {stats['last_flush_seconds'] * 1000:.1f} ms"
+        )
+
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
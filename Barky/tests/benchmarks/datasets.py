@@ -0,0 +1,67 @@
+"""
+Synthetic bookmark data for the benchmarks: the same seed always gives the same
+rows, so results from different runs and machines are measured on the same data.
+
+Titles are unique (the column is), urls spread over a few hundred hosts, notes
+vary in length and some are missing, and the dates cover three years.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from barkylib.adapters import orm
+from barkylib.adapters.repository import SqlAlchemyRepository
+from barkylib.services import unit_of_work
+from sqlalchemy.orm import sessionmaker
+
+# the names --sizes accepts besides plain numbers
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+WORDS = (
+    "python sqlalchemy flask sqlite index query cache async batch stream export import "
+    "search bookmark notes recipe travel music video article paper guide tutorial news "
+    "review design database network cloud linux release security testing profile"
+).split()
+TLDS = ("com", "org", "net", "io", "dev")
+START = datetime(2021, 1, 1)
+# rows written per add_rows call while loading
+LOAD_CHUNK = 50_000
+
+
+def parse_size(value: str) -> int:
+    return SIZES[value.lower()] if value.lower() in SIZES else int(value)
+
+
+def bookmark_rows(count: int, start: int = 0, seed: int = 0) -> Iterator[dict]:
+    """
+    Column dicts for bookmarks start to start + count, as add_rows and
+    upsert_many take them
+    """
+    for i in range(start, start + count):
+        rng = random.Random(seed * 10_000_019 + i)
+        words = rng.sample(WORDS, 3)
+        host = f"{rng.choice(WORDS)}{rng.randrange(300)}.{rng.choice(TLDS)}"
+        date_added = START + timedelta(seconds=rng.randrange(3 * 365 * 24 * 3600))
+        notes = " ".join(rng.choices(WORDS, k=rng.randrange(1, 30))) if rng.random() < 0.9 else None
+        yield {
+            "title": f"{' '.join(words).title()} {i}",
+            "url": f"https://{host}/{words[0]}/{i}",
+            "notes": notes,
+            "date_added": date_added,
+            "date_edited": date_added + timedelta(days=rng.randrange(60)),
+        }
+
+
+def create_database(path: str, count: int, profile: dict = None, seed: int = 0) -> sessionmaker:
+    """
+    A SQLite file at path holding count bookmarks, with the current schema and
+    search index. Returns a session factory for it.
+    """
+    engine = unit_of_work.create_profiled_engine(f"sqlite:///{path}", profile)
+    orm.ensure_schema(engine)
+    session_factory = sessionmaker(bind=engine)
+
+    repository = SqlAlchemyRepository(session_factory())
+    for start in range(0, count, LOAD_CHUNK):
+        repository.add_rows(list(bookmark_rows(min(LOAD_CHUNK, count - start), start=start, seed=seed)))
+    repository.Session.close()
+    return session_factory
@@ -0,0 +1,519 @@
+"""
+Benchmark suite: times the repository, the handlers, the message bus and the
+Flask endpoints (through the test client) on synthetic databases of each size,
+writes the results as JSON and compares two result files.
+
+Run from the Barky folder:
+    PYTHONPATH=src python tests/benchmarks/suite.py run --sizes 1k 100k --output results.json
+    PYTHONPATH=src python tests/benchmarks/suite.py compare baseline.json results.json --threshold 0.2
+
+compare exits with 1 when a benchmark got slower than the baseline by more
+than the threshold (0.2 is 20% more time per operation), so it can gate CI.
+The bench_*.py scripts next to this one are one-off experiments; this is the
+set that is tracked over time.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import datasets
+import sqlalchemy
+from barkylib import bootstrap, config
+from barkylib.adapters.cache import BookmarkCache
+from barkylib.adapters.orm import start_mappers
+from barkylib.adapters.repository import SqlAlchemyRepository
+from barkylib.api import create_app, flaskapi
+from barkylib.domain import commands
+from barkylib.domain.models import Bookmark
+from barkylib.services import handlers, unit_of_work
+from sqlalchemy import select
+
+RESULTS_VERSION = 1
+GROUPS = ("repository", "handlers", "messagebus", "http")
+# operations per timed run of the per-item benchmarks, fewer on small databases
+READS = 1000
+WRITES = 500
+REQUESTS = 200
+
+BENCHMARKS = list()
+
+
+def benchmark(group: str):
+    """
+    Registers a benchmark. It gets a Context, times its work inside
+    ctx.timing() blocks so setup and clean up don't count, and returns how
+    many operations it did.
+    """
+
+    def register(function):
+        BENCHMARKS.append((group, function.__name__, function))
+        return function
+
+    return register
+
+
+class Context:
+    def __init__(self, size: int, session_factory, seed: int = 0) -> None:
+        self.size = size
+        self.session_factory = session_factory
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.elapsed = 0.0
+        self._client = None
+        self._bus = None
+        self._saved_api = None
+
+    @contextmanager
+    def timing(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def ops(self, count: int) -> int:
+        return max(1, min(count, self.size))
+
+    def ids(self, count: int) -> list[int]:
+        return [self.random.randint(1, self.size) for _ in range(self.ops(count))]
+
+    def word(self) -> str:
+        return self.random.choice(datasets.WORDS)
+
+    def uow(self, cache: BookmarkCache = None) -> unit_of_work.SqlAlchemyUnitOfWork:
+        return unit_of_work.SqlAlchemyUnitOfWork(self.session_factory, cache=cache)
+
+    @contextmanager
+    def repository(self):
+        session = self.session_factory()
+        try:
+            yield SqlAlchemyRepository(session)
+        finally:
+            session.close()
+
+    def bus(self):
+        if self._bus is None:
+            self._bus = bootstrap.bootstrap(start_orm=False, uow=self.uow(), dispatch_settings={})
+        return self._bus
+
+    def client(self):
+        if self._client is None:
+            # the blueprint's views belong to flaskapi.fb, pointed at this database until close()
+            self._saved_api = (flaskapi.fb.session_factory, flaskapi.fb.cache, flaskapi.fb.bus)
+            flaskapi.fb.session_factory = self.session_factory
+            flaskapi.fb.cache = BookmarkCache(**config.get_cache_settings())
+            flaskapi.fb.bus = None
+            app = create_app({"TESTING": True})
+            self._client = app.test_client()
+        return self._client
+
+    def close(self) -> None:
+        if self._client is not None:
+            flaskapi.fb.session_factory, flaskapi.fb.cache, flaskapi.fb.bus = self._saved_api
+            self._client = None
+        self.session_factory.kw["bind"].dispose()
+
+    def new_rows(self, count: int) -> list[dict]:
+        # numbered past the dataset, so the titles are new
+        return list(datasets.bookmark_rows(count, start=self.size + 1_000_000, seed=self.random.randrange(1 << 30)))
+
+    def remove_after(self, last_id: int) -> None:
+        """
+        Deletes what a write benchmark added on top of the dataset
+        """
+        with self.repository() as repository:
+            ids = repository.Session.scalars(select(Bookmark.id).where(Bookmark.id > last_id)).all()
+            repository.delete_by_ids(ids)
+
+
+# repository
+
+
+@benchmark("repository")
+def repository_get(ctx):
+    ids = ctx.ids(READS)
+    with ctx.repository() as repository, ctx.timing():
+        for id in ids:
+            repository.get_dict(id)
+    return len(ids)
+
+
+@benchmark("repository")
+def repository_find_rows_all(ctx):
+    with ctx.repository() as repository, ctx.timing():
+        repository.find_rows(select(Bookmark))
+    return 1
+
+
+@benchmark("repository")
+def repository_find_page(ctx):
+    pages = ctx.ops(20)
+    with ctx.repository() as repository, ctx.timing():
+        after = None
+        for _ in range(pages):
+            _, after = repository.find_page(select(Bookmark), after=after, limit=100, sort="title")
+            if after is None:
+                break
+    return pages
+
+
+@benchmark("repository")
+def repository_stream_rows(ctx):
+    with ctx.repository() as repository, ctx.timing():
+        for _ in repository.stream_rows(select(Bookmark)):
+            pass
+    return 1
+
+
+@benchmark("repository")
+def repository_search(ctx):
+    words = [ctx.word() for _ in range(ctx.ops(50))]
+    with ctx.repository() as repository, ctx.timing():
+        for word in words:
+            repository.search(word, limit=20)
+    return len(words)
+
+
+@benchmark("repository")
+def repository_add_rows(ctx):
+    rows = ctx.new_rows(ctx.ops(WRITES * 10))
+    with ctx.timing():
+        with ctx.repository() as repository:
+            repository.add_rows(rows)
+    ctx.remove_after(ctx.size)
+    return len(rows)
+
+
+@benchmark("repository")
+def repository_update_many(ctx):
+    ids = sorted(set(ctx.ids(WRITES)))
+    edits = [Bookmark(id, None, None, f"edited {id}", None, datetime.now()) for id in ids]
+    with ctx.repository() as repository, ctx.timing():
+        repository.update_many(edits)
+    return len(edits)
+
+
+@benchmark("repository")
+def repository_upsert_unchanged(ctx):
+    start = ctx.random.randrange(max(1, ctx.size - ctx.ops(WRITES * 10)))
+    rows = list(datasets.bookmark_rows(ctx.ops(WRITES * 10), start=start, seed=ctx.seed))
+    with ctx.repository() as repository, ctx.timing():
+        repository.upsert_many(rows)
+    return len(rows)
+
+
+@benchmark("repository")
+def repository_delete_by_ids(ctx):
+    rows = ctx.new_rows(ctx.ops(WRITES * 10))
+    with ctx.repository() as repository:
+        repository.add_rows(rows)
+        ids = repository.Session.scalars(select(Bookmark.id).where(Bookmark.id > ctx.size)).all()
+    with ctx.repository() as repository, ctx.timing():
+        repository.delete_by_ids(ids)
+    return len(ids)
+
+
+# handlers
+
+
+@benchmark("handlers")
+def handlers_list_bookmark(ctx):
+    ids = ctx.ids(READS)
+    uow = ctx.uow()
+    with ctx.timing():
+        for id in ids:
+            handlers.list_bookmark(id, uow=uow)
+    return len(ids)
+
+
+@benchmark("handlers")
+def handlers_list_bookmark_cached(ctx):
+    ids = ctx.ids(READS)
+    uow = ctx.uow(cache=BookmarkCache())
+    for id in ids:
+        handlers.list_bookmark(id, uow=uow)
+    with ctx.timing():
+        for id in ids:
+            handlers.list_bookmark(id, uow=uow)
+    return len(ids)
+
+
+@benchmark("handlers")
+def handlers_list_all_json(ctx):
+    with ctx.timing():
+        handlers.list_all_bookmarks_json(None, None, None, uow=ctx.uow())
+    return 1
+
+
+@benchmark("handlers")
+def handlers_list_page(ctx):
+    pages = ctx.ops(20)
+    uow = ctx.uow()
+    with ctx.timing():
+        after = None
+        for _ in range(pages):
+            after = handlers.list_bookmarks_page(None, None, "date_added", after, 100, uow=uow)["next"]
+            if after is None:
+                break
+    return pages
+
+
+@benchmark("handlers")
+def handlers_search(ctx):
+    words = [ctx.word() for _ in range(ctx.ops(50))]
+    uow = ctx.uow()
+    with ctx.timing():
+        for word in words:
+            handlers.search_bookmarks(word, 20, 0, uow=uow)
+    return len(words)
+
+
+@benchmark("handlers")
+def handlers_export_ndjson(ctx):
+    with ctx.timing():
+        for _ in handlers.export_bookmarks("ndjson", uow=ctx.uow()):
+            pass
+    return 1
+
+
+@benchmark("handlers")
+def handlers_import_ndjson(ctx):
+    rows = ctx.new_rows(ctx.ops(WRITES * 10))
+    records = [(line, dict(row, date_added=None, date_edited=None)) for line, row in enumerate(rows, start=1)]
+    with ctx.timing():
+        handlers.import_bookmarks(records, uow=ctx.uow())
+    ctx.remove_after(ctx.size)
+    return len(rows)
+
+
+# message bus
+
+
+@benchmark("messagebus")
+def messagebus_handle_add(ctx):
+    messages = [
+        commands.AddBookmarkCommand(None, row["title"], row["url"], None, None, row["notes"])
+        for row in ctx.new_rows(ctx.ops(WRITES))
+    ]
+    bus = ctx.bus()
+    with ctx.timing():
+        for message in messages:
+            bus.handle(message)
+    ctx.remove_after(ctx.size)
+    return len(messages)
+
+
+@benchmark("messagebus")
+def messagebus_handle_many_edit(ctx):
+    messages = [
+        commands.EditBookmarkCommand(id, None, None, None, None, f"edited {id}")
+        for id in sorted(set(ctx.ids(WRITES)))
+    ]
+    bus = ctx.bus()
+    with ctx.timing():
+        bus.handle_many(messages)
+    return len(messages)
+
+
+# http
+
+
+def ok(response):
+    # an endpoint that fails fast mustn't look like a speed up
+    if response.status_code >= 400:
+        raise AssertionError(f"{response.request.path} answered {response.status_code}")
+    return response
+
+
+@benchmark("http")
+def http_get_one(ctx):
+    ids = ctx.ids(REQUESTS)
+    client = ctx.client()
+    with ctx.timing():
+        for id in ids:
+            ok(client.get(f"/api/one/{id}"))
+    return len(ids)
+
+
+@benchmark("http")
+def http_get_page(ctx):
+    pages = ctx.ops(20)
+    client = ctx.client()
+    with ctx.timing():
+        url = "/api/all?limit=100"
+        for _ in range(pages):
+            after = ok(client.get(url)).get_json()["next"]
+            if after is None:
+                break
+            url = f"/api/all?limit=100&after={after}"
+    return pages
+
+
+@benchmark("http")
+def http_search(ctx):
+    words = [ctx.word() for _ in range(ctx.ops(50))]
+    client = ctx.client()
+    with ctx.timing():
+        for word in words:
+            ok(client.get(f"/api/search?q={word}"))
+    return len(words)
+
+
+@benchmark("http")
+def http_add(ctx):
+    bodies = [
+        {"title": row["title"], "url": row["url"], "notes": row["notes"]}
+        for row in ctx.new_rows(ctx.ops(REQUESTS))
+    ]
+    client = ctx.client()
+    with ctx.timing():
+        for body in bodies:
+            ok(client.post("/api/add", json=body))
+    ctx.remove_after(ctx.size)
+    return len(bodies)
+
+
+@benchmark("http")
+def http_export(ctx):
+    client = ctx.client()
+    with ctx.timing():
+        response = ok(client.get("/api/export?format=ndjson"))
+        for _ in response.response:
+            pass
+    return 1
+
+
+def run_benchmark(function, ctx: Context, repeat: int) -> dict:
+    times, ops = list(), 0
+    for _ in range(repeat):
+        ctx.elapsed = 0.0
+        ops = function(ctx)
+        times.append(ctx.elapsed)
+    seconds = statistics.median(times)
+    return dict(
+        ops=ops,
+        seconds=seconds,
+        min_seconds=min(times),
+        seconds_per_op=seconds / ops,
+        ops_per_second=ops / seconds if seconds else None,
+    )
+
+
+def run(args) -> int:
+    start_mappers()
+    profile = config.get_db_profile(args.profile)
+    selected = [
+        (group, name, function)
+        for group, name, function in BENCHMARKS
+        if group in args.groups and (not args.only or any(part in name for part in args.only))
+    ]
+
+    results = list()
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            print(f"loading {size} bookmarks", file=sys.stderr)
+            session_factory = datasets.create_database(os.path.join(folder, "bench.db"), size, profile, seed=args.seed)
+            ctx = Context(size, session_factory, seed=args.seed)
+            try:
+                for group, name, function in selected:
+                    result = dict(group=group, name=name, size=size, **run_benchmark(function, ctx, args.repeat))
+                    results.append(result)
+                    print(
+                        f"{name:>32} {size:>9} {result['ops']:>6} ops {result['seconds_per_op'] * 1e3:>10.3f} ms/op",
+                        file=sys.stderr,
+                    )
+            finally:
+                ctx.close()
+
+    report = dict(
+        version=RESULTS_VERSION,
+        created=datetime.now().isoformat(timespec="seconds"),
+        python=platform.python_version(),
+        sqlalchemy=sqlalchemy.__version__,
+        platform=platform.platform(),
+        profile=args.profile or os.environ.get("BARKY_DB_PROFILE", "default"),
+        repeat=args.repeat,
+        results=results,
+    )
+    with open(args.output, "w") as out:
+        json.dump(report, out, indent=2)
+    print(f"wrote {len(results)} results to {args.output}", file=sys.stderr)
+    return 0
+
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> list[dict]:
+    """
+    One row per benchmark found in both, with the change in time per
+    operation; regression is set when it grew by more than threshold
+    """
+    base = {(r["group"], r["name"], r["size"]): r for r in baseline["results"]}
+    rows = list()
+    for result in current["results"]:
+        key = (result["group"], result["name"], result["size"])
+        if key not in base:
+            continue
+        change = result["seconds_per_op"] / base[key]["seconds_per_op"] - 1 if base[key]["seconds_per_op"] else 0.0
+        rows.append(dict(
+            group=result["group"],
+            name=result["name"],
+            size=result["size"],
+            baseline=base[key]["seconds_per_op"],
+            current=result["seconds_per_op"],
+            change=change,
+            regression=change > threshold,
+        ))
+    return rows
+
+
+def compare(args) -> int:
+    with open(args.baseline) as baseline, open(args.current) as current:
+        rows = compare_results(json.load(baseline), json.load(current), args.threshold)
+
+    print(f"{'benchmark':>32} {'size':>9} {'baseline ms':>12} {'current ms':>11} {'change':>8}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(
+            f"{row['name']:>32} {row['size']:>9} {row['baseline'] * 1e3:>12.3f} "
+            f"{row['current'] * 1e3:>11.3f} {row['change']:>+8.1%}{flag}"
+        )
+    regressions = [row for row in rows if row["regression"]]
+    print(f"{len(regressions)} of {len(rows)} benchmarks slower by more than {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="suite.py", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands_parser = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands_parser.add_parser("run", help="run the benchmarks and write the results")
+    run_parser.add_argument("--sizes", nargs="+", type=datasets.parse_size, default=[1_000, 10_000],
+                            help="bookmarks in the database, numbers or 1k 10k 100k 1m")
+    run_parser.add_argument("--groups", nargs="+", choices=GROUPS, default=list(GROUPS))
+    run_parser.add_argument("--only", nargs="+", help="run the benchmarks whose name has one of these in it")
+    run_parser.add_argument("--repeat", type=int, default=3, help="timed runs per benchmark, the median is kept")
+    run_parser.add_argument("--profile", choices=list(config.DB_PROFILES), help="BARKY_DB_PROFILE by default")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", default="benchmark-results.json")
+    run_parser.set_defaults(run=run)
+
+    compare_parser = commands_parser.add_parser("compare", help="compare results against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2,
+                                help="allowed growth in time per operation, 0.2 is 20%%")
+    compare_parser.set_defaults(run=compare)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
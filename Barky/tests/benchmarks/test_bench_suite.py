@@ -0,0 +1,36 @@
+"""
+Smoke test for the benchmark suite: every benchmark runs on a tiny database
+and compare flags a regression. Keeps the suite from rotting between the
+runs that matter; it doesn't measure anything.
+"""
+import json
+
+import datasets
+import pytest
+import suite
+
+
+def test_dataset_is_repeatable():
+    assert list(datasets.bookmark_rows(5, start=10)) == list(datasets.bookmark_rows(5, start=10))
+    titles = [row["title"] for row in datasets.bookmark_rows(1000)]
+    assert len(set(titles)) == 1000
+    assert datasets.parse_size("10k") == 10_000 and datasets.parse_size("250") == 250
+
+
+def test_run_and_compare(tmp_path, capsys):
+    baseline = tmp_path / "baseline.json"
+    assert suite.main(["run", "--sizes", "50", "--repeat", "1", "--output", str(baseline)]) == 0
+
+    report = json.loads(baseline.read_text())
+    assert {result["name"] for result in report["results"]} == {name for _, name, _ in suite.BENCHMARKS}
+    assert {result["group"] for result in report["results"]} == set(suite.GROUPS)
+    assert all(result["seconds"] > 0 for result in report["results"])
+
+    assert suite.main(["compare", str(baseline), str(baseline)]) == 0
+
+    slower = dict(report, results=[dict(result) for result in report["results"]])
+    slower["results"][0]["seconds_per_op"] *= 1.5
+    current = tmp_path / "current.json"
+    current.write_text(json.dumps(slower))
+    assert suite.main(["compare", str(baseline), str(current), "--threshold", "0.2"]) == 1
+    assert "REGRESSION" in capsys.readouterr().out
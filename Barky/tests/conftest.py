@@ -16,6 +16,11 @@ from tenacity import retry, stop_after_delay
 
 pytest.register_assert_rewrite("tests.e2e.api_client")
 
+# a query per row or a commit per row in any unit of work fails the test that ran it
+os.environ.setdefault("BARKY_QUERY_STRICT", "1")
+# off by default for their overhead, the tests check them
+os.environ.setdefault("BARKY_METRICS", "1")
+
 @pytest.fixture
 def session(file_sqlite_db):
 
@@ -60,6 +65,15 @@ def sqlite_session_factory(in_memory_sqlite_db):
     yield sessionmaker(bind=in_memory_sqlite_db)
 
 
+@pytest.fixture
+def file_session_factory(tmp_path):
+    # for tests with threads of their own, each connection to :memory: is an empty database
+    engine = create_engine(f"sqlite:///{tmp_path / 'bookmarks.db'}")
+    mapper_registry.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
 @pytest.fixture
 def mappers():
     try:
@@ -1,3 +1,4 @@
+import gzip
 import json
 import os
 from pathlib import Path
@@ -45,6 +46,76 @@ def test_get_all(test_client):
     cleanup(test_client, 2)
 
 
+def test_get_all_pages(test_client):
+    for index in range(1, 4):
+        cleanup(test_client, index)
+        add_bookmark(test_client, index)
+
+    url = config.get_api_url()+'/api/all'
+    titles, after = list(), None
+    while True:
+        query = {'limit': 2, 'sort': 'title'}
+        if after:
+            query['after'] = after
+        data = json.loads(test_client.get(url, query_string=query).data)
+        assert len(data['bookmarks']) <= 2
+        titles.extend(bmark['title'] for bmark in data['bookmarks'])
+        after = data['next']
+        if after is None:
+            break
+
+    assert titles == ['1', '2', '3']
+
+    for index in range(1, 4):
+        cleanup(test_client, index)
+
+
+def test_stream_all(test_client):
+    for index in range(1, 3):
+        cleanup(test_client, index)
+        add_bookmark(test_client, index)
+
+    url = config.get_api_url()+'/api/all'
+    r = test_client.get(url, query_string={'stream': 'json', 'sort': 'title'})
+    assert r.mimetype == 'application/json'
+    assert [bmark['title'] for bmark in json.loads(r.data)] == ['1', '2']
+
+    r = test_client.get(url, query_string={'stream': 'ndjson', 'sort': 'title'})
+    assert r.mimetype == 'application/x-ndjson'
+    lines = r.data.decode().splitlines()
+    assert [json.loads(line)['title'] for line in lines] == ['1', '2']
+
+    r = test_client.get(url, query_string={'stream': 'xml'})
+    assert r.status_code == 400
+    assert b'json, ndjson' in r.data
+
+    for index in range(1, 3):
+        cleanup(test_client, index)
+
+
+def test_search(test_client):
+    for index in range(1, 4):
+        cleanup(test_client, index)
+        add_bookmark(test_client, index)
+
+    url = config.get_api_url()+'/api/search'
+    data = json.loads(test_client.get(url, query_string={'q': 'test2', 'limit': 1}).data)
+    assert [r['title'] for r in data['results']] == ['2']
+    assert data['next'] is None
+
+    data = json.loads(test_client.get(url, query_string={'q': 'test*', 'limit': 2}).data)
+    assert len(data['results']) == 2
+    assert data['next'] == 2
+
+    # SQLite would take LIMIT -4 as no limit
+    data = json.loads(test_client.get(url, query_string={'q': 'test*', 'limit': -5, 'offset': -3}).data)
+    assert len(data['results']) == 1
+    assert data['next'] == 1
+
+    for index in range(1, 4):
+        cleanup(test_client, index)
+
+
 def test_edit(test_client):
     index = 1
     cleanup(test_client, index)
@@ -76,6 +147,196 @@ def test_get_one(test_client):
     assert bmark['title'] == json.loads(r.data)['title']
 
 
+def test_get_one_after_edit(test_client):
+    index = 1
+    cleanup(test_client, index)
+    add_bookmark(test_client, index)
+    bmark = get_test_bookmark(test_client, index)
+    url = config.get_api_url()+'/api/one/'+str(bmark['id'])
+
+    # reading twice so the second one comes from the cache
+    test_client.get(f'{url}')
+    test_client.get(f'{url}')
+    test_client.post(config.get_api_url()+'/api/edit/'+str(bmark['id']), json={"notes": "edited"})
+    r = test_client.get(f'{url}')
+
+    assert json.loads(r.data)['notes'] == 'edited'
+
+    cleanup(test_client, index)
+
+
+def test_import(test_client):
+    for index in range(1, 4):
+        cleanup(test_client, index)
+
+    url = config.get_api_url()+'/api/import'
+    body = 'title,url,notes\n1,http://test1.com,test1\n2,http://test2.com,test2\n3,not a url,\n'
+    r = test_client.post(url, data=body, content_type='text/csv')
+
+    assert r.status_code == 200
+    report = json.loads(r.data)
+    assert report['imported'] == 2
+    assert report['errors'] == [{'line': 4, 'error': 'invalid url not a url'}]
+    assert get_test_bookmark(test_client, 2)['notes'] == 'test2'
+
+    r = test_client.post(url, data=body)
+    assert r.status_code == 400
+
+    for index in range(1, 4):
+        cleanup(test_client, index)
+
+
+def test_upsert(test_client):
+    for index in range(1, 3):
+        cleanup(test_client, index)
+    add_bookmark(test_client, 1)
+
+    url = config.get_api_url()+'/api/upsert'
+    body = 'title,url,notes\n1,http://changed1.com,changed\n2,http://test2.com,test2\n'
+    r = test_client.post(f'{url}?update=url', data=body, content_type='text/csv')
+
+    assert r.status_code == 200
+    report = json.loads(r.data)
+    assert (report['inserted'], report['updated'], report['unchanged']) == (1, 1, 0)
+    bookmark = get_test_bookmark(test_client, 1)
+    assert (bookmark['url'], bookmark['notes']) == ('http://changed1.com', 'test1')
+
+    r = test_client.post(f'{url}?update=title', data=body, content_type='text/csv')
+    assert r.status_code == 400
+
+    for index in range(1, 3):
+        cleanup(test_client, index)
+
+
+def test_delete_many(test_client):
+    for index in range(1, 4):
+        cleanup(test_client, index)
+        add_bookmark(test_client, index)
+    ids = [get_test_bookmark(test_client, index)['id'] for index in range(1, 3)]
+
+    url = config.get_api_url()+'/api/delete'
+    r = test_client.post(url, json={'ids': ids + [ids[0], 10**9]})
+    assert r.status_code == 200
+    assert json.loads(r.data) == {'deleted': 2}
+    assert not get_test_bookmark(test_client, 1)
+    assert get_test_bookmark(test_client, 3)['title'] == '3'
+
+    r = test_client.post(url, json=[get_test_bookmark(test_client, 3)['id']])
+    assert json.loads(r.data) == {'deleted': 1}
+
+    assert test_client.post(url, json={'ids': 'all'}).status_code == 400
+    assert test_client.post(url, json={'ids': ['one']}).status_code == 400
+    assert test_client.post(url, json=[1.9]).status_code == 400
+    assert test_client.post(url, json=[True]).status_code == 400
+
+
+def test_export(test_client):
+    for index in range(1, 3):
+        cleanup(test_client, index)
+        add_bookmark(test_client, index)
+
+    url = config.get_api_url()+'/api/export'
+    r = test_client.get(f'{url}?format=csv')
+    assert r.status_code == 200
+    assert r.mimetype == 'text/csv'
+    lines = r.data.decode().splitlines()
+    assert lines[0] == 'id,title,url,notes,date_added,date_edited'
+    assert [line.split(',')[1] for line in lines[1:]][-2:] == ['1', '2']
+
+    r = test_client.get(f'{url}?gzip=1')
+    assert r.status_code == 200
+    assert 'bookmarks.ndjson.gz' in r.headers['Content-Disposition']
+    rows = [json.loads(line) for line in gzip.decompress(r.data).splitlines()]
+    assert [row['title'] for row in rows][-2:] == ['1', '2']
+
+    r = test_client.get(f'{url}?format=xml')
+    assert r.status_code == 400
+
+    for index in range(1, 3):
+        cleanup(test_client, index)
+
+
+def test_metrics(test_client):
+    cleanup(test_client, 1)
+    add_bookmark(test_client, 1)
+    get_test_bookmark(test_client, 1)
+
+    r = test_client.get(config.get_api_url()+'/api/metrics')
+
+    assert r.status_code == 200
+    assert r.content_type.startswith('text/plain; version=0.0.4')
+    text = r.data.decode()
+    assert 'barky_db_queries_total{shape="select bookmarks"}' in text
+    assert 'barky_http_requests_total{endpoint="flask_bookmark_api.add",method="POST",status="201"}' in text
+    assert 'barky_http_request_db_queries_bucket{endpoint="flask_bookmark_api.first",le="+Inf"}' in text
+    assert 'barky_cache_hits_total' in text
+
+    cleanup(test_client, 1)
+
+
+def test_profiling(test_client, monkeypatch):
+    from barkylib.adapters import profiles
+    from barkylib.api import flaskapi
+
+    monkeypatch.setattr(flaskapi.fb, 'profiling', profiles.RequestProfiling(secret='secret'))
+    token = profiles.sign_token('secret', 'cprofile')
+    url = config.get_api_url()+'/api'
+
+    assert profiles.ID_HEADER not in test_client.get(f'{url}/all').headers
+    assert test_client.get(f'{url}/admin/profiles').status_code == 403
+
+    r = test_client.get(f'{url}/all', headers={profiles.HEADER: token, 'X-Request-Id': 'slow-all'})
+    assert r.headers[profiles.ID_HEADER] == 'slow-all'
+
+    r = test_client.get(f'{url}/admin/profiles', headers={profiles.HEADER: token})
+    assert [profile['id'] for profile in r.json] == ['slow-all']
+    assert r.json[0]['endpoint'] == 'flask_bookmark_api.all'
+
+    r = test_client.get(f'{url}/admin/profiles/slow-all', headers={profiles.HEADER: token})
+    assert r.headers['Content-Disposition'] == 'attachment; filename="slow-all.prof"'
+    r = test_client.get(f'{url}/admin/profiles/slow-all?format=text', headers={profiles.HEADER: token})
+    assert b'list_all_bookmarks' in r.data
+
+
+def test_write_behind_add(test_client, monkeypatch, tmp_path):
+    from barkylib.api import flaskapi
+    from barkylib.services.write_behind import WriteBehindWriter
+
+    cleanup(test_client, 1)
+    writer = WriteBehindWriter(flaskapi.fb.uow, str(tmp_path), max_delay_ms=60_000).start()
+    monkeypatch.setattr(flaskapi.fb, 'writer', writer)
+    flaskapi.fb.register_collectors()
+
+    r = add_bookmark(test_client, 1)
+    assert r.status_code == 202
+    assert 'barky_write_behind_depth 1' in test_client.get(config.get_api_url()+'/api/metrics').data.decode()
+
+    writer.close()
+    assert get_test_bookmark(test_client, 1) is not None
+    monkeypatch.undo()
+    flaskapi.fb.register_collectors()
+    cleanup(test_client, 1)
+
+
+def test_outbox_events_are_published(test_client, monkeypatch):
+    from barkylib.adapters.publishers import InMemoryPublisher
+    from barkylib.services import unit_of_work
+    from barkylib.services.relay import OutboxRelay
+
+    cleanup(test_client, 1)
+    relay = OutboxRelay(unit_of_work.default_session_factory(), InMemoryPublisher())
+    relay.publish_all()
+    monkeypatch.setenv('BARKY_OUTBOX', '1')
+
+    assert add_bookmark(test_client, 1).status_code == 201
+    cleanup(test_client, 1)
+
+    relay.publish_all()
+    channels = [message.channel for message in relay.publisher.messages]
+    assert channels == ['barky.bookmark_added', 'barky.bookmark_deleted']
+    assert json.loads(relay.publisher.messages[0].body())['event']['title'] == '1'
+
+
 def add_bookmark(test_client, index):
     url = config.get_api_url()+'/api/add'
     r = test_client.post(f"{url}", json=json.loads('{"title":"'+str(index)+'", "url":"http://test'+str(index)+'.com", "notes":"test'+str(index)+'"}'))
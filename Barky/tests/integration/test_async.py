@@ -0,0 +1,127 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+from barkylib.api.asgiapi import AsgiBookmarkAPI
+from barkylib.domain.models import Bookmark
+from barkylib.services import async_handlers, handlers, unit_of_work
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+
+@pytest.fixture
+def async_session_factory(tmp_path):
+    engine = unit_of_work.create_profiled_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'async.db'}")
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
+def make_bookmark(index):
+    return Bookmark(
+        id=None,
+        title=f"Test{index}",
+        url=f"http://test{index}.com",
+        notes=f"Test bookmark {index}",
+        date_added=datetime(2023, 8, 12),
+        date_edited=datetime(2023, 8, 12),
+    )
+
+
+def test_async_repository(async_session_factory):
+    async def run():
+        uow = unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+        ids = await async_handlers.add_bookmark(uow=uow, bookmarks=[make_bookmark(i) for i in range(1, 6)], bulk=True)
+        assert ids == [1, 2, 3, 4, 5]
+
+        async with uow:
+            edits = [Bookmark(2, "Edited", None, None, None, None), Bookmark(99, "x", None, None, None, None)]
+            assert await uow.bookmarks.update_many(edits) == [1, 0]
+            await uow.bookmarks.delete_many([5])
+
+            bookmark = await uow.bookmarks.get_dict(2)
+            assert bookmark['title'] == "Edited"
+            assert bookmark['date_added'] == "2023-08-12 00:00:00"
+
+            titles, after = list(), None
+            while True:
+                page, after = await uow.bookmarks.find_page(None, after=after, limit=2, sort='title')
+                titles += [b.title for b in page]
+                if after is None:
+                    break
+            assert titles == ["Edited", "Test1", "Test3", "Test4"]
+
+            results = await uow.bookmarks.search("test3")
+            assert [r['id'] for r in results] == [3]
+
+            streamed = [row.id async for row in uow.bookmarks.stream_rows(select(Bookmark), batch_size=2)]
+            assert streamed == [1, 2, 3, 4]
+
+    asyncio.run(run())
+
+
+def test_async_handlers_match_sync(async_session_factory, sqlite_session_factory):
+    bookmarks = [make_bookmark(i) for i in range(1, 4)]
+    handlers.add_bookmark(uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory), bookmarks=bookmarks, bulk=True)
+    expected = handlers.list_all_bookmarks(None, None, 'title', unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory))
+
+    async def run():
+        await async_handlers.add_bookmark(
+            uow=unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory), bookmarks=bookmarks, bulk=True
+        )
+        return await async_handlers.list_all_bookmarks(
+            None, None, 'title', unit_of_work.AsyncSqlAlchemyUnitOfWork(async_session_factory)
+        )
+
+    assert asyncio.run(run()) == expected
+
+
+def call(app, method, path, query=b"", body=b""):
+    """
+    Sends one request through the ASGI app and returns (status, body)
+    """
+    messages = list()
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "query_string": query}
+    asyncio.run(app(scope, receive, send))
+    return messages[0]["status"], b"".join(m.get("body", b"") for m in messages[1:])
+
+
+def test_asgi_api(async_session_factory):
+    app = AsgiBookmarkAPI(async_session_factory)
+
+    assert call(app, "GET", "/api/") == (200, b"Barky API")
+    for index in (1, 2, 3):
+        body = json.dumps({"title": f"Test{index}", "url": f"http://test{index}.com"}).encode()
+        assert call(app, "POST", "/api/add", body=body)[0] == 201
+
+    status, body = call(app, "GET", "/api/one/2")
+    assert status == 200 and json.loads(body)["title"] == "Test2"
+
+    assert call(app, "POST", "/api/edit/2", body=b'{"title": "Edited"}')[0] == 201
+    assert call(app, "GET", "/api/delete/3")[0] == 201
+    # sqlite hands the freed id 3 out again
+    assert call(app, "POST", "/api/add", body=b'{"title": "Test4", "url": "http://test4.com"}')[0] == 201
+    assert json.loads(call(app, "POST", "/api/delete", body=b'{"ids": [3, 40]}')[1]) == {"deleted": 1}
+    assert call(app, "POST", "/api/delete", body=b'{"ids": ["x"]}')[0] == 400
+
+    assert [b["title"] for b in json.loads(call(app, "GET", "/api/all")[1])] == ["Test1", "Edited"]
+    page = json.loads(call(app, "GET", "/api/all", b"limit=1&sort=title")[1])
+    assert [b["title"] for b in page["bookmarks"]] == ["Edited"] and page["next"]
+    streamed = call(app, "GET", "/api/all", b"stream=ndjson")[1]
+    assert [json.loads(line)["id"] for line in streamed.splitlines()] == [1, 2]
+    # a bare ?stream streams a JSON array, as in the Flask app
+    assert [b["id"] for b in json.loads(call(app, "GET", "/api/all", b"stream&limit=1")[1])] == [1, 2]
+    assert call(app, "GET", "/api/all", b"stream=xml")[0] == 400
+    assert json.loads(call(app, "GET", "/api/search", b"q=test1")[1])["results"][0]["id"] == 1
+
+    assert call(app, "GET", "/api/all", b"after=nope")[0] == 400
+    assert call(app, "GET", "/api/missing")[0] == 404
@@ -0,0 +1,119 @@
+import io
+import json
+
+import pytest
+from barkylib import cli
+from barkylib.adapters import importers
+from barkylib.domain.models import Bookmark
+from barkylib.services import handlers, unit_of_work
+from sqlalchemy import event, select
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+
+def ndjson(*titles):
+    return "".join(
+        json.dumps({"title": title, "url": f"http://{title}.com"}) + "\n" for title in titles
+    ).encode()
+
+
+def test_import_skips_taken_titles(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    handlers.import_bookmarks(importers.read_records(io.BytesIO(ndjson("b")), "ndjson"), uow=uow)
+
+    data = ndjson("a", "b", "c") + b'{"title": "d"}\n' + ndjson("e", "a")
+    report = handlers.import_bookmarks(importers.read_records(io.BytesIO(data), "ndjson"), uow=uow, chunk_size=2)
+
+    assert report["imported"] == 3
+    assert report["failed"] == 3
+    assert [error["line"] for error in report["errors"]] == [2, 4, 6]
+    assert report["errors"][0]["error"] == "A bookmark titled b already exists"
+    assert report["errors"][1]["error"] == "url is required"
+    titles = sqlite_session_factory().scalars(select(Bookmark.title).order_by(Bookmark.id)).all()
+    assert titles == ["b", "a", "c", "e"]
+
+
+def test_import_commits_once_per_chunk_with_duplicates(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    handlers.import_bookmarks(importers.read_records(io.BytesIO(ndjson("t3")), "ndjson"), uow=uow)
+    commits = list()
+    event.listen(sqlite_session_factory.kw["bind"], "commit", commits.append)
+
+    # titles taken before the import, by an earlier chunk and earlier in the same chunk
+    titles = [f"t{i}" for i in range(10)] + ["t3", "t12", "t12", "t14", "t5", "t16", "t17"]
+    report = handlers.import_bookmarks(importers.read_records(io.BytesIO(ndjson(*titles)), "ndjson"), uow=uow, chunk_size=6)
+
+    assert len(commits) == 3
+    assert report["imported"] == 13
+    assert [error["line"] for error in report["errors"]] == [4, 11, 13, 15]
+    assert all("already exists" in error["error"] for error in report["errors"])
+
+
+@pytest.mark.parametrize("in_memory", [False, True])
+def test_import_reports_duplicates_with_either_unit_of_work(sqlite_session_factory, in_memory):
+    if in_memory:
+        uow = unit_of_work.InMemoryUnitOfWork()
+    else:
+        uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    handlers.import_bookmarks(importers.read_records(io.BytesIO(ndjson("b")), "ndjson"), uow=uow)
+
+    data = ndjson("a", "b", "c", "a")
+    report = handlers.import_bookmarks(importers.read_records(io.BytesIO(data), "ndjson"), uow=uow, chunk_size=2)
+
+    assert report["imported"] == 2
+    assert [error["line"] for error in report["errors"]] == [2, 4]
+
+
+def test_cli_import(tmp_path, capsys):
+    path = tmp_path / "bookmarks.csv"
+    path.write_text("title,url\nOne,http://one.com\nTwo,nope\n")
+    db = f"sqlite:///{tmp_path / 'cli.db'}"
+
+    assert cli.main(["--db", db, "import", str(path)]) == 1
+
+    report = json.loads(capsys.readouterr().out)
+    assert report["imported"] == 1
+    assert report["errors"] == [{"line": 3, "error": "invalid url nope"}]
+
+
+def test_imported_dates_read_like_orm_ones(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    data = b'{"title": "a", "url": "http://a.com", "date_added": "2023-08-12T10:30:00.5", "date_edited": "2023-08-13"}\n'
+    handlers.import_bookmarks(importers.read_records(io.BytesIO(data), "ndjson"), uow=uow)
+
+    bookmark = handlers.list_bookmark(1, uow=uow)
+    assert bookmark["date_added"] == "2023-08-12 10:30:00.500000"
+    assert bookmark["date_edited"] == "2023-08-13 00:00:00"
+    # the filter binds a datetime, so this only matches if the stored text is the same
+    assert len(handlers.list_all_bookmarks("date_edited", "2023-08-13T00:00:00", None, uow=uow)) == 1
+
+
+def test_upsert_bookmarks(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    handlers.import_bookmarks(importers.read_records(io.BytesIO(ndjson("a", "b")), "ndjson"), uow=uow)
+
+    data = b'{"title": "a", "url": "http://changed.com"}\n' + ndjson("b", "c") + b'{"title": "d"}\n'
+    report = handlers.upsert_bookmarks(importers.read_records(io.BytesIO(data), "ndjson"), uow=uow, chunk_size=2)
+
+    assert (report["inserted"], report["updated"], report["unchanged"], report["failed"]) == (1, 1, 1, 1)
+    assert report["errors"] == [{"line": 4, "error": "url is required"}]
+    assert handlers.list_bookmark(1, uow=uow)["url"] == "http://changed.com"
+
+    report = handlers.upsert_bookmarks(importers.read_records(io.BytesIO(data), "ndjson"), uow=uow)
+    assert (report["inserted"], report["updated"], report["unchanged"]) == (0, 0, 3)
+
+
+def test_cli_upsert(tmp_path, capsys):
+    path = tmp_path / "bookmarks.csv"
+    path.write_text("title,url,notes\nOne,http://one.com,first\nTwo,http://two.com,\n")
+    db = f"sqlite:///{tmp_path / 'cli.db'}"
+    assert cli.main(["--db", db, "import", str(path)]) == 0
+    capsys.readouterr()
+
+    path.write_text("title,url,notes\nOne,http://uno.com,changed\nThree,http://three.com,\n")
+    assert cli.main(["--db", db, "upsert", str(path), "--update", "url"]) == 0
+
+    report = json.loads(capsys.readouterr().out)
+    assert (report["inserted"], report["updated"]) == (1, 1)
+    bookmark = handlers.list_bookmark(1, uow=cli.make_uow(db))
+    assert (bookmark["url"], bookmark["notes"]) == ("http://uno.com", "first")
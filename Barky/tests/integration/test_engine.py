@@ -0,0 +1,38 @@
+import pytest
+from barkylib import config
+from barkylib.services import unit_of_work
+
+
+def pragma(engine, name):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+
+def test_profile_pragmas_are_set_on_connect(tmp_path):
+    engine = unit_of_work.create_profiled_engine(
+        f"sqlite:///{tmp_path / 'profile.db'}", config.get_db_profile("fast")
+    )
+
+    assert pragma(engine, "journal_mode") == "wal"
+    assert pragma(engine, "synchronous") == 1  # NORMAL
+    assert pragma(engine, "busy_timeout") == 5000
+    assert pragma(engine, "cache_size") == -64000
+    assert engine.pool.size() == 20
+
+
+def test_default_profile_keeps_sqlite_defaults(tmp_path):
+    engine = unit_of_work.create_profiled_engine(
+        f"sqlite:///{tmp_path / 'profile.db'}", config.get_db_profile("default")
+    )
+
+    assert pragma(engine, "journal_mode") == "delete"
+    assert pragma(engine, "synchronous") == 2  # FULL
+
+
+def test_profile_is_picked_from_the_environment(monkeypatch):
+    monkeypatch.setenv("BARKY_DB_PROFILE", "wal")
+    assert config.get_db_profile()["journal_mode"] == "WAL"
+
+    monkeypatch.setenv("BARKY_DB_PROFILE", "nope")
+    with pytest.raises(ValueError):
+        config.get_db_profile()
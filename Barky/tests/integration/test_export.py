@@ -0,0 +1,82 @@
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+from barkylib import cli, config
+from barkylib.adapters import exporters, orm
+from barkylib.services import handlers, unit_of_work
+from sqlalchemy.orm import sessionmaker
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+NOW = datetime(2023, 8, 12)
+
+
+def rows(start, stop):
+    return [
+        {"title": str(id), "url": f"http://{id}.com", "notes": None, "date_added": NOW, "date_edited": NOW}
+        for id in range(start, stop)
+    ]
+
+
+@pytest.fixture
+def wal_engine(tmp_path):
+    engine = unit_of_work.create_profiled_engine(f"sqlite:///{tmp_path / 'export.db'}", config.get_db_profile("wal"))
+    orm.ensure_schema(engine)
+    yield engine
+    engine.dispose()
+
+
+def exported_ids(chunks):
+    return [json.loads(line)["id"] for line in b"".join(chunks).decode().splitlines()]
+
+
+def test_export_is_in_id_order(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    with uow:
+        uow.bookmarks.add_rows(rows(0, 50))
+        uow.bookmarks.delete_many([10])
+
+    ids = exported_ids(handlers.export_bookmarks("ndjson", uow=uow, batch_size=7))
+
+    assert ids == [id for id in range(1, 51) if id != 10]
+
+
+def test_concurrent_writes_dont_tear_the_export(wal_engine):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sessionmaker(bind=wal_engine))
+    with uow:
+        uow.bookmarks.add_rows(rows(0, 3 * exporters.ROWS_PER_CHUNK))
+
+    chunks = handlers.export_bookmarks("ndjson", uow=uow, batch_size=100)
+    first = next(chunks)
+
+    # another connection deletes a row the export hasn't reached and adds one
+    with wal_engine.begin() as connection:
+        connection.exec_driver_sql("DELETE FROM bookmarks WHERE id = 2500")
+        connection.exec_driver_sql(
+            "INSERT INTO bookmarks (title, url, date_added, date_edited) VALUES ('new', 'http://new.com', '2023-08-12', '2023-08-12')"
+        )
+
+    ids = exported_ids([first, *chunks])
+    assert ids == list(range(1, 3 * exporters.ROWS_PER_CHUNK + 1))
+    # the writes went through, the next export sees them
+    ids = exported_ids(handlers.export_bookmarks("ndjson", uow=uow))
+    assert 2500 not in ids and len(ids) == 3 * exporters.ROWS_PER_CHUNK
+
+
+def test_cli_export_round_trips_through_import(tmp_path, capsys):
+    source = f"sqlite:///{tmp_path / 'source.db'}"
+    target = f"sqlite:///{tmp_path / 'target.db'}"
+    uow = cli.make_uow(source)
+    with uow:
+        uow.bookmarks.add_rows(rows(0, 20))
+    path = tmp_path / "bookmarks.csv.gz"
+
+    assert cli.main(["--db", source, "export", str(path)]) == 0
+    assert gzip.decompress(path.read_bytes()).startswith(b"id,title,url,notes,date_added,date_edited\r\n1,0,")
+
+    (tmp_path / "bookmarks.csv").write_bytes(gzip.decompress(path.read_bytes()))
+    assert cli.main(["--db", target, "import", str(tmp_path / "bookmarks.csv")]) == 0
+    assert json.loads(capsys.readouterr().out)["imported"] == 20
+    assert handlers.list_bookmark(20, uow=cli.make_uow(target))["url"] == "http://19.com"
@@ -0,0 +1,121 @@
+"""
+The in-memory repository answers the same queries the same way as SQLite
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from barkylib.adapters import orm, serializers
+from barkylib.adapters.memory import InMemoryRepository
+from barkylib.adapters.repository import SqlAlchemyRepository
+from barkylib.domain.models import Bookmark
+from barkylib.services import handlers
+from sqlalchemy import and_, or_, select, tuple_
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+START = datetime(2023, 1, 1)
+
+
+def rows(count):
+    # dates repeat so ordering has ties for the id to break
+    return [
+            {
+                "title": f"{'Bcda'[i % 4]} title {i:03}",
+                "url": f"http://host{i % 5}.com/{i}",
+                "notes": None if i % 3 == 0 else f"notes about python {i}",
+                "date_added": START + timedelta(days=i % 7),
+                "date_edited": START + timedelta(days=i % 11, hours=i),
+            }
+            for i in range(count)
+    ]
+
+
+@pytest.fixture
+def repositories(sqlite_session_factory):
+    sql = SqlAlchemyRepository(sqlite_session_factory())
+    memory = InMemoryRepository()
+    for repo in (sql, memory):
+        repo.add_rows(rows(60))
+        repo.delete_by_ids([5, 6])
+    yield sql, memory
+    sql.Session.close()
+
+
+def dicts(rows):
+    return [serializers.row_to_dict(row) for row in rows]
+
+
+def queries():
+    # built per test, select(Bookmark) needs the mappers started
+    filters = [
+        (None, None),
+        ('id', 7),
+        ('id', 5),
+        ('title', 'C title 009'),
+        ('url', 'http://host2.com/12'),
+        ('date_added', START + timedelta(days=3)),
+        ('date_edited', START + timedelta(days=4, hours=15)),
+    ]
+    c = orm.bookmarks.c
+    return [
+        handlers.get_query(filter, value, sort)
+        for filter, value in filters
+        for sort in (None, 'id', 'title', 'date_added', 'date_edited')
+    ] + [
+        select(Bookmark).where(c.id > 40),
+        select(Bookmark).where(c.id.in_([1, 3, 5, 99])).order_by(c.title.desc()),
+        select(Bookmark).where(c.date_added >= START + timedelta(days=5)).order_by(c.date_edited),
+        select(Bookmark).where(c.date_added < START + timedelta(days=2), c.id <= 30),
+        select(Bookmark).where(c.notes.is_(None)).order_by(c.date_added.desc(), c.id.desc()),
+        select(Bookmark).where(or_(c.id < 3, c.title == 'd title 055')),
+        select(Bookmark)
+        .where(tuple_(c.date_added, c.id) > tuple_(START + timedelta(days=2), 20))
+        .order_by(c.date_added, c.id)
+        .limit(10),
+        select(Bookmark).order_by(c.date_edited.desc()).limit(5).offset(3),
+        select(Bookmark).where(and_(c.url != 'http://host1.com/1', c.notes.is_not(None))).limit(7),
+    ]
+
+
+@pytest.mark.parametrize("number", range(44))
+def test_same_rows(repositories, number):
+    sql, memory = repositories
+    query = queries()[number]
+    assert dicts(memory.find_rows(query)) == dicts(sql.find_rows(query))
+    assert [b.as_dict() for b in memory.find_all(query)] == [b.as_dict() for b in sql.find_all(query)]
+
+
+@pytest.mark.parametrize("sort", ['id', 'title', 'date_added', 'date_edited'])
+def test_same_pages(repositories, sort):
+    pages = list()
+    for repo in repositories:
+        after, ids = None, list()
+        while True:
+            query = handlers.get_query('date_added', START + timedelta(days=1), None) if sort == 'title' else None
+            bookmarks, after = repo.find_page(query, after=after, limit=7, sort=sort)
+            ids.append([bookmark.id for bookmark in bookmarks])
+            if after is None:
+                break
+        pages.append(ids)
+    assert pages[0] == pages[1]
+
+
+def test_same_upserts_and_updates(repositories):
+    sql, memory = repositories
+    changes = [dict(row, notes="changed") for row in rows(4)] + rows(62)[60:]
+    assert memory.upsert_many(changes) == sql.upsert_many(changes) == {'inserted': 2, 'updated': 4, 'unchanged': 0}
+
+    edits = [Bookmark(id=id, title=None, url=f"http://edited.com/{id}", notes=None, date_added=None, date_edited=None) for id in (1, 5, 8)]
+    assert memory.update_many(edits) == sql.update_many(edits) == [1, 0, 1]
+
+    everything = select(Bookmark).order_by(orm.bookmarks.c.id)
+    # date_edited is set to now by both, separately
+    strip = lambda rows: [dict(row, date_edited=None) for row in dicts(rows)]
+    assert strip(memory.find_rows(everything)) == strip(sql.find_rows(everything))
+
+
+def test_same_search_results(repositories):
+    sql, memory = repositories
+    for text in ('python', 'notes 1*', 'host3', 'missing'):
+        fields = lambda results: [(result['id'], result['title']) for result in results]
+        assert sorted(fields(memory.search(text, limit=100))) == sorted(fields(sql.search(text, limit=100)))
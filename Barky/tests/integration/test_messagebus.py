@@ -0,0 +1,96 @@
+from collections import Counter
+
+import pytest
+from barkylib import bootstrap
+from barkylib.adapters import orm
+from barkylib.adapters.cache import BookmarkCache
+from barkylib.domain import commands, events
+from barkylib.domain.models import Bookmark
+from barkylib.services import unit_of_work
+from sqlalchemy import event, func, select
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+
+@pytest.fixture
+def bus(sqlite_session_factory):
+    return bootstrap.bootstrap(start_orm=False, uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory))
+
+
+@pytest.fixture
+def commits(in_memory_sqlite_db):
+    # migrating the schema commits too, get it out of the way first
+    orm.ensure_schema(in_memory_sqlite_db)
+    counter = Counter()
+
+    def count(conn):
+        counter['commits'] += 1
+
+    event.listen(in_memory_sqlite_db, "commit", count)
+    yield counter
+    event.remove(in_memory_sqlite_db, "commit", count)
+
+
+def add_command(index):
+    return commands.AddBookmarkCommand(
+        id=None,
+        title=f"Test{index}",
+        url=f"http://test{index}.com",
+        date_added="2023-08-12T00:00:00",
+        date_edited="2023-08-12T00:00:00",
+    )
+
+
+def count_bookmarks(session_factory):
+    return session_factory().scalar(select(func.count()).select_from(Bookmark))
+
+
+def test_handle_many_commits_a_run_of_commands_once(bus, commits, sqlite_session_factory):
+    bus.handle_many(add_command(i) for i in range(10_000))
+
+    assert commits['commits'] == 1
+    assert count_bookmarks(sqlite_session_factory) == 10_000
+
+
+def test_handle_many_groups_consecutive_commands_only(bus, commits, sqlite_session_factory):
+    bus.handle_many([
+        add_command(1),
+        add_command(2),
+        commands.EditBookmarkCommand(1, "Edited", None, None, None),
+        commands.EditBookmarkCommand(2, None, "http://edited.com", None, None),
+        commands.DeleteBookmarkCommand(1),
+        add_command(3),
+    ])
+
+    assert commits['commits'] == 4
+    session = sqlite_session_factory()
+    assert session.scalars(select(Bookmark.title).order_by(Bookmark.id)).all() == ["Test2", "Test3"]
+    assert session.scalar(select(Bookmark.url).where(Bookmark.id == 2)) == "http://edited.com"
+
+
+def test_handle_runs_single_commands(bus, sqlite_session_factory):
+    bus.handle(add_command(1))
+    bus.handle(commands.DeleteBookmarkCommand(1))
+    bus.handle(add_command(2))
+
+    assert count_bookmarks(sqlite_session_factory) == 1
+
+
+def test_bootstrap_dispatches_events_in_the_background(sqlite_session_factory):
+    cache = BookmarkCache()
+    cache.put(1, {"id": 1})
+    bus = bootstrap.bootstrap(
+        start_orm=False,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory),
+        cache=cache,
+        dispatch_settings=dict(workers=2, max_queue=10),
+    )
+
+    bus.handle(events.BookmarkEdited(id=1, title="Edited", url="http://edited.com", date_edited="2023-08-12"))
+    bus.dispatcher.join()
+    stats = bus.dispatcher.stats()
+    bus.dispatcher.shutdown()
+
+    assert cache.get(1) is None
+    assert stats["handlers"]["invalidate_cached_bookmark"]["calls"] == 1
+    assert stats["handlers"]["invalidate_cached_bookmark"]["errors"] == 0
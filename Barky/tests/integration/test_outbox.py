@@ -0,0 +1,159 @@
+import json
+import time
+from datetime import datetime
+
+import pytest
+from barkylib.adapters import orm, outbox
+from barkylib.adapters.publishers import InMemoryPublisher
+from barkylib.domain.models import Bookmark
+from barkylib.services import unit_of_work
+from barkylib.services.relay import OutboxRelay
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+
+def uow(file_session_factory, enabled=True):
+    return unit_of_work.SqlAlchemyUnitOfWork(file_session_factory, outbox=enabled)
+
+
+def bookmark(i, **kwargs):
+    values = dict(id=None, title=f"title {i}", url=f"http://{i}.com", notes=None,
+                  date_added=datetime(2023, 1, 1), date_edited=datetime(2023, 1, 1))
+    return Bookmark(**dict(values, **kwargs))
+
+
+def events(file_session_factory):
+    with file_session_factory() as session:
+        return [(row.topic, json.loads(row.payload)) for row in session.execute(select(orm.outbox).order_by(orm.outbox.c.id))]
+
+
+def test_writes_put_their_events_in_the_outbox(file_session_factory):
+    with uow(file_session_factory) as work:
+        ids = work.bookmarks.add_many([bookmark(1), bookmark(2)])
+        work.bookmarks.update(Bookmark(ids[0], None, "http://new.com", None, None, None))
+        work.bookmarks.update(Bookmark(999, None, "http://new.com", None, None, None))
+        work.bookmarks.delete_by_ids([ids[1], 999])
+
+    topics = [(topic, payload["id"]) for topic, payload in events(file_session_factory)]
+    assert topics == [
+        ("bookmark_added", ids[0]),
+        ("bookmark_added", ids[1]),
+        ("bookmark_edited", ids[0]),
+        ("bookmark_deleted", ids[1]),
+    ]
+    assert events(file_session_factory)[0][1]["title"] == "title 1"
+    assert events(file_session_factory)[2][1]["url"] == "http://new.com"
+
+
+def test_bulk_writes_put_their_events_in_the_outbox(file_session_factory):
+    with uow(file_session_factory) as work:
+        work.bookmarks.add_rows([dict(title="a", url="http://a.com", notes=None, date_added=None, date_edited=None)])
+        counts = work.bookmarks.upsert_many([
+            dict(title="a", url="http://b.com", notes=None, date_added=None, date_edited=None),
+            dict(title="c", url="http://c.com", notes=None, date_added=None, date_edited=None),
+        ])
+
+    assert counts == {'inserted': 1, 'updated': 1, 'unchanged': 0}
+    assert [(topic, payload["title"], payload["id"]) for topic, payload in events(file_session_factory)] == [
+        ("bookmark_added", "a", None),
+        ("bookmark_added", "c", None),
+        ("bookmark_edited", "a", 1),
+    ]
+
+
+def test_a_rolled_back_write_leaves_no_events(file_session_factory):
+    with uow(file_session_factory) as work:
+        work.bookmarks.add_one(bookmark(1))
+    with pytest.raises(IntegrityError):
+        with uow(file_session_factory) as work:
+            work.bookmarks.add_many([bookmark(2), bookmark(1)])
+
+    assert [payload["title"] for _, payload in events(file_session_factory)] == ["title 1"]
+    assert not work.session.info[outbox.PENDING]
+
+
+def test_nothing_is_written_with_the_outbox_off(file_session_factory):
+    with uow(file_session_factory, enabled=False) as work:
+        work.bookmarks.add_one(bookmark(1))
+
+    assert events(file_session_factory) == []
+
+
+def test_relay_publishes_in_batches_and_empties_the_outbox(file_session_factory):
+    with uow(file_session_factory) as work:
+        work.bookmarks.add_many([bookmark(i) for i in range(5)])
+    publisher = InMemoryPublisher()
+    relay = OutboxRelay(file_session_factory, publisher, batch_size=2)
+
+    assert relay.publish_all() == 5
+    assert [json.loads(message.body())["event"]["title"] for message in publisher.messages] == [
+        f"title {i}" for i in range(5)
+    ]
+    assert relay.backlog() == 0
+    assert relay.stats()["batches"] == 3
+
+
+def test_events_stay_in_the_outbox_when_publishing_fails(file_session_factory):
+    class Down(InMemoryPublisher):
+        def publish_many(self, messages):
+            raise ConnectionError("redis is down")
+
+    with uow(file_session_factory) as work:
+        work.bookmarks.add_one(bookmark(1))
+    relay = OutboxRelay(file_session_factory, Down())
+
+    with pytest.raises(ConnectionError):
+        relay.publish_batch()
+    assert relay.backlog() == 1
+
+
+def test_relay_thread_is_woken_by_a_commit(file_session_factory):
+    publisher = InMemoryPublisher()
+    # the interval alone would take a minute
+    relay = OutboxRelay(file_session_factory, publisher, interval_ms=60_000).start()
+    try:
+        received = list()
+        publisher.subscribe("barky.bookmark_added", received.append)
+        with uow(file_session_factory) as work:
+            work.bookmarks.add_one(bookmark(1))
+
+        deadline = time.monotonic() + 5
+        while not received and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(received) == 1
+    finally:
+        relay.stop()
+
+
+def test_only_the_relay_with_the_lock_publishes(file_session_factory, tmp_path):
+    lock_path = str(tmp_path / "outbox.lock")
+    first, second = InMemoryPublisher(), InMemoryPublisher()
+    owner = OutboxRelay(file_session_factory, first, interval_ms=10, lock_path=lock_path)
+    assert owner.acquire()
+    owner.start()
+    standby = OutboxRelay(file_session_factory, second, interval_ms=10, lock_path=lock_path)
+
+    def wait_for(publisher, count):
+        deadline = time.monotonic() + 5
+        while len(publisher.messages) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return len(publisher.messages)
+
+    try:
+        standby.start()
+        with uow(file_session_factory) as work:
+            work.bookmarks.add_many([bookmark(i) for i in range(5)])
+        assert wait_for(first, 5) == 5
+        assert standby.stats()["owner"] == 0
+
+        # the standby takes over once the owner is gone
+        owner.stop()
+        with uow(file_session_factory) as work:
+            work.bookmarks.add_one(bookmark(5))
+        assert wait_for(second, 1) == 1
+        assert len(first.messages) == 5
+    finally:
+        owner.stop()
+        standby.stop()
@@ -0,0 +1,84 @@
+import pytest
+from barkylib.adapters import metrics, orm
+from barkylib.adapters.repository import SqlAlchemyRepository
+from barkylib.domain.models import Bookmark
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite:///:memory:")
+    orm.ensure_schema(engine)
+    metrics.instrument_engine(engine)
+    # instrumenting again doesn't double count
+    metrics.instrument_engine(engine)
+    metrics.REGISTRY.clear()
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def repo(engine):
+    repo = SqlAlchemyRepository(sessionmaker(bind=engine)())
+    yield repo
+    repo.Session.close()
+
+
+def test_queries_are_counted_by_shape(repo):
+    repo.add_rows([
+        {"title": str(i), "url": f"http://{i}.com", "notes": None, "date_added": None, "date_edited": None}
+        for i in range(3)
+    ])
+
+    with metrics.track_request() as request:
+        repo.find_rows(select(Bookmark))
+        repo.get_dict(1)
+    assert request[0] == 2
+    assert request[1] > 0
+
+    assert repo.delete_by_ids([1, 2]) == 2
+    assert metrics.DB_QUERIES.value("select bookmarks") == 2
+    assert metrics.DB_DURATION.count("select bookmarks") == 2
+    assert metrics.DB_ROWS_WRITTEN.value("insert bookmarks") == 3
+    assert metrics.DB_ROWS_WRITTEN.value("delete bookmarks") == 2
+    assert metrics.DB_ROWS_WRITTEN.value("select bookmarks") == 0
+    assert metrics.DB_ROWS_RETURNED.value("find_rows") == 3
+    assert metrics.DB_ROWS_RETURNED.value("get_dict") == 1
+
+    with pytest.raises(Exception):
+        repo.Session.connection().exec_driver_sql("SELECT * FROM missing")
+    repo.Session.rollback()
+    assert metrics.DB_ERRORS.value("select missing") == 1
+    assert 'barky_db_queries_total{shape="select bookmarks"} 2' in metrics.REGISTRY.render()
+
+
+def test_streamed_rows_are_counted_when_the_stream_stops(repo):
+    repo.add_rows([
+        {"title": str(i), "url": f"http://{i}.com", "notes": None, "date_added": None, "date_edited": None}
+        for i in range(5)
+    ])
+
+    rows = repo.stream_rows(select(Bookmark), batch_size=2)
+    next(rows)
+    next(rows)
+    rows.close()
+    assert len(list(repo.stream_all(None))) == 5
+
+    assert metrics.DB_ROWS_RETURNED.value("stream_rows") == 2
+    assert metrics.DB_ROWS_RETURNED.value("stream_all") == 5
+    assert 'barky_db_rows_returned_total{method="stream_all"} 5' in metrics.REGISTRY.render()
+
+
+def test_rows_are_not_counted_without_instrumentation(mappers):
+    engine = create_engine("sqlite:///:memory:")
+    orm.ensure_schema(engine)
+    metrics.REGISTRY.clear()
+    repo = SqlAlchemyRepository(sessionmaker(bind=engine)())
+    repo.find_rows(select(Bookmark))
+    repo.Session.close()
+    engine.dispose()
+
+    assert metrics.DB_ROWS_RETURNED.value("find_rows") == 0
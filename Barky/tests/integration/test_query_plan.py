@@ -0,0 +1,93 @@
+from datetime import datetime
+
+import pytest
+from barkylib.adapters import orm
+from barkylib.adapters.repository import SqlAlchemyRepository, encode_cursor
+from barkylib.services import handlers
+from sqlalchemy import event
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+FILTER_VALUES = {
+    'id': '1',
+    'title': '1',
+    'url': 'http://test1.com',
+    'date_added': '2023-08-12T00:00:00',
+    'date_edited': '2023-08-12T00:00:00',
+}
+
+
+def query_plans(engine, run):
+    """
+    Runs the callable, then asks sqlite for the plan of every SELECT it issued
+    """
+    statements = list()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        run()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    plans = list()
+    with engine.connect() as conn:
+        for statement, parameters in statements:
+            if statement.lstrip().upper().startswith("SELECT"):
+                rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+                plans.append([row[3] for row in rows])
+    return plans
+
+
+def assert_uses_indexes(plan, filtered, sort):
+    for step in plan:
+        if step.startswith("SCAN bookmarks"):
+            # reading everything in rowid order is the only scan we accept
+            assert "USING" in step or (not filtered and sort in (None, 'id')), plan
+    if filtered:
+        assert any(step.startswith("SEARCH bookmarks") for step in plan), plan
+    else:
+        assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+@pytest.mark.parametrize("sort", [None, *handlers.SORTS])
+@pytest.mark.parametrize("filter", [None, *handlers.FILTERS])
+def test_get_query_uses_indexes(in_memory_sqlite_db, sqlite_session_factory, filter, sort):
+    repo = SqlAlchemyRepository(sqlite_session_factory())
+    query = handlers.get_query(filter, FILTER_VALUES.get(filter), sort)
+
+    plans = query_plans(in_memory_sqlite_db, lambda: repo.find_all(query))
+
+    assert len(plans) == 1
+    assert_uses_indexes(plans[0], filter is not None, sort)
+
+
+@pytest.mark.parametrize("sort", handlers.SORTS)
+def test_find_page_uses_indexes(in_memory_sqlite_db, sqlite_session_factory, sort):
+    repo = SqlAlchemyRepository(sqlite_session_factory())
+    cursor = page_cursor(sort)
+
+    plans = query_plans(in_memory_sqlite_db, lambda: repo.find_page(None, after=cursor, limit=10, sort=sort))
+
+    assert len(plans) == 1
+    assert not any("TEMP B-TREE" in step for step in plans[0]), plans[0]
+    assert plans[0][0].startswith("SEARCH bookmarks"), plans[0]
+
+
+def test_create_indexes_upgrades_existing_database(in_memory_sqlite_db):
+    for index in orm.bookmarks.indexes:
+        index.drop(in_memory_sqlite_db)
+
+    orm.create_indexes(in_memory_sqlite_db)
+    orm.create_indexes(in_memory_sqlite_db)
+
+    with in_memory_sqlite_db.connect() as conn:
+        names = {row[1] for row in conn.exec_driver_sql("PRAGMA index_list(bookmarks)")}
+    assert {index.name for index in orm.bookmarks.indexes} <= names
+
+
+def page_cursor(sort):
+    value = datetime(2023, 8, 12) if sort.startswith('date') else ('1' if sort == 'title' else 1)
+    return encode_cursor(sort, value, 1)
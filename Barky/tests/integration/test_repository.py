@@ -1,9 +1,12 @@
 import pytest
 import json
 from datetime import datetime
-from barkylib.adapters.repository import SqlAlchemyRepository
+from barkylib.adapters import serializers
+from barkylib.adapters.cache import BookmarkCache
+from barkylib.adapters.memory import InMemoryRepository
+from barkylib.adapters.repository import CachingRepository, SqlAlchemyRepository
 from barkylib.domain.models import Bookmark
-from sqlalchemy import create_engine, select, update, delete
+from sqlalchemy import create_engine, delete, event, select, update
 
 pytestmark = pytest.mark.usefixtures("mappers")
 
@@ -47,6 +50,35 @@ def test_add(sqlite_session_factory):
     assert len(indexes) == len(bmarks)
 
 
+def test_add_many_bulk(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+
+    indexes = [str(i) for i in range(1, 8)]
+    bmarks = [constructBookmark(index) for index in indexes]
+    # giving one an explicit id to make sure the order of the ids is kept
+    bmarks[3].id = 100
+
+    ids = repo.add_many(bmarks, bulk=True, chunk_size=3)
+
+    assert len(ids) == len(indexes)
+    assert ids[3] == 100
+    for id, index in zip(ids, indexes):
+        assert repo.get(id).title == index
+
+
+def test_add_many_bulk_keeps_the_order_around_an_explicit_id(sqlite_session_factory):
+    repo = SqlAlchemyRepository(sqlite_session_factory())
+    bmarks = [constructBookmark(str(index)) for index in range(1, 8)]
+    bmarks[4].id = 100
+
+    ids = repo.add_many(bmarks, bulk=True, chunk_size=3)
+
+    # inserted in list order, so the generated ids follow it
+    assert ids == [1, 2, 3, 4, 100, 101, 102]
+    assert [repo.get(id).title for id in ids] == [bookmark.title for bookmark in bmarks]
+
+
 def test_find(sqlite_session_factory):
     session = sqlite_session_factory()
     repo = SqlAlchemyRepository(session)
@@ -93,6 +125,31 @@ def test_update(sqlite_session_factory):
         assert queried_bmarks[i].notes == bmarks[i].notes
 
 
+def test_update_many_reports_affected_rows(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+
+    indexes = ['1', '2', '3']
+    bmarks = create_multiple_bookmarks(repo, indexes)
+    missing = constructBookmark(4)
+    missing.id = 1000
+    # only the notes are changed on the first one, so it lands in its own group
+    changes = [
+        Bookmark(bmarks[0].id, None, None, 'only notes', None, None),
+        Bookmark(bmarks[1].id, 'new 2', 'http://new2.com', 'new notes', None, None),
+        missing,
+        Bookmark(bmarks[2].id, 'new 3', 'http://new3.com', 'new notes', None, None),
+    ]
+
+    assert repo.update_many(changes) == [1, 1, 0, 1]
+
+    first = repo.get(bmarks[0].id)
+    assert first.title == '1'
+    assert first.notes == 'only notes'
+    assert repo.get(bmarks[2].id).title == 'new 3'
+    assert repo.get(1000) is None
+
+
 def test_delete(sqlite_session_factory):
     session = sqlite_session_factory()
     repo = SqlAlchemyRepository(session)
@@ -115,6 +172,195 @@ def test_delete(sqlite_session_factory):
     assert len(queried_bmarks) == 0
 
 
+def test_delete_by_ids_is_chunked_and_counts_rows(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+    repo.add_many([constructBookmark(index) for index in range(2500)], bulk=True)
+    statements = list()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(session.get_bind(), "before_cursor_execute", listener)
+
+    # 2600 ids, with a repeat and 100 that don't exist
+    ids = list(range(1, 2501)) + ['7'] + list(range(5001, 5100))
+    assert repo.delete_by_ids(ids) == 2500
+    event.remove(session.get_bind(), "before_cursor_execute", listener)
+
+    # no select before the deletes, one statement per 999 ids
+    assert [statement.split()[0] for statement in statements] == ['DELETE'] * 3
+    assert repo.find_all(select(Bookmark)) == []
+    assert repo.delete_by_ids([]) == 0
+
+
+@pytest.mark.parametrize("id", [1.9, True, "1.0", None])
+def test_delete_by_ids_refuses_what_isnt_a_whole_number(sqlite_session_factory, id):
+    repo = SqlAlchemyRepository(sqlite_session_factory())
+    repo.add_many([constructBookmark(index) for index in range(2)], bulk=True)
+
+    with pytest.raises((ValueError, TypeError)):
+        repo.delete_by_ids([id])
+    assert repo.delete_by_ids([2.0]) == 1
+    assert len(repo.find_all(select(Bookmark))) == 1
+
+
+def test_upsert_many(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+    repo.add_many([constructBookmark(index) for index in range(3)], bulk=True)
+    rows = [upsertRow(index, url=f"http://new{index}.com") for index in range(1, 5)]
+    rows.append(upsertRow(4, notes="repeated"))
+
+    counts = repo.upsert_many(rows, chunk_size=2)
+
+    assert counts == {'inserted': 2, 'updated': 3, 'unchanged': 0}
+    bmarks = {b.title: b for b in repo.find_all(select(Bookmark))}
+    assert len(bmarks) == 5
+    assert bmarks['0'].url == "http://test0.com"
+    assert bmarks['1'].url == "http://new1.com"
+    assert bmarks['1'].notes is None
+    # date_added is kept, date_edited is when the change was made
+    assert bmarks['1'].date_added == datetime(2023, 8, 12)
+    assert bmarks['1'].date_edited > datetime(2023, 9, 1)
+    assert bmarks['4'].notes == "repeated"
+
+
+@pytest.mark.parametrize("memory", [False, True])
+def test_upsert_many_stamps_date_edited(sqlite_session_factory, memory):
+    repo = InMemoryRepository() if memory else SqlAlchemyRepository(sqlite_session_factory())
+    repo.add_rows([dict(upsertRow(1), date_added=datetime(2023, 1, 1), date_edited=datetime(2023, 6, 1))])
+    before = datetime.now()
+
+    # an imported record fills date_edited in from its date_added
+    old = dict(upsertRow(1, url="http://new.com"), date_added=datetime(2020, 1, 1), date_edited=datetime(2020, 1, 1))
+    assert repo.upsert_many([old])['updated'] == 1
+    assert repo.get_dict(1)['url'] == "http://new.com"
+    assert before <= repo.get(1).date_edited <= datetime.now()
+
+    # unless the caller asks for it
+    repo.upsert_many([dict(old, url="http://newer.com")], update_columns=['url', 'date_edited'])
+    assert repo.get(1).date_edited == datetime(2020, 1, 1)
+
+
+def test_upsert_many_again_writes_nothing(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+    rows = [upsertRow(index) for index in range(2000)]
+    assert repo.upsert_many(rows)['inserted'] == 2000
+
+    statements = list()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(session.get_bind(), "before_cursor_execute", listener)
+    counts = repo.upsert_many([upsertRow(index) for index in range(2000)])
+    event.remove(session.get_bind(), "before_cursor_execute", listener)
+
+    assert counts == {'inserted': 0, 'updated': 0, 'unchanged': 2000}
+    assert [statement.split()[0] for statement in statements] == ['SELECT'] * 3
+
+
+def test_upsert_many_update_columns(sqlite_session_factory):
+    repo = SqlAlchemyRepository(sqlite_session_factory())
+    repo.add_many([constructBookmark(1)], bulk=True)
+
+    counts = repo.upsert_many([upsertRow(1, url="http://other.com"), upsertRow(2)], update_columns=())
+    assert counts == {'inserted': 1, 'updated': 0, 'unchanged': 1}
+    assert repo.find_first(select(Bookmark).where(Bookmark.title == '1')).url == "http://test1.com"
+
+    assert repo.upsert_many([upsertRow(1, notes="only notes")], update_columns=['notes'])['updated'] == 1
+    assert repo.find_first(select(Bookmark).where(Bookmark.title == '1')).url == "http://test1.com"
+
+    with pytest.raises(ValueError):
+        repo.upsert_many([upsertRow(1)], update_columns=['title'])
+
+
+def test_find_page(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+    bmarks = [constructBookmark(i) for i in range(1, 8)]
+    # same dates on purpose so the id has to break the ties, and a couple of NULLs
+    for i, bookmark in enumerate(bmarks):
+        bookmark.date_added = None if i in (2, 5) else datetime(2023, 8, 12 + i % 2)
+    repo.add_many(bmarks)
+
+    expected = repo.find_all(select(Bookmark).order_by(Bookmark.date_added, Bookmark.id))
+    paged, after = list(), None
+    while True:
+        page, after = repo.find_page(None, after=after, limit=3, sort='date_added')
+        paged.extend(page)
+        if after is None:
+            break
+
+    assert [b.id for b in paged] == [b.id for b in expected]
+
+    with pytest.raises(ValueError):
+        repo.find_page(None, after='not a cursor', sort='title')
+
+
+def test_find_rows_serialize_like_to_json(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+    bmarks = [constructBookmark(1), constructBookmark(2)]
+    bmarks[1].date_edited = datetime(2023, 8, 12, 10, 30, 5, 1234)
+    bmarks[1].notes = None
+    repo.add_many(bmarks)
+
+    query = select(Bookmark).order_by(Bookmark.title)
+    expected = [json.loads(bookmark.to_json()) for bookmark in repo.find_all(query)]
+
+    assert [serializers.row_to_dict(row) for row in repo.find_rows(query)] == expected
+    assert json.loads(serializers.rows_to_json(repo.find_rows(query))) == expected
+    assert repo.get_dict(expected[1]['id']) == expected[1]
+
+
+def test_search(sqlite_session_factory):
+    session = sqlite_session_factory()
+    repo = SqlAlchemyRepository(session)
+    python = Bookmark(None, 'Python docs', 'http://docs.python.org', 'the reference', datetime(2023, 8, 12), datetime(2023, 8, 12))
+    notes = Bookmark(None, 'Notes', 'http://notes.com', 'mentions python once', datetime(2023, 8, 12), datetime(2023, 8, 12))
+    other = Bookmark(None, 'Other', 'http://other.com', None, datetime(2023, 8, 12), datetime(2023, 8, 12))
+    repo.add_many([notes, python, other])
+
+    assert repo.search('pyth') == []
+    results = repo.search('pyth*')
+    # a title match ranks above a match in the notes
+    assert [r['title'] for r in results] == ['Python docs', 'Notes']
+    assert results[0]['snippet'] == '<mark>Python</mark> docs'
+    assert repo.search('python reference')[0]['title'] == 'Python docs'
+    assert repo.search('"); DROP') == []
+    assert repo.search('') == []
+
+    # the triggers keep the index in step with updates and deletes
+    repo.update(Bookmark(other.id, None, None, 'now about python', None, None))
+    assert len(repo.search('python')) == 3
+    repo.delete_one(python)
+    assert len(repo.search('python')) == 2
+    assert len(repo.search('python', limit=1, offset=1)) == 1
+
+
+def test_caching_repository(sqlite_session_factory):
+    cache = BookmarkCache()
+    repo = CachingRepository(SqlAlchemyRepository(sqlite_session_factory()), cache)
+    bmarks = create_multiple_bookmarks(repo, ['1', '2'])
+
+    assert repo.get_dict(bmarks[0].id)['title'] == '1'
+    assert repo.get_dict(bmarks[0].id)['title'] == '1'
+    assert cache.stats()['hits'] == 1
+
+    # a write drops the cached copy so the next read sees it
+    repo.update(Bookmark(bmarks[0].id, 'changed', None, None, None, None))
+    assert repo.get_dict(bmarks[0].id)['title'] == 'changed'
+
+    repo.get_dict(bmarks[1].id)
+    repo.delete_one(bmarks[1])
+    assert repo.get_dict(bmarks[1].id) is None
+
+    repo.get_dict(bmarks[0].id)
+    assert repo.upsert_many([upsertRow("changed", url="http://upserted.com")])["updated"] == 1
+    assert repo.get_dict(bmarks[0].id)['url'] == "http://upserted.com"
+
+    repo.get_dict(bmarks[0].id)
+    assert repo.delete_by_ids([bmarks[0].id, 1000]) == 1
+    assert repo.get_dict(bmarks[0].id) is None
+
+
 def create_multiple_bookmarks(repo, indexes) -> list[Bookmark]:
     bmarks = list()
     indexes_as_str = list()
@@ -144,3 +390,13 @@ def constructBookmark(index) -> Bookmark:
         date_added=datetime(2023, 8, 12),
         date_edited=datetime(2023, 8, 12)
     )
+
+
+def upsertRow(index, url=None, notes=None) -> dict:
+    return {
+        'title': str(index),
+        'url': url or f"http://test{index}.com",
+        'notes': notes,
+        'date_added': datetime(2023, 9, 1),
+        'date_edited': datetime(2023, 9, 1),
+    }
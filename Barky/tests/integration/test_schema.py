@@ -0,0 +1,49 @@
+from barkylib.adapters import orm
+from sqlalchemy import create_engine, event
+
+
+def user_version(engine):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def test_new_database_gets_every_migration():
+    engine = create_engine("sqlite:///:memory:")
+
+    orm.ensure_schema(engine)
+
+    assert user_version(engine) == orm.SCHEMA_VERSION
+    with engine.connect() as conn:
+        tables = {row[0] for row in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {"bookmarks", "bookmarks_fts"} <= tables
+
+
+def test_database_from_before_versioning_is_upgraded_in_place():
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE bookmarks (id INTEGER PRIMARY KEY, title VARCHAR(255) UNIQUE, "
+                             "url VARCHAR(255), notes TEXT, date_added DATETIME, date_edited DATETIME)")
+        conn.exec_driver_sql("INSERT INTO bookmarks (title, url) VALUES ('old', 'http://old.com')")
+
+    orm.ensure_schema(engine)
+
+    assert user_version(engine) == orm.SCHEMA_VERSION
+    with engine.connect() as conn:
+        indexes = {row[1] for row in conn.exec_driver_sql("PRAGMA index_list(bookmarks)")}
+        found = conn.exec_driver_sql("SELECT rowid FROM bookmarks_fts WHERE bookmarks_fts MATCH 'old'").all()
+    assert {index.name for index in orm.bookmarks.indexes} <= indexes
+    assert len(found) == 1
+
+
+def test_schema_is_only_checked_once_per_engine():
+    engine = create_engine("sqlite:///:memory:")
+    statements = list()
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+
+    orm.ensure_schema(engine)
+    first = len(statements)
+    orm.ensure_schema(engine)
+    orm.ensure_schema(engine)
+
+    assert first > 0
+    assert len(statements) == first
@@ -0,0 +1,84 @@
+import logging
+from datetime import datetime
+
+import pytest
+from barkylib.adapters import query_log
+from barkylib.domain.models import Bookmark
+from barkylib.services import handlers, unit_of_work
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+
+def uow(sqlite_session_factory, **settings):
+    settings = dict(dict(enabled=True, slow_ms=None, repeat_limit=3, strict=False), **settings)
+    return unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory, query_log=settings)
+
+
+def add_bookmarks(sqlite_session_factory, count):
+    handlers.add_bookmark(
+        uow=uow(sqlite_session_factory),
+        bookmarks=[
+            Bookmark(id=None, title=str(i), url=f"http://{i}.com", notes=None,
+                     date_added=datetime(2023, 1, 1), date_edited=datetime(2023, 1, 1))
+            for i in range(count)
+        ],
+    )
+
+
+def test_records_the_statements_of_one_unit_of_work(sqlite_session_factory):
+    add_bookmarks(sqlite_session_factory, 2)
+    work = uow(sqlite_session_factory)
+    with work:
+        work.bookmarks.get(1)
+        work.bookmarks.get(2)
+        outside = query_log.current()
+
+    assert outside is work.recorder
+    assert query_log.current() is None
+    assert len(work.recorder.statements) == 2
+    assert work.recorder.repeated() == {}
+
+
+def test_strict_mode_fails_on_a_query_per_row(sqlite_session_factory):
+    add_bookmarks(sqlite_session_factory, 5)
+
+    with pytest.raises(query_log.RepeatedStatementsError) as error:
+        work = uow(sqlite_session_factory, strict=True)
+        with work:
+            for id in range(1, 6):
+                work.bookmarks.get(id)
+
+    assert "5 x select bookmarks" in str(error.value)
+    assert "test_statement_recording.test_strict_mode_fails_on_a_query_per_row" in str(error.value)
+
+
+def test_slow_statements_name_the_handler(sqlite_session_factory, caplog):
+    add_bookmarks(sqlite_session_factory, 1)
+
+    with caplog.at_level(logging.WARNING, logger="barkylib.adapters.query_log"):
+        handlers.list_bookmark(1, uow(sqlite_session_factory, slow_ms=0))
+
+    assert "barkylib.services.handlers.list_bookmark" in caplog.text
+    assert "FROM bookmarks" in caplog.text
+
+
+def test_recording_is_off_by_default(sqlite_session_factory, monkeypatch):
+    monkeypatch.delenv("BARKY_QUERY_LOG", raising=False)
+    monkeypatch.delenv("BARKY_QUERY_STRICT", raising=False)
+    work = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    with work:
+        work.bookmarks.get(1)
+    assert work.recorder is None
+
+
+def test_strict_mode_passes_a_chunked_import(sqlite_session_factory):
+    records = [
+        (line, dict(title=str(line), url=f"http://{line}.com", notes=None))
+        for line in range(120)
+    ]
+
+    work = uow(sqlite_session_factory, strict=True)
+    report = handlers.import_bookmarks(records, uow=work, chunk_size=10)
+
+    assert report["imported"] == 120
+    assert work.recorder.commits == 0
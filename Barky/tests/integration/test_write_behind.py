@@ -0,0 +1,208 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+from barkylib.adapters import orm
+from barkylib.adapters.journal import Journal
+from barkylib.domain.models import Bookmark
+from barkylib.services import handlers, unit_of_work
+from barkylib.services.write_behind import WriteBehindWriter
+from sqlalchemy import func, select
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+
+@pytest.fixture
+def make_writer(file_session_factory, tmp_path):
+    writers = list()
+
+    def make(**kwargs):
+        kwargs = dict(dict(max_rows=100, max_delay_ms=20), **kwargs)
+        writer = WriteBehindWriter(
+            lambda: unit_of_work.SqlAlchemyUnitOfWork(file_session_factory), str(tmp_path / "journal"), **kwargs
+        )
+        writers.append(writer)
+        return writer
+
+    yield make
+    for writer in writers:
+        writer.close()
+
+
+def row(i):
+    return dict(title=f"title {i}", url=f"http://{i}.com", notes=None,
+                date_added=datetime(2023, 1, 1), date_edited=datetime(2023, 1, 1))
+
+
+def count(file_session_factory):
+    with file_session_factory() as session:
+        return session.scalar(select(func.count()).select_from(orm.bookmarks))
+
+
+def test_journal_reads_back_what_was_appended(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.append([row(1), row(2)])
+    journal.append([row(3)])
+    number = journal.seal()
+
+    assert journal.segments() == [number]
+    assert list(journal.read(number)) == [row(1), row(2), row(3)]
+    journal.remove(number)
+    assert journal.segments() == []
+
+
+def test_journal_skips_a_partial_last_line(tmp_path):
+    journal = Journal(str(tmp_path))
+    journal.append([row(1)])
+    number = journal.seal()
+    with open(journal.path(number), "ab") as file:
+        file.write(b'{"title": "title 2", "url"')
+
+    assert list(journal.read(number)) == [row(1)]
+    journal.close()
+    # a new journal on the directory starts after the segments in it
+    assert Journal(str(tmp_path)).number == number + 1
+
+
+def test_journal_directory_belongs_to_one_process(tmp_path):
+    journal = Journal(str(tmp_path))
+    with pytest.raises(RuntimeError):
+        Journal(str(tmp_path))
+    journal.close()
+    Journal(str(tmp_path)).close()
+
+
+def test_flushes_when_the_buffer_has_max_rows(make_writer, file_session_factory):
+    writer = make_writer(max_rows=10, max_delay_ms=60_000).start()
+    writer.add([row(i) for i in range(10)])
+
+    assert writer.flush(timeout=5)
+    assert count(file_session_factory) == 10
+    assert writer.stats()["flushes"] == 1
+
+
+def test_flushes_after_max_delay(make_writer, file_session_factory):
+    writer = make_writer(max_rows=1000, max_delay_ms=10).start()
+    writer.add([row(1)])
+
+    with writer._condition:
+        assert writer._condition.wait_for(lambda: writer.written == 1, timeout=5)
+    assert count(file_session_factory) == 1
+    assert writer.depth == 0
+    assert writer.journal.segments() == []
+
+
+def test_adds_through_the_unit_of_work_are_acknowledged_before_they_are_written(make_writer, file_session_factory):
+    writer = make_writer(max_delay_ms=60_000).start()
+    ids = handlers.add_bookmark(
+        uow=unit_of_work.WriteBehindUnitOfWork(writer, unit_of_work.SqlAlchemyUnitOfWork(file_session_factory)),
+        bookmarks=[Bookmark(id=None, title=f"title {i}", url=f"http://{i}.com", notes=None,
+                            date_added=None, date_edited=None) for i in range(5)],
+    )
+
+    assert ids == [None] * 5
+    assert writer.depth == 5
+    assert count(file_session_factory) == 0
+
+    # reads go to the database, writes other than adds flush the buffer first
+    uow = unit_of_work.WriteBehindUnitOfWork(writer, unit_of_work.SqlAlchemyUnitOfWork(file_session_factory))
+    with uow:
+        assert uow.bookmarks.delete_by_ids([1]) == 1
+    assert count(file_session_factory) == 4
+
+
+def test_rejects_rows_without_a_title(make_writer):
+    writer = make_writer()
+    with pytest.raises(ValueError):
+        writer.add([dict(row(1), title=None)])
+    assert writer.depth == 0
+
+
+def test_normalises_rows_like_an_import(make_writer, file_session_factory):
+    writer = make_writer().start()
+    with pytest.raises(ValueError):
+        writer.add([row(1), dict(row(2), date_added="yesterday")])
+    writer.add([dict(row(1), title=" title 1 ", date_added="2023-02-01T10:00:00", date_edited=None)])
+
+    assert writer.flush(timeout=5)
+    with file_session_factory() as session:
+        bookmark = session.scalars(select(Bookmark)).one()
+    assert bookmark.title == "title 1"
+    assert bookmark.date_added == bookmark.date_edited == datetime(2023, 2, 1, 10)
+
+
+def test_dead_letters_the_rows_a_batch_fails_on(make_writer, file_session_factory, tmp_path):
+    # left by a version that didn't check rows, the database can't take a number for a date
+    journal = Journal(str(tmp_path / "journal"))
+    journal.append([row(1), dict(row(2), date_added=5), row(3), row(4)])
+    journal.close()
+
+    writer = make_writer().start()
+
+    assert count(file_session_factory) == 3
+    assert writer.stats()["dead_lettered"] == 1
+    assert writer.journal.segments() == []
+    with open(tmp_path / "journal" / "dead-letters.ndjson") as file:
+        dead = [json.loads(line) for line in file]
+    assert [letter["row"]["title"] for letter in dead] == ["title 2"]
+    assert "datetime" in dead[0]["error"]
+
+
+def test_writes_wait_for_the_buffer_for_so_long(make_writer, file_session_factory):
+    # not started, nothing writes the buffer
+    writer = make_writer(flush_timeout_ms=20)
+    writer.add([row(1)])
+
+    uow = unit_of_work.WriteBehindUnitOfWork(writer, unit_of_work.SqlAlchemyUnitOfWork(file_session_factory))
+    with pytest.raises(TimeoutError):
+        with uow:
+            uow.bookmarks.delete_by_ids([1])
+
+
+def test_replays_the_journal_left_by_a_crash(make_writer, file_session_factory, tmp_path):
+    # a process that died with rows journaled, one batch of them already in the database
+    journal = Journal(str(tmp_path / "journal"))
+    journal.append([row(i) for i in range(3)])
+    journal.seal()
+    journal.append([row(i) for i in range(3, 6)])
+    journal.close()
+    with unit_of_work.SqlAlchemyUnitOfWork(file_session_factory) as uow:
+        uow.bookmarks.add_rows([row(i) for i in range(3)])
+
+    writer = make_writer().start()
+
+    assert count(file_session_factory) == 6
+    assert writer.journal.segments() == []
+    assert writer.stats()["replayed"] == 6
+    assert writer.stats()["skipped"] == 3
+    assert writer.flush(timeout=0)
+
+
+def test_keeps_a_failed_batch_and_retries_it(make_writer, file_session_factory, tmp_path):
+    failures = [RuntimeError("database is down")]
+
+    def flaky():
+        if failures:
+            raise failures.pop()
+        return unit_of_work.SqlAlchemyUnitOfWork(file_session_factory)
+
+    writer = make_writer(max_delay_ms=5)
+    writer.uow_factory = flaky
+    writer.start()
+    writer.add([row(1), row(2)])
+
+    assert writer.flush(timeout=5)
+    assert count(file_session_factory) == 2
+    assert writer.stats()["errors"] == 1
+    assert os.listdir(tmp_path / "journal") == []
+
+
+def test_close_writes_out_the_buffer(make_writer, file_session_factory):
+    writer = make_writer(max_delay_ms=60_000).start()
+    writer.add([row(i) for i in range(3)])
+    writer.close()
+
+    assert count(file_session_factory) == 3
+    with pytest.raises(RuntimeError):
+        writer.add([row(4)])
@@ -0,0 +1,82 @@
+import pytest
+
+from barkylib.adapters.cache import BookmarkCache
+from barkylib.domain import events
+from barkylib.services import handlers
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_cache_counts_hits_and_misses():
+    cache = BookmarkCache(max_size=10, ttl=60)
+
+    assert cache.get(1) is None
+    cache.put(1, {"id": 1, "title": "one"})
+
+    assert cache.get(1)["title"] == "one"
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_evicts_least_recently_used():
+    cache = BookmarkCache(max_size=2, ttl=60)
+    cache.put(1, {"id": 1})
+    cache.put(2, {"id": 2})
+    # touching 1 makes 2 the least recently used
+    cache.get(1)
+    cache.put(3, {"id": 3})
+
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+    assert cache.get(3) is not None
+    assert cache.evictions == 1
+
+
+def test_cache_entries_expire():
+    clock = FakeClock()
+    cache = BookmarkCache(max_size=10, ttl=5, clock=clock)
+    cache.put(1, {"id": 1})
+
+    clock.now = 4.9
+    assert cache.get(1) is not None
+    clock.now = 5.0
+    assert cache.get(1) is None
+    assert cache.expirations == 1
+
+
+def test_cache_hands_out_copies():
+    cache = BookmarkCache()
+    cache.put(1, {"id": 1, "title": "one"})
+    cache.get(1)["title"] = "changed"
+
+    assert cache.get(1)["title"] == "one"
+
+
+def test_events_invalidate_cached_bookmarks():
+    cache = BookmarkCache()
+    cache.put(1, {"id": 1})
+    cache.put(2, {"id": 2})
+
+    handlers.invalidate_cached_bookmark(events.BookmarkEdited(1, "t", "u", "d"), cache=cache)
+    handlers.invalidate_cached_bookmark(events.BookmarkDeleted({"id": 2}), cache=cache)
+
+    assert len(cache) == 0
+    assert cache.invalidations == 2
+
+
+def test_cache_drops_a_read_that_raced_an_invalidation():
+    cache = BookmarkCache()
+    version = cache.version()
+    # an update commits and invalidates between the miss's read and its put
+    cache.invalidate(1)
+    cache.put(1, {"id": 1, "title": "stale"}, version)
+
+    assert cache.get(1) is None
+    cache.put(1, {"id": 1, "title": "fresh"}, cache.version())
+    assert cache.get(1)["title"] == "fresh"
@@ -0,0 +1,149 @@
+import queue
+import threading
+import time
+
+import pytest
+from barkylib import bootstrap
+from barkylib.adapters.cache import BookmarkCache
+from barkylib.domain import events
+from barkylib.services import dispatch, handlers, messagebus, unit_of_work
+
+
+def edited(id):
+    return events.BookmarkEdited(id=id, title="Edited", url="http://edited.com", date_edited="2023-08-12")
+
+
+def square_id(event):
+    # module level so the process pool can pickle it
+    return event.id ** 2
+
+
+def test_handlers_run_on_workers():
+    threads = set()
+
+    def record(event):
+        threads.add(threading.current_thread().name)
+
+    dispatcher = dispatch.EventDispatcher({events.BookmarkEdited: [record]}, workers=2)
+    for id in range(10):
+        dispatcher.submit(edited(id))
+    dispatcher.join()
+    stats = dispatcher.stats()
+    dispatcher.shutdown()
+
+    assert threads and all(name.startswith("event-dispatch-") for name in threads)
+    assert stats["submitted"] == stats["handled"] == 10
+    assert stats["queue_depth"] == 0
+    assert stats["handlers"]["record"]["calls"] == 10
+    assert stats["handlers"]["record"]["errors"] == 0
+
+
+def test_full_queue_pushes_back():
+    release = threading.Event()
+    dispatcher = dispatch.EventDispatcher(
+        {events.BookmarkEdited: [lambda event: release.wait()]},
+        workers=1,
+        max_queue=1,
+        submit_timeout=0.05,
+    )
+    dispatcher.submit(edited(1))
+    # the worker picks the first one up, so one more fits in the queue
+    time.sleep(0.05)
+    dispatcher.submit(edited(2))
+
+    with pytest.raises(queue.Full):
+        dispatcher.submit(edited(3))
+
+    release.set()
+    dispatcher.shutdown()
+    assert dispatcher.stats()["rejected"] == 1
+    assert dispatcher.stats()["handled"] == 2
+
+
+def test_handler_limits():
+    lock = threading.Lock()
+    running = {"now": 0, "max": 0}
+
+    def slow(event):
+        with lock:
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+        time.sleep(0.01)
+        with lock:
+            running["now"] -= 1
+
+    dispatcher = dispatch.EventDispatcher({events.BookmarkEdited: [slow]}, workers=4, handler_limits={"slow": 1})
+    for id in range(8):
+        dispatcher.submit(edited(id))
+    dispatcher.shutdown()
+
+    assert running["max"] == 1
+    assert dispatcher.stats()["handlers"]["slow"]["calls"] == 8
+
+
+def test_shutdown_drains_the_queue():
+    handled = list()
+
+    def slow(event):
+        time.sleep(0.005)
+        handled.append(event.id)
+
+    dispatcher = dispatch.EventDispatcher({events.BookmarkEdited: [slow]}, workers=1)
+    for id in range(20):
+        dispatcher.submit(edited(id))
+
+    assert dispatcher.shutdown(drain=True)
+    assert handled == list(range(20))
+    with pytest.raises(RuntimeError):
+        dispatcher.submit(edited(21))
+
+
+def test_failing_handler_is_counted():
+    def broken(event):
+        raise ValueError("broken")
+
+    dispatcher = dispatch.EventDispatcher({events.BookmarkEdited: [broken]}, workers=1)
+    dispatcher.submit(edited(1))
+    dispatcher.shutdown()
+
+    assert dispatcher.stats()["handlers"]["broken"]["errors"] == 1
+    assert dispatcher.stats()["handled"] == 1
+
+
+def test_process_executor_through_bootstrap(monkeypatch):
+    cache = BookmarkCache()
+    cache.put(1, {"id": 1})
+    monkeypatch.setitem(
+        handlers.EVENT_HANDLERS, events.BookmarkEdited, [handlers.invalidate_cached_bookmark, square_id]
+    )
+    bus = bootstrap.bootstrap(
+        start_orm=False,
+        uow=unit_of_work.InMemoryUnitOfWork(),
+        cache=cache,
+        dispatch_settings=dict(workers=2, executor="process"),
+    )
+    dispatcher = bus.dispatcher
+    for id in range(1, 5):
+        bus.handle(edited(id))
+    dispatcher.shutdown()
+    stats = dispatcher.stats()["handlers"]
+
+    # the cache bound handler ran here, on a thread, so it cleared this cache
+    assert cache.get(1) is None
+    assert [handler.__name__ for handler in dispatcher.pooled] == ["square_id"]
+    assert stats["invalidate_cached_bookmark"] == dict(stats["invalidate_cached_bookmark"], calls=4, errors=0)
+    assert stats["square_id"] == dict(stats["square_id"], calls=4, errors=0)
+
+
+def test_message_bus_queues_events():
+    cache = BookmarkCache()
+    cache.put(1, {"id": 1})
+    invalidate = lambda event: cache.invalidate(event.id)
+    dispatcher = dispatch.EventDispatcher({events.BookmarkEdited: [invalidate]}, workers=1)
+    bus = messagebus.MessageBus(uow=None, event_handlers={}, command_handlers={}, dispatcher=dispatcher)
+
+    bus.handle(edited(1))
+    dispatcher.join()
+    dispatcher.shutdown()
+
+    assert cache.get(1) is None
@@ -0,0 +1,73 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+
+import pytest
+from barkylib.adapters import exporters
+
+ROWS = [
+    (1, "One", "http://one.com", "first, with a comma", "2023-08-12 10:30:00.000000", "2023-08-12 10:30:00.500000"),
+    (2, "Two", "http://two.com", None, datetime(2023, 8, 13), datetime(2023, 8, 13, 9)),
+    (3, "Three", "http://three.com", "line\nbreak", "2023-08-14 00:00:00.000000", "2023-08-14 00:00:00.000000"),
+]
+
+
+def export(format, rows=ROWS, rows_per_chunk=2):
+    return b"".join(exporters.write(iter(rows), format, rows_per_chunk))
+
+
+def test_ndjson():
+    lines = export("ndjson").decode().splitlines()
+
+    assert [json.loads(line)["id"] for line in lines] == [1, 2, 3]
+    assert json.loads(lines[0])["date_added"] == "2023-08-12 10:30:00"
+    assert json.loads(lines[1])["date_edited"] == "2023-08-13 09:00:00"
+
+
+def test_csv():
+    rows = list(csv.DictReader(io.StringIO(export("csv").decode())))
+
+    assert [row["title"] for row in rows] == ["One", "Two", "Three"]
+    assert rows[0]["notes"] == "first, with a comma"
+    assert rows[1]["notes"] == ""
+    assert rows[2]["notes"] == "line\nbreak"
+    assert rows[0]["date_edited"] == "2023-08-12 10:30:00.500000"
+
+
+def test_columnar():
+    header, *blocks = [json.loads(line) for line in export("columnar").decode().splitlines()]
+
+    assert header["columns"] == ["id", "title", "url", "notes", "date_added", "date_edited"]
+    assert [block["id"] for block in blocks] == [[1, 2], [3]]
+    assert blocks[0]["date_added"] == ["2023-08-12 10:30:00", "2023-08-13 00:00:00"]
+
+
+@pytest.mark.parametrize("format", exporters.FORMATS)
+def test_chunks_hold_at_most_rows_per_chunk(format):
+    rows = [(id, str(id), f"http://{id}.com", None, None, None) for id in range(10)]
+    chunks = list(exporters.write(iter(rows), format, rows_per_chunk=4))
+
+    # a header line (csv writes it with the first chunk), then 4 + 4 + 2 rows
+    assert len(chunks) == (4 if format == "columnar" else 3)
+
+
+def test_empty_export():
+    assert export("ndjson", rows=[]) == b""
+    assert export("csv", rows=[]) == b"id,title,url,notes,date_added,date_edited\r\n"
+
+
+def test_gzip_chunks():
+    chunks = [b"a" * 1000, b"b" * 1000, b""]
+    assert gzip.decompress(b"".join(exporters.gzip_chunks(chunks))) == b"a" * 1000 + b"b" * 1000
+
+
+def test_detect_format():
+    assert exporters.detect_format("csv") == ("csv", False)
+    assert exporters.detect_format(filename="backup.ndjson") == ("ndjson", False)
+    assert exporters.detect_format(filename="backup.CSV.gz") == ("csv", True)
+    assert exporters.detect_format(filename="backup.columnar.jsonl.gz") == ("columnar", True)
+    assert exporters.detect_format(filename="backup.jsonl") == ("ndjson", False)
+    with pytest.raises(ValueError):
+        exporters.detect_format(filename="backup.txt")
@@ -0,0 +1,48 @@
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parents[2] / "src"
+# generous for slow CI machines, a regression back to building the bus and
+# engines at import costs more than this on its own
+BUDGET_MS = float(os.environ.get("BARKY_IMPORT_BUDGET_MS", 1000))
+
+
+def import_times(module, cwd):
+    """
+    Imports module in a fresh interpreter with -X importtime and returns the
+    cumulative microseconds of every module it imported
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd,
+        env=dict(os.environ, PYTHONPATH=str(SRC)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = dict()
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)", line)
+        if match:
+            times[match.group(2)] = int(match.group(1))
+    return times
+
+
+def test_import_api_is_fast_and_side_effect_free(tmp_path):
+    # the default database url is ../bookmarks.db, relative to the working directory
+    cwd = tmp_path / "cwd"
+    cwd.mkdir()
+
+    times = import_times("barkylib.api", cwd)
+
+    assert times["barkylib.api"] / 1000 < BUDGET_MS, times["barkylib.api"]
+    assert list(tmp_path.iterdir()) == [cwd]
+    assert list(cwd.iterdir()) == []
+    # the async driver loads only when the asyncio stack is used
+    assert "aiosqlite" not in times
+    assert "sqlalchemy.ext.asyncio" not in times
+    # and the redis client only when the outbox publishes to redis
+    assert "redis" not in times
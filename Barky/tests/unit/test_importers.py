@@ -0,0 +1,92 @@
+import io
+from datetime import datetime
+
+import pytest
+from barkylib.adapters import importers
+
+NOW = datetime(2023, 8, 12)
+
+NETSCAPE = b"""<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">
+<TITLE>Bookmarks</TITLE>
+<DL><p>
+    <DT><H3 ADD_DATE="1691800000">Folder</H3>
+    <DL><p>
+        <DT><A HREF="http://one.com" ADD_DATE="1691800000" LAST_MODIFIED="1691900000">One &amp; only</A>
+        <DD>First notes
+        <DT><A HREF="http://two.com" ADD_DATE="1691800000">Two</A>
+    </DL><p>
+</DL><p>
+"""
+
+
+def records(data, format):
+    return list(importers.read_records(io.BytesIO(data), format))
+
+
+def test_read_ndjson():
+    data = b'{"title": "One", "url": "http://one.com"}\n\nnot json\n[1]\n{"title": "Two", "url": "http://two.com"}'
+    result = records(data, 'ndjson')
+
+    assert [line for line, _ in result] == [1, 3, 4, 5]
+    assert result[0][1] == {"title": "One", "url": "http://one.com"}
+    assert isinstance(result[1][1], ValueError)
+    assert isinstance(result[2][1], ValueError)
+    assert result[3][1]["title"] == "Two"
+
+
+def test_read_csv():
+    data = '﻿title,url,notes\nOne,http://one.com,"two\nlines"\nTwo,http://two.com,,extra\n'.encode()
+    result = records(data, 'csv')
+
+    assert result == [
+        (3, {"title": "One", "url": "http://one.com", "notes": "two\nlines"}),
+        (4, {"title": "Two", "url": "http://two.com", "notes": ""}),
+    ]
+
+
+def test_read_netscape():
+    result = records(NETSCAPE, 'html')
+
+    assert [line for line, _ in result] == [7, 9]
+    assert result[0][1] == {
+        "title": "One & only",
+        "url": "http://one.com",
+        "date_added": "1691800000",
+        "date_edited": "1691900000",
+        "notes": "First notes",
+    }
+    assert result[1][1]["title"] == "Two" and "notes" not in result[1][1]
+
+
+def test_to_bookmark():
+    bookmark = importers.to_bookmark(
+        {"id": 7, "title": " One ", "url": "http://one.com", "notes": "", "date_added": "1691800000"}, NOW
+    )
+
+    assert bookmark.id is None
+    assert bookmark.title == "One"
+    assert bookmark.notes is None
+    assert bookmark.date_added == datetime.fromtimestamp(1691800000)
+    assert bookmark.date_edited == bookmark.date_added
+    assert importers.to_bookmark({"title": "x", "url": "http://x.com"}, NOW).date_added == NOW
+
+
+@pytest.mark.parametrize("record", [
+    {"url": "http://one.com"},
+    {"title": "One"},
+    {"title": "One", "url": "one.com"},
+    {"title": "x" * 256, "url": "http://one.com"},
+    {"title": "One", "url": "http://one.com", "date_added": "yesterday"},
+])
+def test_to_bookmark_rejects(record):
+    with pytest.raises(ValueError):
+        importers.to_bookmark(record, NOW)
+
+
+def test_detect_format():
+    assert importers.detect_format("csv", "text/html") == "csv"
+    assert importers.detect_format(content_type="application/x-ndjson; charset=utf-8") == "ndjson"
+    assert importers.detect_format(filename="Bookmarks.HTML") == "html"
+    with pytest.raises(ValueError):
+        importers.detect_format(filename="bookmarks")
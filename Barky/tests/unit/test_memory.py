@@ -0,0 +1,93 @@
+from datetime import datetime
+
+import pytest
+from barkylib.adapters.memory import BookmarkTable, InMemoryRepository
+from barkylib.domain.models import Bookmark
+from barkylib.services import handlers, unit_of_work
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+pytestmark = pytest.mark.usefixtures("mappers")
+
+
+def bookmark(title, id=None, day=1):
+    return Bookmark(id=id, title=title, url=f"http://{title}.com", notes=f"notes on {title}",
+                    date_added=datetime(2023, 1, day), date_edited=datetime(2023, 1, day))
+
+
+def test_handlers_on_the_in_memory_unit_of_work():
+    uow = unit_of_work.InMemoryUnitOfWork()
+    assert handlers.add_bookmark(uow, bookmarks=[bookmark('b', day=2), bookmark('a', day=3), bookmark('c', day=1)]) == [1, 2, 3]
+
+    assert [b['title'] for b in handlers.list_all_bookmarks(None, None, 'title', uow)] == ['a', 'b', 'c']
+    assert [b['title'] for b in handlers.list_all_bookmarks(None, None, 'date_added', uow)] == ['c', 'b', 'a']
+    assert handlers.list_bookmark(2, uow)['title'] == 'a'
+
+    handlers.edit_bookmark(uow, bookmark=Bookmark(id=2, title='z', url=None, notes=None, date_added=None, date_edited=None))
+    assert handlers.list_all_bookmarks('title', 'z', None, uow)[0]['id'] == 2
+    assert handlers.list_all_bookmarks('title', 'a', None, uow) == []
+
+    assert handlers.delete_bookmarks([1, 7], uow) == 1
+    page = handlers.list_bookmarks_page(None, None, 'title', None, 1, uow)
+    assert [b['title'] for b in page['bookmarks']] == ['c']
+    page = handlers.list_bookmarks_page(None, None, 'title', page['next'], 1, uow)
+    assert [b['title'] for b in page['bookmarks']] == ['z'] and page['next'] is None
+
+    results = handlers.search_bookmarks('notes', 10, 0, uow)['results']
+    assert [result['id'] for result in results] == [2, 3]
+    assert '<mark>notes</mark>' in results[0]['snippet']
+
+    # a new unit of work on the same table sees the same bookmarks
+    assert len(handlers.list_all_bookmarks(None, None, None, unit_of_work.InMemoryUnitOfWork(uow.table))) == 2
+
+
+def test_constraints():
+    repo = InMemoryRepository()
+    repo.add_one(bookmark('a'))
+    repo.add_one(bookmark('b'))
+
+    with pytest.raises(IntegrityError):
+        repo.add_many([bookmark('c'), bookmark('a')])
+    with pytest.raises(IntegrityError):
+        repo.add_one(bookmark('d', id=1))
+    # nothing of a failed insert is kept
+    assert len(repo.table) == 2
+
+    assert repo.update(Bookmark(id=2, title='a', url=None, notes=None, date_added=None, date_edited=None)) == ('Error', 400)
+    # swapping titles in one go is fine
+    assert repo.update_many([
+        Bookmark(id=1, title='b', url=None, notes=None, date_added=None, date_edited=None),
+        Bookmark(id=2, title='a', url=None, notes=None, date_added=None, date_edited=None),
+    ]) == [1, 1]
+    assert repo.get(1).title == 'b'
+
+
+def test_ids_are_not_reused():
+    repo = InMemoryRepository()
+    repo.add_many([bookmark('a'), bookmark('b')])
+    repo.delete_by_ids([2])
+    assert repo.add_one(bookmark('c')) == 3
+
+
+def test_bookmarks_are_copies():
+    repo = InMemoryRepository()
+    repo.add_one(bookmark('a'))
+    repo.get(1).title = 'changed'
+    assert repo.get(1).title == 'a'
+
+
+def test_ordered_scan_stops_at_the_limit():
+    table = BookmarkTable()
+    repo = InMemoryRepository(table)
+    repo.add_rows([{'title': str(i), 'url': 'http://x.com', 'notes': None,
+                    'date_added': datetime(2023, 1, 1), 'date_edited': datetime(2023, 1, 1)} for i in range(1000)])
+    ids = table.indexes['id'].ids(0, len(table))
+    # the scan is lazy, so a LIMIT query only reads what it returns
+    assert next(ids) == 1
+    assert [b.id for b in repo.find_all(select(Bookmark).order_by(Bookmark.id.desc()).limit(2))] == [1000, 999]
+
+
+def test_unsupported_queries_raise():
+    repo = InMemoryRepository()
+    with pytest.raises(NotImplementedError):
+        repo.find_all(select(Bookmark).where(func.lower(Bookmark.title) == 'a'))
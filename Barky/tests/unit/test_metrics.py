@@ -0,0 +1,47 @@
+from barkylib.adapters import metrics
+
+
+def test_statement_shape():
+    assert metrics.statement_shape("SELECT bookmarks.id FROM bookmarks WHERE bookmarks.id = ?") == "select bookmarks"
+    assert metrics.statement_shape("INSERT INTO bookmarks (title) VALUES (?)") == "insert bookmarks"
+    assert metrics.statement_shape("UPDATE bookmarks SET title=? WHERE bookmarks.id = ?") == "update bookmarks"
+    assert metrics.statement_shape('DELETE FROM "bookmarks" WHERE id IN (?)') == "delete bookmarks"
+    assert metrics.statement_shape("PRAGMA journal_mode") == "pragma"
+    assert metrics.statement_shape("   ") == "other"
+
+
+def test_render():
+    registry = metrics.Registry()
+    requests = registry.counter("test_requests_total", "Requests", ("path",))
+    latency = registry.histogram("test_latency_seconds", "Latency", buckets=(0.1, 1.0))
+    requests.inc('/a "quoted"')
+    requests.inc('/a "quoted"', amount=2)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5.0)
+    registry.add_collector(lambda: [("test_size", "gauge", "Size", [({}, 3)])])
+
+    text = registry.render()
+
+    assert "# TYPE test_requests_total counter" in text
+    assert 'test_requests_total{path="/a \\"quoted\\""} 3' in text
+    assert 'test_latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{le="+Inf"} 3' in text
+    assert "test_latency_seconds_sum 5.55" in text
+    assert "test_latency_seconds_count 3" in text
+    assert "# TYPE test_size gauge\ntest_size 3" in text
+
+
+def test_registering_twice_returns_the_same_metric():
+    registry = metrics.Registry()
+    assert registry.counter("test_total", "Test") is registry.counter("test_total", "Test")
+
+
+def test_stats_collector():
+    collect = metrics.stats_collector("test_cache", lambda: {"hits": 2, "size": 5, "name": "x"}, "Cache", counters=("hits",))
+
+    assert list(collect()) == [
+        ("test_cache_hits_total", "counter", "Cache: hits", [({}, 2)]),
+        ("test_cache_size", "gauge", "Cache: size", [({}, 5)]),
+    ]
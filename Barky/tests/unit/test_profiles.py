@@ -0,0 +1,74 @@
+import time
+
+import pytest
+from barkylib.adapters import profiles
+
+
+def test_tokens():
+    token = profiles.sign_token("secret", "sampling", ttl=60, now=1000)
+
+    assert profiles.verify_token("secret", token, now=1000) == "sampling"
+    assert profiles.verify_token("secret", token, now=1061) is None
+    assert profiles.verify_token("other", token, now=1000) is None
+    assert profiles.verify_token("secret", token.replace("sampling", "cprofile"), now=1000) is None
+    assert profiles.verify_token(None, token, now=1000) is None
+    assert profiles.verify_token("secret", "junk", now=1000) is None
+    with pytest.raises(ValueError):
+        profiles.sign_token("secret", "perf")
+
+
+def busy():
+    total = 0
+    deadline = time.perf_counter() + 0.03
+    while time.perf_counter() < deadline:
+        total += sum(range(100))
+    return total
+
+
+def test_cprofile():
+    profiling = profiles.RequestProfiling(secret="secret")
+    mode = profiling.choose(profiles.sign_token("secret", "cprofile"))
+    started = profiling.start(mode, "request-1")
+    busy()
+    profile = profiling.finish(started, "GET", "/api/all", "all", 200)
+
+    assert profile.id == "request-1"
+    assert profile.filename == "request-1.prof"
+    assert "busy" in profile.text()
+    assert profiling.store.get("request-1") is profile
+
+
+def test_sampling_profiler():
+    profiling = profiles.RequestProfiling(secret="secret", sample_rate=1.0)
+    started = profiling.start(profiling.choose(), "../../etc/passwd")
+    busy()
+    profile = profiling.finish(started, "GET", "/api/all")
+
+    # ids that can't be file names are replaced
+    assert profile.id != "../../etc/passwd"
+    assert profile.mode == "sampling"
+    assert "test_profiles:busy" in profile.text()
+
+
+def test_store_keeps_the_latest(tmp_path):
+    store = profiles.ProfileStore(keep=2, directory=str(tmp_path))
+    for id in ("a", "b", "c"):
+        store.save(profiles.Profile(id, "sampling", "GET", "/", None, 200, 0.1, None, b"x 1\n"))
+
+    assert [profile.id for profile in store.recent()] == ["c", "b"]
+    assert store.get("a") is None
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a.folded", "b.folded", "c.folded"]
+
+
+def test_nothing_is_profiled_by_default():
+    profiling = profiles.RequestProfiling(secret="secret")
+    assert profiling.choose() is None
+    assert profiling.choose("forged.cprofile.token") is None
+
+
+def test_sampling_needs_a_way_to_read_the_profiles(tmp_path):
+    with pytest.raises(ValueError):
+        profiles.RequestProfiling(sample_rate=0.1)
+    # written to the directory, the admin endpoints stay shut
+    profiling = profiles.RequestProfiling(sample_rate=0.1, directory=str(tmp_path))
+    assert not profiling.allowed(None)
@@ -0,0 +1,60 @@
+import json
+
+from barkylib.adapters.publishers import InMemoryPublisher, Message, RedisPublisher
+
+
+class RecordingRedis:
+    """
+    Stands in for redis.Redis, keeps what each pipeline sent
+    """
+
+    def __init__(self):
+        self.executed = list()
+
+    def pipeline(self, transaction=True):
+        client = self
+
+        class Pipeline:
+            def __init__(self):
+                self.commands = list()
+
+            def publish(self, channel, body):
+                self.commands.append((channel, body))
+
+            def execute(self):
+                client.executed.append((transaction, self.commands))
+
+        return Pipeline()
+
+
+def messages():
+    return [
+        Message(1, "bookmark_added", '{"id":1,"title":"a"}'),
+        Message(2, "bookmark_deleted", '{"id":1}'),
+    ]
+
+
+def test_message_body_wraps_the_payload():
+    body = json.loads(messages()[0].body())
+    assert body == {"outbox_id": 1, "event": {"id": 1, "title": "a"}}
+    assert messages()[1].channel == "barky.bookmark_deleted"
+
+
+def test_redis_publisher_sends_a_batch_in_one_pipeline():
+    client = RecordingRedis()
+    RedisPublisher(client).publish_many(messages())
+
+    assert len(client.executed) == 1
+    transaction, commands = client.executed[0]
+    assert transaction is False
+    assert [channel for channel, _ in commands] == ["barky.bookmark_added", "barky.bookmark_deleted"]
+
+
+def test_in_memory_publisher_calls_the_subscribers_of_a_channel():
+    publisher = InMemoryPublisher()
+    received = list()
+    publisher.subscribe("barky.bookmark_added", received.append)
+    publisher.publish_many(messages())
+
+    assert received == messages()[:1]
+    assert publisher.messages == messages()
@@ -0,0 +1,63 @@
+import logging
+
+import pytest
+from barkylib.adapters import query_log
+
+
+def test_repeated_statements_are_reported():
+    recorder = query_log.StatementRecorder(repeat_limit=2)
+    for id in range(3):
+        recorder.record("SELECT * FROM bookmarks WHERE id = ?", (id,), 0.001, False)
+    recorder.record("SELECT count(*) FROM bookmarks", (), 0.001, False)
+    # batches repeat by design
+    for _ in range(5):
+        recorder.record("INSERT INTO bookmarks (title) VALUES (?)", [("a",), ("b",)], 0.001, True)
+        recorder.record("DELETE FROM bookmarks WHERE id IN (" + "?, " * 20 + "?)", tuple(range(21)), 0.001, False)
+
+    assert recorder.repeated() == {"SELECT * FROM bookmarks WHERE id = ?": 3}
+    assert len(recorder.statements) == 14
+
+
+def test_commits_are_counted():
+    recorder = query_log.StatementRecorder(repeat_limit=2)
+    recorder.commits = 3
+    assert recorder.repeated() == {"COMMIT": 3}
+
+
+def test_strict_raises(caplog):
+    recorder = query_log.StatementRecorder(repeat_limit=1)
+    recorder.record("UPDATE bookmarks SET title=? WHERE id = ?", ("a", 1), 0.001, False)
+    recorder.record("UPDATE bookmarks SET title=? WHERE id = ?", ("b", 2), 0.001, False)
+
+    with caplog.at_level(logging.WARNING, logger="barkylib.adapters.query_log"):
+        recorder.check(handler="edit")
+    assert "2 x update bookmarks: UPDATE bookmarks SET title=? WHERE id = ?" in caplog.text
+    assert "in edit" in caplog.text
+
+    recorder.strict = True
+    with pytest.raises(query_log.RepeatedStatementsError):
+        recorder.check()
+
+
+def test_slow_statements_are_logged(caplog):
+    recorder = query_log.StatementRecorder(slow_ms=10)
+    with caplog.at_level(logging.WARNING, logger="barkylib.adapters.query_log"):
+        recorder.record("SELECT * FROM bookmarks WHERE id = ?", (1,), 0.005, False)
+        recorder.record("SELECT * FROM bookmarks WHERE title = ?", ("slow",), 0.02, False)
+
+    assert len(caplog.records) == 1
+    assert "20.0 ms" in caplog.text
+    assert "WHERE title = ? ('slow',)" in caplog.text
+
+
+def test_commits_of_batches_are_not_counted():
+    recorder = query_log.StatementRecorder(repeat_limit=2)
+    for _ in range(12):
+        recorder.record("INSERT INTO bookmarks (title) VALUES (?)", [("a",), ("b",)], 0.001, True)
+        recorder.commit()
+    for id in range(3):
+        recorder.record("UPDATE bookmarks SET title=? WHERE id = ?", ("a", id), 0.001, False)
+        recorder.commit()
+
+    assert recorder.commits == 3
+    assert recorder.repeated()["COMMIT"] == 3